@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Times the heavy pages and API calls against synthetic conventions of several
+sizes (see penguicontrax/dataset.py), through the Flask test client, and
+records latency percentiles, SQL statements per request and peak memory.
+
+  python benchmarks/endpoints.py [--scales 0.1,1,10] [--requests 20] [--output results.json]
+  python benchmarks/endpoints.py --compare before.json after.json
+
+Every size gets a throwaway SQLite database built in a child process, and
+every endpoint is measured in a fresh child of its own, so each one starts
+from the same state and its peak memory isn't hidden by another's. The
+first request of each child is reported as cold, the rest make up the
+percentiles. The Flask page cache is cleared before every request so the
+work behind /report is measured; /report.csv is built once per dataset
+version, so its cold request is the build and the rest send the file.
+redis is used if it's running. Staff pages log in through /fakelogin with
+PC_FAKE_OID.
+"""
+
+import argparse, datetime, json, os, platform, resource, shutil, subprocess, sys, tempfile, time, traceback
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+os.environ['PC_FAKE_OID'] = 'benchmark-staff'
+os.environ['ARTIFACT_DIR'] = tempfile.mkdtemp()
+sys.path.insert(0, ROOT)
+
+import penguicontrax
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from sqlalchemy import event, literal, select, cast, String
+from penguicontrax import cache, migrations, import2013schedule, search
+from penguicontrax.audit import Audit
+from penguicontrax.dataset import generate_dataset
+from penguicontrax.user import User, rsvps
+
+# name, path ({convention} is the synthetic convention's url), staff login
+ENDPOINTS = [
+    ('api-submissions', '/api/submissions', False),
+    ('report-csv', '/report.csv', False),
+    ('report-xml', '/report', False),
+    ('logs', '/logs', True),
+    ('users', '/users', True),
+    ('convention-schedule', '/convention/{convention}/schedule', False),
+]
+PERCENTILES = [50, 90, 99]
+
+
+def in_child(function, *args):
+    """ Runs function in a forked process and returns its (JSON) result """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            result = {'result': function(*args)}
+        except Exception:
+            result = {'error': traceback.format_exc()}
+        with os.fdopen(write_end, 'w') as pipe:
+            json.dump(result, pipe)
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    result = json.loads(data) if data else {'error': 'child process died'}
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result['result']
+
+
+def use_database(path):
+    db.session.remove()
+    db.engine.dispose()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+
+
+def build_fixture(path, scale, seed):
+    """ A new database at path with a synthetic convention, a staff account
+        to log in as and an audit log entry for every RSVP
+    """
+    use_database(path)
+    db.create_all()
+    migrations.upgrade()
+    import2013schedule.setup_predefined()
+    search.search_backend()
+    convention_id, counts = generate_dataset(seed, scale)
+    db.session.execute(User.__table__.insert(), {'name': 'Benchmark Staff', 'account_name': 'BenchmarkStaff',
+                                                 'openid': os.environ['PC_FAKE_OID'], 'points': 5,
+                                                 'staff': True, 'superuser': True})
+    now = datetime.datetime(2015, 5, 1)
+    db.session.execute(Audit.__table__.insert().from_select(['user_id', 'log', 'time'], select([
+        rsvps.c.user_id, literal('RSVPed to {submissions: id=') + cast(rsvps.c.submission_id, String) + literal('}'),
+        literal(now)])))
+    db.session.commit()
+    counts['audit'] = counts['rsvps']
+    return {'convention': 'synthetic%d' % convention_id, 'rows': counts}
+
+
+def rss_kb():
+    """ The resident set size right now, in KB (Linux only, else 0) """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError):
+        return 0
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(percent / 100.0 * len(values) + 0.5)) - 1))]
+
+
+def measure(path, url, staff, requests, budget):
+    """ Requests url up to requests times (at least twice, and while budget
+        seconds last) and returns the timings
+    """
+    use_database(path)
+    # every endpoint starts without the report files built
+    shutil.rmtree(os.environ['ARTIFACT_DIR'], ignore_errors=True)
+    statements = []
+
+    def count(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    client = app.test_client()
+    if staff:
+        client.get('/fakelogin')
+    baseline = rss_kb()
+    latencies, queries = [], []
+    status = size = None
+    started = time.time()
+    while len(latencies) < requests and (len(latencies) < 2 or time.time() - started < budget):
+        cache.clear()
+        del statements[:]
+        start = time.time()
+        response = client.get(url)
+        data = response.data
+        latencies.append((time.time() - start) * 1000)
+        queries.append(len(statements))
+        status, size = response.status_code, len(data)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    warm = latencies[1:]
+    return {
+        'status': status,
+        'bytes': size,
+        'requests': len(latencies),
+        'latency_ms': dict([('cold', latencies[0]), ('mean', sum(warm) / len(warm)), ('max', max(warm))] +
+                           [('p%d' % p, percentile(warm, p)) for p in PERCENTILES]),
+        'queries': {'cold': queries[0], 'warm': percentile(queries[1:], 50)},
+        'peak_memory_kb': max(0, peak - baseline) if baseline else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    endpoints = [endpoint for endpoint in ENDPOINTS if not args.endpoints or endpoint[0] in args.endpoints]
+    report = {
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'redis': penguicontrax.conn is not None,
+        'seed': args.seed,
+        'results': [],
+    }
+    for scale in args.scales:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        try:
+            start = time.time()
+            fixture = in_child(build_fixture, path, scale, args.seed)
+            print >> sys.stderr, 'scale %s: built %d rows in %.1fs' % (
+                scale, sum(fixture['rows'].values()), time.time() - start)
+            for name, url, staff in endpoints:
+                url = url.format(convention=fixture['convention'])
+                result = in_child(measure, path, url, staff, args.requests, args.budget)
+                result.update({'scale': scale, 'endpoint': name, 'path': url, 'rows': fixture['rows']})
+                report['results'].append(result)
+                print >> sys.stderr, '  %-20s p50 %9.1fms  %5d queries  %7s KB' % (
+                    name, result['latency_ms']['p50'], result['queries']['warm'], result['peak_memory_kb'])
+        finally:
+            os.close(fd)
+            os.unlink(path)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print '%-20s %6s %12s %12s %7s %9s %9s' % ('endpoint', 'scale', 'p50 before', 'p50 after', 'ratio',
+                                              'queries', 'memory')
+    old = dict(((result['endpoint'], result['scale']), result) for result in before['results'])
+    for result in after['results']:
+        previous = old.get((result['endpoint'], result['scale']))
+        if previous is None:
+            continue
+        p50, old_p50 = result['latency_ms']['p50'], previous['latency_ms']['p50']
+        print '%-20s %6s %10.1fms %10.1fms %6.2fx %4d->%-4d %4s->%s' % (
+            result['endpoint'], result['scale'], old_p50, p50, p50 / old_p50 if old_p50 else 0,
+            previous['queries']['warm'], result['queries']['warm'],
+            previous['peak_memory_kb'], result['peak_memory_kb'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=lambda value: [float(scale) for scale in value.split(',')],
+                        default=[0.1, 1, 10], help='dataset sizes, relative to one convention')
+    parser.add_argument('--requests', type=int, default=20, help='requests per endpoint and size')
+    parser.add_argument('--budget', type=float, default=60, help='seconds per endpoint and size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--endpoints', nargs='*', choices=[endpoint[0] for endpoint in ENDPOINTS])
+    parser.add_argument('--output', help='file to write the JSON results to, instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two results files')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        db.session.remove()
+        shutil.rmtree(os.environ['ARTIFACT_DIR'], ignore_errors=True)
+        os.close(db_fd)
+        os.unlink(db_path)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Compares RSVP throughput of the old read-check-modify path (two commits per
+click) with penguicontrax.rsvp (one transaction), with sequential clicks and
+with clicks from several threads. After each run the points and RSVP counts
+are checked against the rsvps table.
+
+  python benchmarks/rsvp.py [users] [threads]
+
+A throwaway SQLite database is used; set DATABASE_URL to try PostgreSQL.
+"""
+
+import os, sys, tempfile, time, json, random, threading
+
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + db_path)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import penguicontrax
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import audit
+from penguicontrax.rsvp import add_rsvp
+from penguicontrax.submission import Submission, submission_dataset_changed
+from penguicontrax.user import User, rsvps
+
+POINTS = 5
+
+
+def legacy_rsvp(user, submission):
+    if user.points > 0:
+        if not submission in user.rsvped_to:
+            user.rsvped_to.append(submission)
+            user.points = user.points - 1
+            audit.audit_rsvp(user, submission)
+            submission_dataset_changed(submission.id)
+            db.session.add(user)
+            db.session.commit()
+            return True
+    return False
+
+
+def engine_rsvp(user, submission):
+    return add_rsvp(user, submission)
+
+
+def build_dataset(users, submissions):
+    db.session.execute(rsvps.delete())
+    db.session.execute(User.__table__.delete())
+    db.session.execute(Submission.__table__.delete())
+    db.session.commit()
+    for index in range(submissions):
+        submission = Submission()
+        submission.title = 'Benchmark submission %d' % index
+        submission.followUpState = 0
+        db.session.add(submission)
+    for index in range(users):
+        user = User()
+        user.name = 'Benchmark User %d' % index
+        user.account_name = 'BenchmarkUser%d' % index
+        user.staff = False
+        db.session.add(user)
+    db.session.commit()
+    user_ids = [row[0] for row in db.session.query(User.id)]
+    submission_ids = [row[0] for row in db.session.query(Submission.id)]
+    db.session.remove()
+    return user_ids, submission_ids
+
+
+def run_clicks(function, clicks, errors):
+    for user_id, submission_id in clicks:
+        try:
+            function(User.query.get(user_id), Submission.query.get(submission_id))
+        except Exception as e:
+            db.session.rollback()
+            errors.append(type(e).__name__)
+    db.session.remove()
+
+
+def measure(name, function, users, threads):
+    user_ids, submission_ids = build_dataset(users, 50)
+    # every user clicks more often than they have points
+    clicks = [(user_id, random.choice(submission_ids)) for user_id in user_ids for _ in range(POINTS + 2)]
+    random.shuffle(clicks)
+    errors = []
+    workers = [threading.Thread(target=run_clicks, args=(function, clicks[index::threads], errors))
+               for index in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    overdrawn = 0
+    for user in User.query:
+        rsvped = db.session.query(rsvps).filter(rsvps.c.user_id == user.id).count()
+        if user.points != POINTS - rsvped or user.points < 0:
+            overdrawn += 1
+    db.session.remove()
+    return {
+        'case': name,
+        'threads': threads,
+        'clicks': len(clicks),
+        'clicks_per_second': len(clicks) / elapsed,
+        'errors': len(errors),
+        'inconsistent_users': overdrawn
+    }
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    results = []
+    for thread_count in [1, threads]:
+        results.append(measure('legacy', legacy_rsvp, users, thread_count))
+        results.append(measure('engine', engine_rsvp, users, thread_count))
+    print json.dumps({'users': users, 'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        db.session.remove()
+        os.close(db_fd)
+        os.unlink(db_path)
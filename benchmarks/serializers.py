@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Compares the old dump_table (getattr per column per ORM object) with the
+compiled serializers reading Core rows, for JSON, XML and CSV output.
+
+  python benchmarks/serializers.py [rows ...]
+
+Defaults to 10000 and 100000 submissions. A throwaway SQLite database is used.
+"""
+
+import os, sys, tempfile, time, json, datetime
+import xml.etree.ElementTree as ET
+
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import penguicontrax
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.api import DateEncoder
+from penguicontrax.serializers import get_serializer
+from penguicontrax.submission import Submission
+
+
+def legacy_dump_table(elements, table):
+    return [dict((col, getattr(element, col)) for col in table.columns.keys()) for element in elements]
+
+
+def legacy_dump_table_xml(elements, table, parent_node, collection_name, element_name):
+    collection = ET.SubElement(parent_node, collection_name)
+    for element in elements:
+        element_node = ET.SubElement(collection, element_name)
+        element_dict = dict((col, getattr(element, col)) for col in table.columns.keys())
+        for key, value in element_dict.iteritems():
+            ET.SubElement(element_node, str(key)).text = unicode(value)
+    return collection
+
+
+def build_dataset(count):
+    db.session.execute(Submission.__table__.delete())
+    now = datetime.datetime.now()
+    rows = [{'title': 'Benchmark submission %d' % index,
+             'description': 'A description of benchmark submission %d. ' % index * 5,
+             'eventType': 'talk',
+             'followUpState': index % 3,
+             'duration': 1,
+             'setupTime': 0,
+             'repetition': 0,
+             'submitted_dt': now} for index in range(count)]
+    for start in range(0, count, 10000):
+        db.session.execute(Submission.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+
+
+def timed(function):
+    db.session.expunge_all()
+    start = time.time()
+    function()
+    return (time.time() - start) * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    table = Submission.__table__
+    serializer = get_serializer(table)
+    results = []
+    for count in sizes:
+        build_dataset(count)
+        cases = [
+            ('json legacy', lambda: json.dumps(legacy_dump_table(Submission.query.all(), table), cls=DateEncoder)),
+            ('json compiled', lambda: ''.join(serializer.json(serializer.execute()))),
+            ('xml legacy', lambda: ET.tostring(legacy_dump_table_xml(Submission.query.all(), table,
+                                                                     ET.Element('root'), 'submissions', 'submission'))),
+            ('xml compiled', lambda: ET.tostring(serializer.xml(serializer.execute(),
+                                                                ET.Element('root'), 'submissions', 'submission'))),
+            ('csv compiled', lambda: ''.join(serializer.csv(serializer.execute()))),
+        ]
+        for name, function in cases:
+            results.append({'rows': count, 'case': name, 'ms': timed(function)})
+    print json.dumps(results, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        db.session.remove()
+        os.close(db_fd)
+        os.unlink(db_path)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Compares bytes sent and latency of /api/submissions for the uncompressed
+payload, the precompressed encodings and ETag revalidation.
+
+  REDISTOGO_URL=redis://localhost:6379 python benchmarks/submissionencoding.py [submissions] [requests]
+
+The cached encodings need a redis server; without one only the uncached
+fallback is measured. A throwaway SQLite database is used.
+"""
+
+import os, sys, tempfile, time, json
+
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import penguicontrax
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.submission import Submission, submission_dataset_changed
+from penguicontrax.tag import Tag
+from penguicontrax.user import User, Presenter
+
+
+def build_dataset(count):
+    tags = [Tag('benchmark-tag-%d' % index, 'Benchmark tag %d' % index, False) for index in range(20)]
+    users = []
+    for index in range(count):
+        user = User()
+        user.name = 'Benchmark User %d' % index
+        user.account_name = 'BenchmarkUser%d' % index
+        user.email = '%d@benchmark.example' % index
+        users.append(user)
+        submission = Submission()
+        submission.title = 'Benchmark submission %d' % index
+        submission.description = 'A description of benchmark submission %d. ' % index * 5
+        submission.followUpState = index % 3
+        submission.eventType = 'talk'
+        submission.submitter = user
+        presenter = Presenter('Benchmark Presenter %d' % index)
+        presenter.user = user
+        submission.presenters.append(presenter)
+        submission.tags.extend([tags[index % 20], tags[(index * 7) % 20]])
+        submission.rsvped_by.extend(users[-5:])
+        db.session.add(submission)
+    db.session.commit()
+    submission_dataset_changed()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(name, requests, headers):
+    client = app.test_client()
+    client.get('/api/submissions', headers=headers)  # warm the cache
+    timings = []
+    for index in range(requests):
+        start = time.time()
+        response = client.get('/api/submissions', headers=headers)
+        timings.append((time.time() - start) * 1000)
+    return {
+        'case': name,
+        'status': response.status_code,
+        'encoding': response.headers.get('Content-Encoding', 'identity'),
+        'bytes': len(response.data),
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95)
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    build_dataset(count)
+    cases = [('uncompressed', {'Accept-Encoding': 'identity'})]
+    if penguicontrax.conn is not None:
+        etag = app.test_client().get('/api/submissions').headers.get('ETag')
+        cases.append(('gzip', {'Accept-Encoding': 'gzip'}))
+        from penguicontrax.api.functions import brotli
+        if brotli is not None:
+            cases.append(('brotli', {'Accept-Encoding': 'br'}))
+        cases.append(('revalidate', {'Accept-Encoding': 'gzip', 'If-None-Match': etag}))
+    else:
+        print 'No redis connection, only the uncached fallback is measured'
+    results = [measure(name, requests, headers) for name, headers in cases]
+    print json.dumps({'submissions': count, 'requests': requests, 'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        db.session.remove()
+        os.close(db_fd)
+        os.unlink(db_path)
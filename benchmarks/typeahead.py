@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Compares the old LIKE '%q%' search behind /api/users with the in-memory
+typeahead index, timing the queries typed into the presenter box.
+
+  python benchmarks/typeahead.py [users]
+
+Defaults to 50000 users. A throwaway SQLite database is used.
+"""
+
+import os, sys, tempfile, time, json, random
+
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import penguicontrax
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from sqlalchemy import or_
+from penguicontrax.typeahead import users_index
+from penguicontrax.user import User
+
+FIRST = ['Alice', 'Bob', 'Carol', 'Dan', 'Erin', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy',
+         'Mallory', 'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil', 'Trent', 'Victor', 'Walter']
+LAST = ['Smith', 'Jones', 'Brown', 'Taylor', 'Wilson', 'Davies', 'Evans', 'Thomas', 'Roberts',
+        'Johnson', 'Walker', 'Wright', 'Robinson', 'Thompson', 'White', 'Hughes', 'Edwards']
+QUERIES = ['al', 'ali', 'alice', 'alice s', 'smi', 'smith', 'son', 'obert', 'user123', 'zz']
+
+
+def build_dataset(users):
+    random.seed(users)
+    rows = []
+    for index in range(users):
+        first, last = random.choice(FIRST), random.choice(LAST)
+        rows.append({'name': '%s %s' % (first, last),
+                     'account_name': 'user%d' % index,
+                     'email': '%s.%s%d@example.com' % (first.lower(), last.lower(), index)})
+    db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+
+
+def legacy_lookup(q):
+    search_string = '%' + q + '%'
+    return [dict(id=user.id, name=user.name, email=user.email) for user in User.query.filter(
+        or_(User.name.like(search_string), User.email.like(search_string), User.account_name.like(search_string)))]
+
+
+def timed(function, q, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        count = len(function(q))
+        times.append(time.time() - start)
+    times.sort()
+    return {'median_ms': times[len(times) // 2] * 1000, 'max_ms': times[-1] * 1000, 'rows': count}
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    build_dataset(users)
+    start = time.time()
+    users_index.refresh()
+    build = time.time() - start
+    results = []
+    for q in QUERIES:
+        results.append({'q': q,
+                        'legacy': timed(legacy_lookup, q, 3),
+                        'index': timed(users_index.lookup, q, 200)})
+    print json.dumps({'users': users, 'index_build_seconds': build, 'results': results}, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        db.session.remove()
+        os.close(db_fd)
+        os.unlink(db_path)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Compares building the /report and schedule XML as an ElementTree (as they
+were) with streaming them through serializers.XMLWriter, for time and peak
+memory.
+
+  python benchmarks/xmlexport.py [rows ...]
+
+Defaults to 10000 and 100000 submissions (and as many scheduled events).
+The old schedule export had only the titles, so the schedule cases compare
+that with the whole schedule book.
+Every case runs in a forked child, so its peak memory is its own; the
+streamed documents are read chunk by chunk like a response would be. A
+throwaway SQLite database is used.
+"""
+
+import os, sys, tempfile, time, json, datetime, resource, traceback
+import xml.etree.ElementTree as ET
+
+db_fd, db_path = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import penguicontrax
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import report_xml
+from penguicontrax.event import Convention, Events, create_schedule_XML
+from penguicontrax.serializers import get_serializer, buffered
+from penguicontrax.submission import Submission, SubmissionToTags
+from penguicontrax.tag import Tag
+
+
+def legacy_report():
+    root = ET.Element('penguicontrax')
+    ET.SubElement(root, 'generated').text = str(datetime.datetime.now())
+    for table, collection_name, element_name in [(Submission.__table__, 'submissions', 'submission'),
+                                                 (Tag.__table__, 'tags', 'tag'),
+                                                 (SubmissionToTags, 'SubmissionToTags', 'SubmissionToTag')]:
+        serializer = get_serializer(table)
+        serializer.xml(serializer.execute(), root, collection_name, element_name)
+    return ET.tostring(root, encoding='utf-8')
+
+
+def legacy_indent(elem, level=0):
+    i = "\n" + level*"  "
+    if len(elem):
+        if not elem.text or not elem.text.strip():
+            elem.text = i + "  "
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+        for elem in elem:
+            legacy_indent(elem, level+1)
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+    else:
+        if level and (not elem.tail or not elem.tail.strip()):
+            elem.tail = i
+
+
+def legacy_schedule(convention_id):
+    root = ET.Element('events')
+    root.attrib['xmlns:xsi'] = 'http://www.w3.org/2001/XMLSchema-instance'
+    document_elem = ET.SubElement(root, 'document')
+    for event in Events.query.filter_by(convention_id=convention_id).all():
+        event_elem = ET.SubElement(document_elem, 'event')
+        title_elem = ET.SubElement(event_elem, 'title')
+        title_elem.text = event.title
+    legacy_indent(root)
+    return '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + ET.tostring(root, encoding='utf-8')
+
+
+def build_dataset(count):
+    for table in [SubmissionToTags, Submission.__table__, Events.__table__]:
+        db.session.execute(table.delete())
+    tags = db.session.query(Tag.id).all()
+    convention = Convention.query.first()
+    if convention is None:
+        convention = Convention()
+        convention.name = convention.url = 'benchmark'
+        db.session.add(convention)
+        db.session.flush()
+    now = datetime.datetime.now()
+    start_dt = datetime.datetime(now.year, now.month, now.day)
+    for start in range(0, count, 10000):
+        indexes = range(start, min(count, start + 10000))
+        db.session.execute(Submission.__table__.insert(), [{
+            'id': index + 1,
+            'title': 'Benchmark submission %d' % index,
+            'description': 'A description of benchmark submission %d & <more>. ' % index * 5,
+            'eventType': 'talk', 'followUpState': index % 3, 'duration': 1, 'setupTime': 0, 'repetition': 0,
+            'submitted_dt': now} for index in indexes])
+        db.session.execute(SubmissionToTags.insert(), [{'submission_id': index + 1, 'tag_id': tags[index % len(tags)][0]}
+                                                      for index in indexes])
+        db.session.execute(Events.__table__.insert(), [{'title': 'Benchmark event %d' % index,
+                                                        'start_dt': start_dt + datetime.timedelta(hours=index % 48),
+                                                        'duration': 4, 'convention_id': convention.id}
+                                                       for index in indexes])
+    db.session.commit()
+    return convention.id
+
+
+def rss_kb():
+    """ The resident set size right now, in KB (Linux only, else 0) """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError):
+        return 0
+
+
+def measure(function):
+    """ Runs function in a forked child; returns its time, output size and
+        peak memory above what the child started with
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            db.session.remove()
+            db.engine.dispose()
+            baseline = rss_kb()
+            start = time.time()
+            with app.test_request_context():
+                size = function()
+            elapsed = (time.time() - start) * 1000
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result = {'ms': elapsed, 'bytes': size, 'peak_memory_kb': max(0, peak - baseline) if baseline else None}
+        except Exception:
+            result = {'error': traceback.format_exc()}
+        with os.fdopen(write_end, 'w') as pipe:
+            json.dump(result, pipe)
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    result = json.loads(data)
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+def streamed_size(pieces):
+    return sum(len(chunk) for chunk in buffered(pieces))
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    results = []
+    for count in sizes:
+        convention_id = build_dataset(count)
+        cases = [
+            ('report tree', lambda: len(legacy_report())),
+            ('report stream', lambda: streamed_size(report_xml())),
+            ('schedule tree', lambda: len(legacy_schedule(convention_id))),
+            ('schedule stream', lambda: streamed_size(create_schedule_XML(convention_id))),
+        ]
+        for name, function in cases:
+            result = measure(function)
+            result.update({'rows': count, 'case': name})
+            results.append(result)
+            print >> sys.stderr, '%7d %-16s %9.1fms %11d bytes %8s KB' % (
+                count, name, result['ms'], result['bytes'], result['peak_memory_kb'])
+    print json.dumps(results, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        db.session.remove()
+        os.close(db_fd)
+        os.unlink(db_path)
@@ -7,11 +7,13 @@ from flask.ext.mail import Mail
 import xml.etree.ElementTree as ET
 import json, redis
 from constants import constants
+from caching import namespaced_key
 from flask.ext.assets import Environment, Bundle
 import os
 import functools
 import csv
 import collections
+from serializers import get_serializer, XMLWriter, buffered, counted
 
 
 app = Flask(__name__)
@@ -31,13 +33,8 @@ mail = Mail(app)
 if constants.DEBUG != True:
     try:
         conn = redis.from_url(constants.REDIS_URL)
-        conn.incr('REDIS_CONNECTION_COUNT')
-        dataset_ver = conn.get('SUBMISSION_DATASET_VERSION')
-        conn.flushall()
-        if dataset_ver is None:
-            conn.set('SUBMISSION_DATASET_VERSION', 0)
-        else:
-            conn.set('SUBMISSION_DATASET_VERSION', int(dataset_ver) + 1)
+        # the cache is kept across restarts; rundeploy.py invalidates it
+        conn.incr(namespaced_key('REDIS_CONNECTION_COUNT'))
     except Exception as e:
         conn = None
         pass
@@ -70,13 +67,8 @@ def uncacheable_response(fun):
     return wrapped
 
 def dump_table_xml(elements, table, parent_node, collection_name, element_name):
-    collection = ET.SubElement(parent_node, collection_name)
-    for element in elements:
-        element_node = ET.SubElement(collection, element_name)
-        element_dict = dict((col, getattr(element, col)) for col in table.columns.keys())
-        for key, value in element_dict.iteritems():
-            ET.SubElement(element_node, str(key)).text = unicode(value)
-    return collection
+    serializer = get_serializer(table)
+    return serializer.xml(serializer.from_objects(elements), parent_node, collection_name, element_name)
 
 """
     @elements is a result set from sqlalchemy
@@ -84,8 +76,8 @@ def dump_table_xml(elements, table, parent_node, collection_name, element_name):
     returns a list of dicts
 """
 def dump_table(elements, table):
-    all = [ dict( (col, getattr(element, col)) for col in table.columns.keys()) for element in elements ]
-    return all
+    serializer = get_serializer(table)
+    return list(serializer.dicts(serializer.from_objects(elements)))
 
 """
     @elements is a result set from sqlalchemy
@@ -93,16 +85,24 @@ def dump_table(elements, table):
     @returns a string of serialized list of dicts
 """
 def dump_table_json(elements, table):
-    return json.dumps(dump_table(elements,table))
+    serializer = get_serializer(table)
+    return ''.join(serializer.json(serializer.from_objects(elements)))
 
-from flask import render_template, g, url_for, redirect, Response, make_response
+from flask import render_template, g, url_for, redirect, Response, make_response, stream_with_context
 from submission import Submission, submission_dataset_ver, Track
-from tag import Tag
+from tag import Tag, tag_names
 from user import Login
 import import2013schedule
 import datetime, audit
 from event import Events, Rooms, RoomGroups, Convention
 import api
+import search
+import migrations
+import perf
+import metrics
+import artifacts
+import ical
+import reports
 
 def init():
     app.secret_key = constants.SESSION_SECRET_KEY
@@ -114,8 +114,14 @@ def init():
         print e
         pass
 
+    # brings databases made by older versions up to the models
+    migrations.upgrade()
+
     if len(Track.query.all()) == 0:
         import2013schedule.setup_predefined()
+
+    # creates the full text search index (and fills it) on a new database
+    search.search_backend()
 '''
     if len(Submission.query.all()) == 0 and len(Events.query.all()) == 0:
         print 'Importing 2015 schedule into submissions'
@@ -127,7 +133,7 @@ def init():
 @app.route('/')
 @uncacheable_response
 def index():
-    tags = [tag.name for tag in Tag.query.all()]
+    tags = tag_names()
     resp = make_response(render_template('index.html', user=g.user, showhidden=False, tags=tags))
     resp.set_cookie('submission_ver', str(submission_dataset_ver()))
     return resp
@@ -141,33 +147,58 @@ def hidden():
 def help():
     return render_template('help.html', user=g.user)
 
-@app.route('/report')
-@uncacheable_response
-@cache.cached(timeout=900)
-def report():
-    root = ET.Element('penguicontrax')
-    ET.SubElement(root, 'generated').text = str(datetime.datetime.now())
-    dump_table_xml(Submission.query.all(), Submission.__table__, root, 'submissions', 'submission')
-    dump_table_xml(Tag.query.all(), Tag.__table__, root, 'tags', 'tag')
+def report_xml(progress=None):
+    """ Yields the /report document as the rows are read, calling
+        progress() for each of them if given
+    """
     from submission import SubmissionToTags
-    dump_table_xml(db.session.query(SubmissionToTags).all(), SubmissionToTags, root, 'SubmissionToTags', 'SubmissionToTag')
-    return Response(ET.tostring(root, encoding='utf-8'), mimetype='text/xml')
-
+    writer = XMLWriter()
+    yield writer.start('penguicontrax')
+    yield writer.element('generated', str(datetime.datetime.now()))
+    for table, collection_name, element_name in [(Submission.__table__, 'submissions', 'submission'),
+                                                 (Tag.__table__, 'tags', 'tag'),
+                                                 (SubmissionToTags, 'SubmissionToTags', 'SubmissionToTag')]:
+        serializer = get_serializer(table)
+        rows = serializer.execute()
+        if progress is not None:
+            rows = counted(rows, progress)
+        for piece in serializer.xml_stream(rows, writer, collection_name, element_name):
+            yield piece
+    yield writer.end()
 
-@app.route('/report.csv')
+@app.route('/report')
 @uncacheable_response
-@cache.cached(timeout=900)
-def reportcsv():
-    # helper to format csv lines
-    class Echo(object):
-        """ An object that implements a writable file object
-            It returns the data that was written
-            to help implement a streaming csv writer
-        """
-        def write(self, value):
-            return value
-    writer = csv.writer(Echo())   # writer.writerow will now return the formatted line
-
+def report():
+    return Response(stream_with_context(buffered(report_xml())), mimetype='text/xml')
+
+
+# submissions loaded per query for the reports
+REPORT_BATCH_SIZE = 500
+
+def report_submissions():
+    """ Yields every submission in id order with its submitter, track and
+        presenters, loaded REPORT_BATCH_SIZE at a time so only one batch of
+        ORM objects is alive while a report is written
+    """
+    from sqlalchemy.orm import joinedload, subqueryload
+    last_id = None
+    while 1:
+        query = Submission.query.options(joinedload(Submission.submitter), joinedload(Submission.track),
+                                         subqueryload(Submission.presenters))
+        if last_id is not None:
+            query = query.filter(Submission.id > last_id)
+        batch = query.order_by(Submission.id).limit(REPORT_BATCH_SIZE).all()
+        for submission in batch:
+            yield submission
+        if len(batch) < REPORT_BATCH_SIZE:
+            return
+        last_id = batch[-1].id
+
+
+def write_report_csv(f, progress=None):
+    """ Writes every submission to f as CSV, row by row, calling
+        progress() for each if given
+    """
     # helpers to fetch data from the object
     def default(data, default=u''):
         """ Replicates that jinja2 default filter
@@ -190,17 +221,21 @@ def reportcsv():
     schema['Repetition'] = lambda s: unicode(s.repetition)
     schema['Time request'] = lambda s: default(s.timeRequest)
     schema['Facility request'] = lambda s: default(s.facilityRequest)
-    schema['Presenting submitter'] = lambda s: unicode(s.submitter in [p.user for p in s.presenters])
+    # compares ids so the presenters' users needn't be loaded
+    schema['Presenting submitter'] = lambda s: unicode(s.submitter_id in [p.user_id for p in s.presenters])
     schema['Presenters'] = lambda s: ','.join([p.name for p in s.presenters])
-    # generate the table
-    def generate_data_rows(data):
-        yield list(schema.keys())
-        for s in data:
-            yield [column(s).encode('utf-8') for column in schema.values()]
-    # convert the table to csv
-    rows_iterator = (writer.writerow(row) for row in generate_data_rows(Submission.query))
-    output = list(rows_iterator)  # iterators break the cache middleware
-    return Response(output, mimetype='text/csv')
+    writer = csv.writer(f)
+    writer.writerow(list(schema.keys()))
+    submissions = report_submissions()
+    if progress is not None:
+        submissions = counted(submissions, progress)
+    for s in submissions:
+        writer.writerow([column(s).encode('utf-8') for column in schema.values()])
+
+
+@app.route('/report.csv')
+def reportcsv():
+    return artifacts.artifact_response('report.csv', submission_dataset_ver(), 'text/csv', write_report_csv)
 
 
 # TODO: this fake URL is used to run unittests. It should be disabled on a deploy
@@ -210,7 +245,10 @@ def fake_login():
     from flask import session
 
     if 'PC_FAKE_OID' in os.environ:
+        session.pop('user_id', None)
+        session.pop('user_key', None)
         session['openid'] = os.environ['PC_FAKE_OID']
+    return redirect('/')
 
 # static asset versioning and packaging
 assets = Environment(app)
@@ -1,6 +1,8 @@
 #from flask import Flask, request
+from flask import stream_with_context
 from flask.ext.restful import Api
 from penguicontrax import app
+from streaming import JSONStream
 
 #api modules
 import submissions
@@ -28,7 +30,11 @@ api = Api(app)
 @api.representation('application/json')
 def json_date(data, code, headers=None):
     #If it's a string, just return it as-is
-    resp = app.make_response(data if type(data) is str else json.dumps(data, cls=DateEncoder))
+    if isinstance(data, JSONStream):
+        #Encode row by row as the response is sent
+        resp = app.response_class(stream_with_context(data))
+    else:
+        resp = app.make_response(data if type(data) is str else json.dumps(data, cls=DateEncoder))
     resp.headers.extend(headers or {})
     resp.status_code = code
     return resp
@@ -41,6 +47,10 @@ api.add_resource(submissions.SubmissionAPI,
                  '/api/submission/<string:submission_id>/<string:noun>')
 api.add_resource(submissions.SubmissionsAPI,
                  '/api/submissions')
+api.add_resource(submissions.SubmissionChangesAPI,
+                 '/api/submissions/changes')
+api.add_resource(submissions.SubmissionIngestAPI,
+                 '/api/submissions/ingest')
 
 #tags
 api.add_resource(tags.TagsAPI,
@@ -19,3 +19,34 @@ def return_null_if_not_staff(func):
         return func(*args, **kwargs)
 
     return return_none
+
+
+# brotli is optional; without it payloads are only precompressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def encode_payload(payload):
+    """ Returns a dict of content-coding -> encoded bytes for a response body """
+    import zlib
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    encoded = {
+        'identity': payload,
+        'gzip': compressor.compress(payload) + compressor.flush()
+    }
+    if brotli is not None:
+        encoded['br'] = brotli.compress(payload)
+    return encoded
+
+
+def available_encodings():
+    return ['br', 'gzip', 'identity'] if brotli is not None else ['gzip', 'identity']
+
+
+def preferred_encoding(request):
+    """ Picks the best content-coding we can precompress for the request """
+    return request.accept_encodings.best_match(available_encodings(), default='identity')
@@ -0,0 +1,51 @@
+class JSONStream(object):
+    """ A JSON array that is encoded row by row while the response is sent
+        Return one from a resource (or wrap it in a Response with
+        stream_with_context) instead of a list to keep peak memory bounded
+        by chunk_size rather than by the number of rows. Values are encoded
+        with DateEncoder, like every other API response.
+        If on_complete is given, it is called with the whole document once
+        the stream is finished, unless the document grew past keep_bytes
+    """
+
+    def __init__(self, rows, chunk_size=64 * 1024, on_complete=None, keep_bytes=0):
+        self.rows = rows
+        self.chunk_size = chunk_size
+        self.on_complete = on_complete
+        self.keep_bytes = keep_bytes
+
+    def encode(self):
+        from penguicontrax.api import DateEncoder
+        encoder = DateEncoder()
+        buffer = ['[']
+        size = 1
+        separator = ''
+        for row in self.rows:
+            encoded = separator + encoder.encode(row)
+            # as json.dumps separates them
+            separator = ', '
+            buffer.append(encoded)
+            size += len(encoded)
+            if size >= self.chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        buffer.append(']')
+        yield ''.join(buffer)
+
+    def __iter__(self):
+        if self.on_complete is None:
+            for chunk in self.encode():
+                yield chunk
+            return
+        kept = []
+        kept_size = 0
+        for chunk in self.encode():
+            if kept is not None:
+                kept.append(chunk)
+                kept_size += len(chunk)
+                if kept_size > self.keep_bytes:
+                    kept = None
+            yield chunk
+        if kept is not None:
+            self.on_complete(''.join(kept))
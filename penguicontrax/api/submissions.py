@@ -1,16 +1,47 @@
 #flask libs
-import datetime, json
+import base64, datetime, hashlib, json, random
+import dateutil.parser
 
 from flask.ext.restful import Resource, reqparse
-from flask import g
-from sqlalchemy import or_
+from flask import g, request, stream_with_context
+from sqlalchemy import or_, and_, func, cast
+from sqlalchemy.orm import joinedload, subqueryload
 from redis import WatchError
 
 
 #global libs
-from penguicontrax import dump_table, db, audit, conn
-from penguicontrax.submission import Submission, submission_dataset_ver, submission_dataset_changed
-from functions import return_null_if_not_logged_in
+from penguicontrax import app, dump_table, db, conn, constants
+from penguicontrax.caching import local_cache, cache_key
+from penguicontrax.submission import Submission, submission_dataset_ver, submission_dataset_changed, \
+    submission_dataset_changes, SUBMISSION_ROW_VERSIONS, submission_fragments_key, \
+    submission_fragment_versions_key
+from penguicontrax.submission import Track
+from penguicontrax.submission.ingest import ingest_submissions, parse_rows, INGEST_FORMATS, INGEST_MAX_ROWS
+from penguicontrax.tag import Tag, normalize_tag_name
+from penguicontrax.user import User, Presenter
+from penguicontrax.rsvp import add_rsvp, remove_rsvp
+from penguicontrax import search, perf, metrics
+from functions import return_null_if_not_logged_in, return_null_if_not_staff, encode_payload, preferred_encoding, \
+    available_encodings
+from streaming import JSONStream
+
+# number of submissions serialized per query when rebuilding stale fragments
+FRAGMENT_BATCH_SIZE = 500
+
+def record_cache(hit):
+    """ Notes whether the full submission list came from a cache """
+    perf.record_cache('submissions', hit)
+    metrics.increment('submissions_cache_requests_total', result='hit' if hit else 'miss')
+
+
+# arguments that switch /api/submissions from the full list to a single page
+PAGE_ARGUMENTS = ['q', 'tag', 'track', 'eventtype', 'submitter', 'rsvped', 'sort', 'seed', 'limit', 'cursor']
+PAGE_SORTS = ['newest', 'rsvps', 'title', 'random', 'relevance']
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# seconds a page stays in redis; pages of old dataset versions just expire
+PAGE_CACHE_TIMEOUT = 3600
+UNSUBMITTED_DT = datetime.datetime(1970, 1, 1)    # sorts submissions without a date under ?sort=newest
 
 
 def expand_presenter(presenter):
@@ -29,7 +60,7 @@ def expand_presenter(presenter):
 
 class SubmissionAPI(Resource):
     def get(self, submission_id, noun=None):
-        submission = Submission.query.filter_by(id=int(submission_id)).all()
+        submission = SubmissionsAPI.eager_query(Submission.query.filter_by(id=int(submission_id))).all()
         ## Output only one element
         output = dump_table(submission, Submission.__table__).pop()
         output['tags'] = [{'id': t.name, 'desc': t.desc} for t in submission[0].tags]
@@ -52,17 +83,10 @@ class SubmissionAPI(Resource):
 
     def __rsvp_post(self, submission_id):
         #first check that the id exists
-        submission = Submission.query.filter_by(id=int(submission_id))
-        if g.user is not None and submission.count() > 0:
-            if g.user.points > 0:
-                if not submission.first() in g.user.rsvped_to:
-                    g.user.rsvped_to.append(submission.first())
-                    g.user.points = g.user.points - 1
-                    audit.audit_rsvp(g.user, submission.first())
-                    submission_dataset_changed()
-                    db.session.add(g.user)
-                    db.session.commit()
-                    return None, 200
+        submission = Submission.query.filter_by(id=int(submission_id)).first()
+        if g.user is not None and submission is not None:
+            if add_rsvp(g.user, submission):
+                return None, 200
             return None, 400
         return None, 404
 
@@ -77,15 +101,9 @@ class SubmissionAPI(Resource):
 
     def __rsvp_delete(self, submission_id):
         #first check that the id exists
-        submission = Submission.query.filter_by(id=int(submission_id))
-        if g.user is not None and submission.count() > 0:
-            if submission.first() in g.user.rsvped_to:
-                g.user.rsvped_to.remove(submission.first())
-                g.user.points = g.user.points + 1
-                audit.audit_rsvp(g.user, submission.first(), False)
-                submission_dataset_changed()
-                db.session.add(g.user)
-                db.session.commit()
+        submission = Submission.query.filter_by(id=int(submission_id)).first()
+        if g.user is not None and submission is not None:
+            if remove_rsvp(g.user, submission):
                 return None, 200
             return None, 400
         return None, 404
@@ -94,34 +112,316 @@ class SubmissionAPI(Resource):
 class SubmissionsAPI(Resource):
 
     @staticmethod
-    def query_db(parts):
-        orbits = [Submission.followUpState == i for i in parts]
-        query = Submission.query.filter(or_(*orbits))
-        submissions = query.all()
+    def eager_query(query):
+        """ Adds the loader options needed to serialize submissions
+            Every relationship touched by serialize is fetched in bulk, so the
+            number of queries issued is fixed no matter how many rows match
+        """
+        return query.options(
+            joinedload(Submission.submitter),
+            subqueryload(Submission.tags),
+            subqueryload(Submission.presenters).joinedload(Presenter.user),
+            subqueryload('rsvped_by'))
+
+    @staticmethod
+    def serialize(submissions):
+        """ Converts submissions loaded through eager_query to a list of dicts """
         output = dump_table(submissions, Submission.__table__)
+        user_map = ['name', 'email', 'id', 'special_tag', 'account_name', 'image_small']
+        now = datetime.datetime.now()
         for index, element in enumerate(output):
             element['tags'] = [{'id': t.name, 'desc': t.desc} for t in submissions[index].tags]
-            user_map = ['name', 'email', 'id', 'special_tag', 'account_name', 'image_small']
             element['presenters'] = [expand_presenter(_) for _ in
                                          submissions[index].presenters]
             element['rsvped_by'] = [dict([(field, getattr(_, field)) for field in user_map]) for _ in
                                     submissions[index].rsvped_by]
-            element['overdue'] = (datetime.datetime.now() - submissions[index].submitted_dt).days > 13
-            element['followUpDays'] = (datetime.datetime.now() - submissions[index].submitted_dt).days
+            if submissions[index].submitted_dt is not None:
+                element['overdue'] = (now - submissions[index].submitted_dt).days > 13
+                element['followUpDays'] = (now - submissions[index].submitted_dt).days
+            else:
+                element['overdue'] = False
+                element['followUpDays'] = None
             if not submissions[index].submitter is None:
                 element['submitter'] = dict([(field, getattr(submissions[index].submitter, field)) for field in user_map])
-        import random
-        random.shuffle(output)
         return output
 
+    @staticmethod
+    def iter_db(parts):
+        """ Yields the serialized submissions in the given states, shuffled
+            Rows are loaded FRAGMENT_BATCH_SIZE at a time so only one batch
+            of ORM objects is alive while the list is streamed
+        """
+        orbits = [Submission.followUpState == i for i in parts]
+        ids = [row[0] for row in db.session.query(Submission.id).filter(or_(*orbits))]
+        random.shuffle(ids)
+        for start in range(0, len(ids), FRAGMENT_BATCH_SIZE):
+            batch = ids[start:start + FRAGMENT_BATCH_SIZE]
+            query = SubmissionsAPI.eager_query(Submission.query.filter(Submission.id.in_(batch)))
+            elements = dict((element['id'], element) for element in SubmissionsAPI.serialize(query.all()))
+            for id in batch:
+                if id in elements:
+                    yield elements[id]
+
+    @staticmethod
+    def query_fragments(ids):
+        """ Returns a dict of id -> serialized JSON for the given submissions """
+        from penguicontrax.api import DateEncoder
+        fragments = {}
+        for start in range(0, len(ids), FRAGMENT_BATCH_SIZE):
+            batch = ids[start:start + FRAGMENT_BATCH_SIZE]
+            query = SubmissionsAPI.eager_query(Submission.query.filter(Submission.id.in_(batch)))
+            for element in SubmissionsAPI.serialize(query.all()):
+                fragments[element['id']] = json.dumps(element, cls=DateEncoder)
+        return fragments
+
+    @staticmethod
+    def cached_fragments(ids):
+        """ Returns the serialized JSON of the given submissions, in order
+            Only the fragments whose row version changed since they were
+            cached (or that were cached on an earlier day, since followUpDays
+            depends on the date) are read back from the database. Submissions
+            that no longer exist come back as None
+        """
+        if len(ids) == 0:
+            return []
+        with conn.pipeline(transaction=False) as pipe:
+            pipe.hmget(SUBMISSION_ROW_VERSIONS, ids)
+            pipe.hmget(submission_fragment_versions_key(), ids)
+            pipe.hmget(submission_fragments_key(), ids)
+            row_versions, fragment_versions, fragments = pipe.execute()
+        today = datetime.date.today().toordinal()
+        wanted_versions = ['%s:%d' % (version or 0, today) for version in row_versions]
+        stale = [ids[index] for index in range(len(ids))
+                 if fragments[index] is None or fragment_versions[index] != wanted_versions[index]]
+        rebuilt = SubmissionsAPI.query_fragments(stale) if len(stale) > 0 else {}
+        if len(rebuilt) > 0:
+            with conn.pipeline(transaction=False) as pipe:
+                pipe.hmset(submission_fragments_key(), rebuilt)
+                pipe.hmset(submission_fragment_versions_key(),
+                           dict((ids[index], wanted_versions[index]) for index in range(len(ids))
+                                if ids[index] in rebuilt))
+                pipe.execute()
+        stale = set(stale)
+        return [rebuilt.get(ids[index]) if ids[index] in stale else fragments[index]
+                for index in range(len(ids))]
+
+    @staticmethod
+    def assemble_fragments(parts):
+        """ Builds the serialized submission list out of per-submission fragments """
+        orbits = [Submission.followUpState == i for i in parts]
+        ids = [row[0] for row in db.session.query(Submission.id).filter(or_(*orbits))]
+        output = [fragment for fragment in SubmissionsAPI.cached_fragments(ids) if fragment is not None]
+        random.shuffle(output)
+        return '[' + ','.join(output) + ']'
+
+    @staticmethod
+    def payload_key(parts):
+        return cache_key('SUBMISSION_DATASET_CACHE_' + str(parts))
+
+    @staticmethod
+    def cached_payload(parts, encoding='identity'):
+        """ Returns (payload, encoding) for the serialized submission list
+            Every content-coding of the list is stored next to the JSON when
+            it is rebuilt, so a cached request only transfers the bytes it sends
+        """
+        with conn.pipeline() as pipe:
+            payload_key = SubmissionsAPI.payload_key(parts)
+            cache_version_key = payload_key + '_VERSION'
+            while 1:
+                try:
+                    pipe.watch(cache_version_key)
+                    current_cache_value = pipe.get(cache_version_key)
+                    current_version = submission_dataset_ver()
+                    hit = current_cache_value == current_version and not current_cache_value is None
+                    if hit:
+                        output = pipe.get(payload_key + '_' + encoding)
+                        if output is None:
+                            encoding = 'identity'
+                            output = pipe.get(payload_key + '_' + encoding)
+                    else:
+                        encoded = encode_payload(SubmissionsAPI.assemble_fragments(parts))
+                        pipe.multi()
+                        for key, value in encoded.items():
+                            pipe.set(payload_key + '_' + key, value)
+                        pipe.set(cache_version_key, current_version)
+                        pipe.execute()
+                        output = encoded[encoding]
+                    break
+                except WatchError:
+                    metrics.increment('watch_error_retries_total', operation='submissions_cache')
+                    continue
+        record_cache(hit)
+        return output, encoding
+
+    @staticmethod
+    def sort_key(sort, seed, matches=None):
+        """ Returns (expression, descending) used to order a page of submissions
+            Submission.id breaks ties in the same direction. relevance needs
+            the matches of the search, see search.ranked
+        """
+        if sort == 'relevance':
+            return matches.c.rank, True
+        elif sort == 'rsvps':
+            return func.coalesce(Submission.rsvp_count, 0), True
+        elif sort == 'title':
+            return func.coalesce(Submission.title, ''), False
+        elif sort == 'random':
+            # a seeded hash (squared modulo a prime to break up the linear
+            # order of ids) so a shuffle can be paged through
+            mixed = (cast(Submission.id, db.BigInteger) * 1103515245 + seed % 2147483647) % 2147483647
+            return (mixed * mixed) % 2147483647, False
+        # NULLs sort differently in every database, and can't be compared
+        # with a cursor, so submissions without a date come last
+        return func.coalesce(Submission.submitted_dt, UNSUBMITTED_DT), True
+
+    @staticmethod
+    def encode_cursor(key, id):
+        if hasattr(key, 'isoformat'):
+            key = key.isoformat()
+        return base64.urlsafe_b64encode(json.dumps([key, id]))
+
+    @staticmethod
+    def decode_cursor(cursor, sort):
+        key, id = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        if sort == 'newest':
+            key = dateutil.parser.parse(key)
+        return key, int(id)
+
+    @staticmethod
+    def page_ids(args, parts):
+        """ Returns (ids, next cursor) of one page of submissions matching the filters """
+        orbits = [Submission.followUpState == i for i in parts]
+        query = db.session.query(Submission.id).filter(or_(*orbits))
+        matches = None
+        if args['q'] is not None:
+            matches = search.ranked('submission', args['q'])
+            if matches is None:
+                return [], None
+            query = query.join(matches, matches.c.doc_id == Submission.id)
+        for name in args['tag'] or []:
+            query = query.filter(Submission.tags.any(Tag.name == normalize_tag_name(name)))
+        if args['track']:
+            query = query.filter(Submission.track.has(Track.name == args['track']))
+        if args['eventtype']:
+            query = query.filter(Submission.eventType == args['eventtype'])
+        if args['submitter'] is not None:
+            query = query.filter(Submission.submitter_id == args['submitter'])
+        if args['rsvped']:
+            query = query.filter(Submission.rsvped_by.any(User.id == g.user.id))
+
+        key, descending = SubmissionsAPI.sort_key(args['sort'], args['seed'], matches)
+        if args['cursor']:
+            last_key, last_id = SubmissionsAPI.decode_cursor(args['cursor'], args['sort'])
+            if descending:
+                query = query.filter(or_(key < last_key, and_(key == last_key, Submission.id < last_id)))
+            else:
+                query = query.filter(or_(key > last_key, and_(key == last_key, Submission.id > last_id)))
+        if descending:
+            query = query.order_by(key.desc(), Submission.id.desc())
+        else:
+            query = query.order_by(key.asc(), Submission.id.asc())
+        rows = query.add_columns(key).limit(args['limit'] + 1).all()
+        next_cursor = None
+        if len(rows) > args['limit']:
+            rows = rows[:args['limit']]
+            next_cursor = SubmissionsAPI.encode_cursor(rows[-1][1], rows[-1][0])
+        return [row[0] for row in rows], next_cursor
+
+    @staticmethod
+    def query_page(args, parts):
+        ids, next_cursor = SubmissionsAPI.page_ids(args, parts)
+        if conn is not None:
+            fragments = SubmissionsAPI.cached_fragments(ids)
+        else:
+            rebuilt = SubmissionsAPI.query_fragments(ids)
+            fragments = [rebuilt.get(id) for id in ids]
+        return '{"next": %s, "seed": %s, "submissions": [%s]}' % (
+            json.dumps(next_cursor), json.dumps(args['seed']),
+            ','.join(fragment for fragment in fragments if fragment is not None))
+
+    @staticmethod
+    def get_page(args, parts):
+        """ Returns one page of filtered, sorted submissions
+            Pages are cached under the dataset version, keyed by every
+            parameter (and the user, for ?rsvped=1), except for random
+            pages without a ?seed=, whose seed is new every time
+        """
+        if args['rsvped'] and g.user is None:
+            return "You must be logged in to perform this action.", 401
+        if args['sort'] not in PAGE_SORTS:
+            return 'Unknown sort order', 400
+        if args['sort'] == 'relevance' and args['q'] is None:
+            return 'Sorting by relevance needs a ?q= search', 400
+        cacheable = True
+        if args['sort'] == 'random' and args['seed'] is None:
+            args['seed'] = random.randint(0, 2147483647)
+            cacheable = False
+        args['limit'] = max(1, min(args['limit'] or PAGE_SIZE, MAX_PAGE_SIZE))
+        if args['cursor']:
+            try:
+                SubmissionsAPI.decode_cursor(args['cursor'], args['sort'])
+            except Exception as e:
+                return 'Invalid cursor', 400
+
+        private = bool(args['rsvped'])
+        params = sorted((name, value) for name, value in args.items() if name not in ('rsvped',))
+        params.append(('parts', parts))
+        params.append(('user', g.user.id if private else None))
+        headers = {"Cache-Control": "private, no-cache" if private else "public, no-cache"}
+        if not cacheable:
+            return app.response_class(SubmissionsAPI.query_page(args, parts), mimetype='application/json',
+                                      headers=headers)
+        etag = hashlib.sha1(json.dumps([params, submission_dataset_ver()])).hexdigest()
+        if etag in request.if_none_match:
+            response = app.response_class(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+
+        local_key = ('submission-page', etag)
+        output = local_cache.get(local_key)
+        if output is None:
+            page_key = cache_key('SUBMISSION_PAGE_CACHE_' + etag)
+            if conn is not None:
+                try:
+                    output = conn.get(page_key)
+                except Exception as e:
+                    pass
+            if output is None:
+                output = SubmissionsAPI.query_page(args, parts)
+                if conn is not None:
+                    try:
+                        conn.setex(page_key, output, PAGE_CACHE_TIMEOUT)
+                    except Exception as e:
+                        pass
+            local_cache.set(local_key, output)
+        response = app.response_class(output, mimetype='application/json', headers=headers)
+        response.set_etag(etag)
+        return response
 
     @staticmethod
     def get():
-        """ Returns a list of objects to represent users in the database
-            Pass a ?q=query to conduct a search by name and email
+        """ Returns the submissions in the given ?state= (0,1,2 by default)
+            Without other arguments the whole list is returned, shuffled.
+            Passing any of q (a full text search of titles, descriptions,
+            presenters and tags), tag (repeatable), track, eventtype,
+            submitter, rsvped=1, sort (newest, rsvps, title, relevance, the
+            default with q, or random with an optional seed), limit or
+            cursor returns one page instead, as
+            {"submissions": [...], "next": cursor, "seed": seed}; pass next
+            back as ?cursor= (with the same arguments) for the following page
         """
         parser = reqparse.RequestParser()
         parser.add_argument('state', type=str)
+        parser.add_argument('q', type=unicode)
+        parser.add_argument('tag', type=str, action='append')
+        parser.add_argument('track', type=str)
+        parser.add_argument('eventtype', type=str)
+        parser.add_argument('submitter', type=int)
+        parser.add_argument('rsvped', type=int)
+        parser.add_argument('sort', type=str)
+        parser.add_argument('seed', type=int)
+        parser.add_argument('limit', type=int)
+        parser.add_argument('cursor', type=str)
         args = parser.parse_args()
 
         
@@ -129,33 +429,135 @@ class SubmissionsAPI(Resource):
             parts = args['state'].split(',')
         else:
             parts = ['0','1','2']
-        
-        try:
-            with conn.pipeline() as pipe:
-                cache_key = 'SUBMISSION_DATASET_CACHE_' + str(parts)
-                cache_version_key = cache_key + '_VERSION'
-                while 1:
-                    try:
-                        pipe.watch(cache_version_key)
-                        current_cache_value = pipe.get(cache_version_key)
-                        current_version = submission_dataset_ver()
-                        if current_cache_value == current_version and not current_cache_value is None:
-                            output = pipe.get(cache_key)
-                        else:
-                            pipe.multi()
-                            output = SubmissionsAPI.query_db(parts)
-                            from penguicontrax.api import DateEncoder
-                            pipe.set(cache_key, json.dumps(output, cls=DateEncoder))
-                            pipe.set(cache_version_key, current_version)
-                            pipe.execute()
-                        break
-                    except WatchError:
-                        continue
-        except Exception as e:
-            output = SubmissionsAPI.query_db(parts)
+
+        if any(args[name] is not None for name in PAGE_ARGUMENTS):
+            args['sort'] = args['sort'] or ('relevance' if args['q'] is not None else 'newest')
+            return SubmissionsAPI.get_page(args, parts)
 
         expires = datetime.datetime.utcnow() + datetime.timedelta(days=1)
-        return output, 200, {
+        headers = {
             "Expires": expires.strftime("%a, %d %b %Y %H:%M:%S GMT"),
             "Cache-Control": "public, max-age=86400"
         }
+
+        # the ETag only depends on the dataset version and the content-coding,
+        # so revalidation is answered without reading the payload or touching
+        # the database
+        version = submission_dataset_ver()
+        etags = {}
+        if not version is None:
+            etags = dict((coding, 'submissions-%s-%s-%s' % ('.'.join(parts), version, coding))
+                         for coding in available_encodings())
+        matched = [etag for etag in etags.values() if etag in request.if_none_match]
+        if len(matched) > 0:
+            response = app.response_class(status=304, headers=headers)
+            response.set_etag(matched[0])
+            return response
+
+        encoding = preferred_encoding(request)
+        local_key = ('submissions', tuple(parts), encoding, version)
+        cached = local_cache.get(local_key)
+        if cached is not None:
+            output, encoding = cached
+            record_cache(True)
+        else:
+            try:
+                output, encoding = SubmissionsAPI.cached_payload(parts, encoding)
+            except Exception as e:
+                record_cache(False)
+                # without redis the list is encoded while it is sent, and the
+                # finished document is kept in the local cache if it's small
+                def keep(document):
+                    if version is None:
+                        return
+                    for name, payload in encode_payload(document).iteritems():
+                        local_cache.set(('submissions', tuple(parts), name, version), (payload, name))
+                output = JSONStream(SubmissionsAPI.iter_db(parts), on_complete=keep,
+                                    keep_bytes=constants.L1_CACHE_ENTRY_BYTES)
+                response = app.response_class(stream_with_context(output), mimetype='application/json',
+                                              headers=headers)
+                if not version is None:
+                    response.set_etag(etags['identity'])
+                response.vary.add('Accept-Encoding')
+                return response
+            if not version is None:
+                local_cache.set(local_key, (output, encoding))
+
+        response = app.response_class(output, mimetype='application/json', headers=headers)
+        if not version is None:
+            response.set_etag(etags[encoding])
+        response.vary.add('Accept-Encoding')
+        if encoding != 'identity':
+            response.content_encoding = encoding
+        return response
+
+
+class SubmissionChangesAPI(Resource):
+
+    @staticmethod
+    def get():
+        """ Returns the submissions changed since the dataset version ?since=
+            Changed submissions still matching ?state= are returned in upserts,
+            the ids of the rest in deletes. If the change log can't cover the
+            requested range resync is true and the client must refetch the
+            full list from /api/submissions
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument('since', type=int, required=True)
+        parser.add_argument('state', type=str)
+        args = parser.parse_args()
+
+        if args['state']:
+            parts = args['state'].split(',')
+        else:
+            parts = ['0','1','2']
+
+        try:
+            version, changed = submission_dataset_changes(args['since'])
+        except Exception as e:
+            version, changed = submission_dataset_ver(), None
+        # redis hands the version back as a string
+        version = int(version or 0)
+        if changed is None:
+            return {'version': version, 'resync': True, 'upserts': [], 'deletes': []}, 200
+
+        orbits = [Submission.followUpState == i for i in parts]
+        ids = []
+        for start in range(0, len(changed), FRAGMENT_BATCH_SIZE):
+            batch = changed[start:start + FRAGMENT_BATCH_SIZE]
+            ids.extend(row[0] for row in db.session.query(Submission.id).filter(
+                Submission.id.in_(batch)).filter(or_(*orbits)))
+        upserts = [fragment for fragment in SubmissionsAPI.cached_fragments(ids) if fragment is not None]
+        deletes = sorted(set(changed) - set(ids))
+        output = '{"version": %s, "resync": false, "deletes": %s, "upserts": [%s]}' % (
+            version, json.dumps(deletes), ','.join(upserts))
+        return output, 200, {
+            "Cache-Control": "no-cache"
+        }
+
+
+class SubmissionIngestAPI(Resource):
+
+    @staticmethod
+    @return_null_if_not_staff
+    def post():
+        """ Creates submissions in bulk from the request body, JSON Lines (one
+            object of /submitevent's fields per line) or CSV (a header row of
+            field names, ';' between the values of list fields) as chosen by
+            ?format= or the Content-Type. Valid rows are all created in one
+            transaction; the rest are reported by line in errors. The
+            submitters are emailed only with ?notify=1
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument('format', type=str)
+        parser.add_argument('notify', type=int, default=0)
+        args = parser.parse_args()
+        format = args['format'] or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+        if format not in INGEST_FORMATS:
+            return {'messages': ['format must be one of %s' % ', '.join(INGEST_FORMATS)]}, 400
+        rows = list(parse_rows(request.get_data().splitlines(True), format))
+        if len(rows) > INGEST_MAX_ROWS:
+            return {'messages': ['At most %d rows per request, split the batch or use runingest.py' %
+                                 INGEST_MAX_ROWS]}, 413
+        ids, errors = ingest_submissions(rows, g.user, args['notify'] == 1)
+        return {'created': ids, 'errors': errors}, 200
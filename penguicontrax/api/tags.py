@@ -2,29 +2,43 @@
 import datetime, json
 
 from flask.ext.restful import Resource, reqparse
-from flask import g
+from flask import g, request
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from redis import WatchError
 
 
 #global libs
-from penguicontrax import dump_table, db, audit, conn
-from penguicontrax.tag import Tag, create_tag, get_tag, get_user_tag
+from penguicontrax import app, dump_table, db, audit, conn
+from penguicontrax.tag import Tag, create_tag, get_tag, get_user_tag, normalize_tag_name, tag_cache
+from penguicontrax.submission import submission_dataset_changed
 from functions import return_null_if_not_logged_in, return_null_if_not_staff
 
 
+def tag_list_response(name, output):
+    """ Answers a GET of a tag list, built by output(rows) from the tag
+        cache, with an ETag of the tag version
+    """
+    version, rows = tag_cache.get()
+    etag = '%s-%s' % (name, version)
+    headers = {"Cache-Control": "public, no-cache"}
+    if etag in request.if_none_match:
+        response = app.response_class(status=304, headers=headers)
+    else:
+        response = app.response_class(json.dumps(output(rows)), mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    return response
+
+
 class TagsAPI(Resource):
     def get(self):
-        tags = Tag.query.filter(Tag.system==True).all()
-        output = [{'id': t.name, 'desc': t.desc} for t in tags]
-        return output, 200
+        return tag_list_response('tags', lambda rows: [{'id': name, 'desc': desc}
+                                                       for id, name, desc, system in rows if system])
 
 
 class UserTagsAPI(Resource):
     def get(self):
-        tags = Tag.query.filter(Tag.system==False).all()
-        output = [t.name for t in tags]
-        return output, 200
+        return tag_list_response('user-tags', lambda rows: [name for id, name, desc, system in rows if not system])
 
     @return_null_if_not_logged_in
     def post(self):
@@ -33,6 +47,12 @@ class UserTagsAPI(Resource):
         parser.add_argument('desc', type=str, default='')
         args = parser.parse_args()
         tag = create_tag(args['id'], args['desc'])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # managed to get created by someone else
+            db.session.rollback()
+            tag = get_tag(args['id'])
         output = {'id': tag.name, 'desc': tag.desc}
         return output
 
@@ -54,14 +74,15 @@ class UserTagAPI(Resource):
         tag = get_user_tag(name)
         if tag is None:
             return 'Invalid id', 404
-        dest_tag = get_user_tag(name)
-        if dest_tag is not None:
-            return 'Duplicate id', 400
-        tag.name = args['id']
+        if args['id'] is not None and normalize_tag_name(args['id']) != tag.name:
+            if get_tag(args['id']) is not None:
+                return 'Duplicate id', 400
+            tag.name = normalize_tag_name(args['id'])
         if args['desc'] is not None:
             tag.desc = args['desc']
         db.session.add(tag)
         db.session.commit()
+        submission_dataset_changed()
         output = {'id': tag.name, 'desc': tag.desc}
         return output
 
@@ -72,4 +93,5 @@ class UserTagAPI(Resource):
             return 'Invalid id', 404
         db.session.delete(tag)
         db.session.commit()
+        submission_dataset_changed()
         return 'Deleted', 200
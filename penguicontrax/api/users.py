@@ -1,7 +1,6 @@
 #flask libs
 from flask import Flask, request, g
 from flask.ext.restful import Resource, Api, reqparse
-from sqlalchemy import or_
 
 #global libs
 from sys import exit
@@ -9,8 +8,8 @@ import sys
 import os
 
 ## Import Local Libs
-from penguicontrax import dump_table
 from functions import return_null_if_not_logged_in
+from penguicontrax.typeahead import users_index, TYPEAHEAD_LIMIT, MAX_TYPEAHEAD_LIMIT
 from .. import db
 ##User = user.User
 from penguicontrax.user import User
@@ -20,29 +19,15 @@ class UsersAPI(Resource):
     @return_null_if_not_logged_in
     def get(self):
         """ Returns a list of objects to represent users in the database
-            Pass a ?q=query to conduct a search by name and email
+            Pass a ?q=query to conduct a search by name and email,
+            best matches first, and ?limit= for more than TYPEAHEAD_LIMIT
         """
         parser = reqparse.RequestParser()
-        parser.add_argument('q', type=str)
+        parser.add_argument('q', type=unicode)
+        parser.add_argument('limit', type=int, default=TYPEAHEAD_LIMIT)
         args = parser.parse_args()
-
-        output = User.query
-        if args['q']:
-            search_string = '%' + args['q'] + '%'
-            output = output.filter(
-                or_(
-                    User.name.like(search_string),
-                    User.email.like(search_string),
-                    User.account_name.like(search_string)
-                )
-            )
-        output = dump_table(output, User.__table__)
-        # fields to show in search results
-        fields = ['id', 'name', 'email']
-        return [
-            dict([(name, element[name]) for name in fields])
-            for element in output
-        ]
+        limit = max(1, min(args['limit'] or TYPEAHEAD_LIMIT, MAX_TYPEAHEAD_LIMIT))
+        return users_index.lookup(args['q'], limit)
 
 
 class UserAPI(Resource):
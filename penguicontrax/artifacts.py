@@ -0,0 +1,149 @@
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+from flask import request, send_file
+from penguicontrax import app, db, constants
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Reports built from the whole database (like /report.csv) are written to a
+# file once per dataset version and served from it. The files are shared by
+# every worker on the machine: one of them builds a new version while the
+# others wait for it, and the files of older versions are deleted, unless
+# they're kept to be expired by age (like the reports built for download,
+# see penguicontrax.reports). Clients revalidate with the version's ETag,
+# which is answered without reading it. The versions have to be the same in
+# every worker for that, so without redis, where each process counts its
+# own, every request builds the artifact afresh instead.
+
+
+def shared_versions():
+    """ Whether dataset versions come from redis, where every worker sees
+        the same ones
+    """
+    from penguicontrax import conn
+    if conn is None:
+        return False
+    try:
+        return conn.ping()
+    except Exception as e:
+        return False
+
+
+def artifact_key(name, version):
+    """ Changes with the version, the database and the format of the file """
+    key = u'%s|%s|%s|%d' % (name, db.engine.url, version, constants.CACHE_SCHEMA_VERSION)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def artifact_path(name, key):
+    return os.path.join(constants.ARTIFACT_DIR, '%s.%s' % (key, name))
+
+
+class BuildLock(object):
+    """ Held by the worker building an artifact; a no-op without fcntl """
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, type, value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def build_artifact(name, key, build, keep_old=False):
+    """ Returns the path of the artifact, calling build(file) to write it
+        unless it's already there, and deletes its older versions unless
+        keep_old
+    """
+    path = artifact_path(name, key)
+    if os.path.exists(path):
+        return path
+    if not os.path.isdir(constants.ARTIFACT_DIR):
+        try:
+            os.makedirs(constants.ARTIFACT_DIR)
+        except OSError as e:
+            # made by another worker in the meantime
+            if not os.path.isdir(constants.ARTIFACT_DIR):
+                raise
+    with BuildLock(artifact_path(name, 'build')):
+        if os.path.exists(path):
+            return path
+        fd, temporary = tempfile.mkstemp(dir=constants.ARTIFACT_DIR, prefix='.' + name)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                build(f)
+            os.rename(temporary, path)
+        except:
+            os.unlink(temporary)
+            raise
+        if not keep_old:
+            for old in glob.glob(artifact_path(name, '*')):
+                if old != path:
+                    try:
+                        os.unlink(old)
+                    except OSError as e:
+                        pass
+    return path
+
+
+def expire_artifacts(max_age):
+    """ Deletes the artifacts built more than max_age seconds ago """
+    cutoff = time.time() - max_age
+    # glob leaves out the temporary files, which start with a dot
+    for path in glob.glob(os.path.join(constants.ARTIFACT_DIR, '*')):
+        if path.endswith('.lock'):
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError as e:
+            pass
+
+
+def open_artifact(name, key, build):
+    """ Opens the artifact, building it again if a worker that built a newer
+        version deleted it between build_artifact and the open
+    """
+    try:
+        return open(build_artifact(name, key, build), 'rb')
+    except IOError as e:
+        return open(build_artifact(name, key, build), 'rb')
+
+
+def artifact_response(name, version, mimetype, build):
+    """ Sends the artifact name for the given dataset version, with its
+        Content-Length, a Last-Modified date and an ETag, and answers
+        conditional requests with 304
+    """
+    if not shared_versions():
+        f = tempfile.TemporaryFile()
+        build(f)
+        f.seek(0)
+        response = send_file(f, mimetype=mimetype, add_etags=False, cache_timeout=0)
+        response.cache_control.no_cache = True
+        return response
+    key = artifact_key(name, version)
+    if key in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        f = open_artifact(name, key, build)
+        stat = os.fstat(f.fileno())
+        response = send_file(f, mimetype=mimetype, add_etags=False, cache_timeout=0)
+        response.content_length = stat.st_size
+        response.last_modified = stat.st_mtime
+    response.cache_control.no_cache = True
+    response.set_etag(key)
+    return response.make_conditional(request)
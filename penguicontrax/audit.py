@@ -5,7 +5,7 @@ from datetime import datetime
 
 class Audit(db.Model):
     id = db.Column(db.Integer(), primary_key = True)
-    user_id = db.Column(db.Integer(), db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer(), db.ForeignKey('user.id'), index=True)
     user = db.relationship('User')
     log = db.Column(db.String())
     time = db.Column(db.DateTime())
@@ -43,7 +43,7 @@ def parse_audit_ref(ref):
         pass
     return bad_ret
         
-def audit_change(table, user, before, after):
+def audit_change(table, user, before, after, commit = True):
     audit = Audit()
     audit.user = user
     audit.log = u'In {%s: id=%s}: ' % (unicode(table.name), unicode(after.id))
@@ -58,7 +58,8 @@ def audit_change(table, user, before, after):
                 audit.log += u', '
             audit.log += u'%s: %s -> %s' % (unicode(key), unicode(before_dict[key]), unicode(after_dict[key]))
     db.session.add(audit)
-    db.session.commit()
+    if commit:
+        db.session.commit()
 
 def audit_user_creation(user):
     audit = Audit()
@@ -67,12 +68,13 @@ def audit_user_creation(user):
     db.session.add(audit)
     db.session.commit()
 
-def audit_rsvp(user, submission, add = True):
+def audit_rsvp(user, submission, add = True, commit = True):
     audit = Audit()
     audit.user = user
     audit.log = u'%s {submissions: id=%s}' % ('RSVPed to' if add == True else 'Un-RSVPed from', unicode(submission.id))
     db.session.add(audit)
-    db.session.commit()
+    if commit:
+        db.session.commit()
 
 @app.route('/logs')
 def logs():
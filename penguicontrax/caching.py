@@ -0,0 +1,195 @@
+import collections
+import os
+import threading
+import time
+
+from redis import ResponseError
+from constants import constants
+
+
+def namespaced_key(name):
+    """ Returns the redis key of a value that outlives deploys, like counters """
+    return '%s:%s' % (constants.CACHE_NAMESPACE, name)
+
+
+def cache_prefix(generation):
+    return '%s:v%d:g%d:' % (constants.CACHE_NAMESPACE, constants.CACHE_SCHEMA_VERSION, generation)
+
+
+cache_generation = None
+
+def cache_key(name):
+    """ Returns the redis key of a cached value
+        Keys carry the schema version and the cache generation, so a new
+        CACHE_SCHEMA_VERSION or a deploy (see invalidate_cache) starts from
+        an empty cache without touching anything else stored in redis.
+        The generation is read once per process, see load_cache_generation
+    """
+    if cache_generation is None:
+        load_cache_generation()
+    return cache_prefix(cache_generation) + name
+
+
+def load_cache_generation():
+    """ Reads the cache generation again, for code that can outlive a deploy
+        in a long running process, like rq jobs
+    """
+    global cache_generation
+    from penguicontrax import conn
+    try:
+        cache_generation = int(conn.get(namespaced_key('CACHE_GENERATION')) or 0) if conn is not None else 0
+    except Exception as e:
+        cache_generation = 0
+    return cache_generation
+
+
+def invalidate_cache(conn):
+    """ Starts a new cache generation and deletes the keys of older ones
+        (and of older schema versions). Only keys in our namespace are
+        touched; counters from namespaced_key are kept. Returns the new
+        generation
+    """
+    generation = conn.incr(namespaced_key('CACHE_GENERATION'))
+    current = cache_prefix(generation)
+    pattern = '%s:v[0-9]*:g[0-9]*:*' % constants.CACHE_NAMESPACE
+    stale = []
+    try:
+        cursor = None
+        while cursor != 0:
+            cursor, keys = conn.scan(cursor or 0, match=pattern, count=1000)
+            cursor = int(cursor)
+            stale.extend(key for key in keys if not key.startswith(current))
+    except ResponseError:
+        # redis servers older than 2.8 have no SCAN
+        stale = [key for key in conn.keys(pattern) if not key.startswith(current)]
+    for start in range(0, len(stale), 1000):
+        conn.delete(*stale[start:start + 1000])
+    return generation
+
+
+class LRUCache(object):
+    """ A bounded, thread safe in-process cache
+        Entries are evicted least recently used first once the total size of
+        the cached strings goes over max_bytes, and expire after ttl seconds
+        so a missed invalidation can't keep a stale payload around for long
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(value):
+        if isinstance(value, tuple):
+            return sum(LRUCache.sizeof(item) for item in value)
+        return len(value) if isinstance(value, basestring) else 1
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                self.size -= self.sizeof(value)
+                return None
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.sizeof(old[1])
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                evicted_key, (expires, evicted) = self.entries.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class VersionCounter(object):
+    """ A dataset version stored in redis and mirrored in every process
+        Writers publish each new version on a redis channel; a listener
+        thread per process keeps the local copy current, so reading the
+        version is free while the subscription is up and one GET otherwise.
+        Without redis the version is a counter local to this process
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.channel = key + '_CHANNEL'
+        self.local = int(time.time())   # unique per process start, see get()
+        self.current = None
+        self.listening = False
+        self.listener_pid = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        from penguicontrax import conn
+        if conn is None:
+            return str(self.local)
+        self.listen(conn)
+        if self.listening and self.current is not None:
+            return str(self.current)
+        return conn.get(self.key)
+
+    def changed(self, version=None):
+        """ Records a bump done by this process, with the new redis version """
+        with self.lock:
+            if version is None:
+                self.local += 1
+            elif self.current is None or int(version) > self.current:
+                self.current = int(version)
+
+    def publish(self, pipe, version):
+        """ Queues the notification of a new version on a redis pipeline """
+        pipe.publish(self.channel, version)
+
+    def listen(self, conn):
+        # threads don't survive a fork, so each worker starts its own
+        if self.listener_pid == os.getpid():
+            return
+        with self.lock:
+            if self.listener_pid == os.getpid():
+                return
+            self.listener_pid = os.getpid()
+            self.listening = False
+            self.current = None
+            listener = threading.Thread(target=self.run, args=(conn,))
+            listener.daemon = True
+            listener.start()
+
+    def run(self, conn):
+        while 1:
+            try:
+                pubsub = conn.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # read the version only once subscribed so no bump is missed
+                        version = conn.get(self.key)
+                        with self.lock:
+                            self.current = int(version) if version is not None else None
+                            self.listening = True
+                    elif message['type'] == 'message':
+                        self.changed(message['data'])
+            except Exception as e:
+                pass
+            self.listening = False
+            time.sleep(1)
+
+
+# hot API payloads keyed by (endpoint, parameters, dataset version)
+local_cache = LRUCache(constants.L1_CACHE_BYTES, constants.L1_CACHE_TTL)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class constants:
     DATABASE_FILE = 'penguicontrax.db'
@@ -23,4 +24,14 @@ class constants:
     ORGANIZATION = 'Penguicon' if not 'ORGANIZATION' in os.environ else os.environ['ORGANIZATION']
     MAIL_REPLY_TO = 'programming@penguicon.org' if not 'MAIL_REPLY_TO' in os.environ else os.environ['DEFAULT_MAIL_SENDER']
     MAIL_ENABLE = False if not 'MAIL_ENABLE' in os.environ else bool(os.environ['MAIL_ENABLE'])
-    DEBUG = False if not 'DEBUG' in os.environ else bool(os.environ['DEBUG'])
\ No newline at end of file
+    DEBUG = False if not 'DEBUG' in os.environ else bool(os.environ['DEBUG'])
+    L1_CACHE_BYTES = 64 * 1024 * 1024 if not 'L1_CACHE_BYTES' in os.environ else int(os.environ['L1_CACHE_BYTES'])
+    L1_CACHE_ENTRY_BYTES = 1024 * 1024 if not 'L1_CACHE_ENTRY_BYTES' in os.environ else int(os.environ['L1_CACHE_ENTRY_BYTES'])
+    L1_CACHE_TTL = 60 if not 'L1_CACHE_TTL' in os.environ else int(os.environ['L1_CACHE_TTL'])
+    PERF_INSTRUMENTATION = False if not 'PERF_INSTRUMENTATION' in os.environ else bool(os.environ['PERF_INSTRUMENTATION'])
+    METRICS_TOKEN = None if not 'METRICS_TOKEN' in os.environ else os.environ['METRICS_TOKEN']
+    RQ_QUEUES = ['high', 'default', 'low']    # the queues runworker.py listens on, most urgent first
+    ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), 'penguicontrax-artifacts') if not 'ARTIFACT_DIR' in os.environ else os.environ['ARTIFACT_DIR']
+    REPORT_RETENTION = 24 * 60 * 60 if not 'REPORT_RETENTION' in os.environ else int(os.environ['REPORT_RETENTION'])    # seconds
+    CACHE_NAMESPACE = 'ptrax' if not 'CACHE_NAMESPACE' in os.environ else os.environ['CACHE_NAMESPACE']
+    CACHE_SCHEMA_VERSION = 1    # bump whenever the format of anything cached in redis changes
@@ -0,0 +1,326 @@
+import bisect
+import datetime
+import random
+
+from sqlalchemy import func
+from penguicontrax import db, constants
+from penguicontrax.event import Events, Rooms, Convention, Timeslot, room_events, event_tags, presenter_event, \
+    room_suitability, room_availability, schedule_dataset_changed
+from penguicontrax.search import index_rows
+from penguicontrax.submission import Submission, Track, Resource, SubmissionToTags, SubmissionToResources, \
+    presenter_presenting_in, submission_dataset_changed
+from penguicontrax.tag import Tag
+from penguicontrax.user import User, Presenter, rsvps, event_rsvps
+
+# Fills the database with a made up convention for load and scale testing.
+# Everything is written with bulk inserts of rows whose ids are picked up
+# front, so the association tables never wait on the database for an id,
+# and the search index is filled from the same rows. Every choice comes from one random.Random(seed): the same seed and
+# sizes on the same (empty) database always give the same data. RSVPs follow
+# a power law, a few submissions get most of them, as at a real convention.
+
+# rows of a convention at scale 1, about the size of Penguicon
+BASE_SIZES = {'users': 1000, 'presenters': 300, 'submissions': 250, 'events': 200, 'rooms': 15}
+# rows per executemany
+INSERT_BATCH = 1000
+# shape of the popularity of submissions and events, lower is more skewed
+POPULARITY_ALPHA = 1.2
+# shape of how many RSVPs each user makes, lower means more busy users
+ACTIVITY_ALPHA = 1.0
+MAX_EVENT_RSVPS = 8
+CONVENTION_DAYS = 3
+
+FIRST = ['Alice', 'Bob', 'Carol', 'Dan', 'Erin', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy', 'Mallory', 'Niaj',
+         'Olivia', 'Peggy', 'Rupert', 'Sybil', 'Trent', 'Victor', 'Walter', 'Xena', 'Yusuf', 'Zoe']
+LAST = ['Smith', 'Jones', 'Brown', 'Taylor', 'Wilson', 'Davies', 'Evans', 'Thomas', 'Roberts', 'Johnson',
+        'Walker', 'Wright', 'Robinson', 'Thompson', 'White', 'Hughes', 'Edwards', 'Green', 'Hall', 'Wood']
+WORDS = ['robots', 'knitting', 'lasers', 'zombies', 'linux', 'dragons', 'cooking', 'rockets', 'soldering',
+         'costumes', 'poetry', 'cryptography', 'gardening', 'swords', 'synthesizers', 'telescopes', 'beer',
+         'board', 'games', 'open', 'source', 'space', 'history', 'future', 'makers', 'science', 'fiction',
+         'hacking', 'privacy', 'puppets', 'chainmail', 'bread', 'mead', 'drones', 'comics', 'anime']
+TITLES = ['Intro to %s', 'Advanced %s', '%s for Beginners', 'The Future of %s', '%s Workshop', '%s Q&A',
+          'Build Your Own %s', '%s and %s', 'All About %s', 'Ask a %s Expert']
+EVENT_TYPES = ['talk', 'panel', 'workshop', 'demo', 'party', 'game']
+ROOM_NAMES = ['Ballroom', 'Salon', 'Hackerspace', 'Suite', 'Con Suite', 'Board Room', 'Atrium', 'Theater']
+
+
+def sizes(scale=1, **counts):
+    """ The row counts of a convention scale times the base one, with any
+        counts given replacing the scaled ones
+    """
+    result = dict((name, max(1, int(round(count * scale)))) for name, count in BASE_SIZES.items())
+    result.update((name, count) for name, count in counts.items() if count is not None)
+    return result
+
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+compiled_cache = {}
+
+
+def insert(table, rows):
+    connection = db.session.connection().execution_options(compiled_cache=compiled_cache)
+    statement = table.insert()
+    for start in range(0, len(rows), INSERT_BATCH):
+        connection.execute(statement, rows[start:start + INSERT_BATCH])
+
+
+def reset_sequences(*models):
+    """ Moves PostgreSQL's id sequences past the ids inserted explicitly """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__table__.name
+        db.session.execute("SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), "
+                           "(SELECT coalesce(max(id), 1) FROM \"%s\"))" % (table, table))
+
+
+class WeightedChoice(object):
+    """ Picks ids at random in proportion to their weights """
+
+    def __init__(self, rng, ids, weights):
+        self.rng = rng
+        self.ids = ids
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    def pick(self):
+        return self.ids[bisect.bisect_right(self.cumulative, self.rng.random() * self.total)]
+
+    def sample(self, count):
+        """ count different ids """
+        count = min(count, len(self.ids))
+        picked = set()
+        while len(picked) < count:
+            picked.add(self.pick())
+        return sorted(picked)
+
+
+class DatasetGenerator(object):
+
+    def __init__(self, seed, sizes):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.sizes = sizes
+        # tag id -> the text the search index has for it
+        self.tags = dict((id, u'%s %s' % (name, desc or u'')) for id, name, desc in
+                         db.session.query(Tag.id, Tag.name, Tag.desc))
+        self.tag_ids = sorted(self.tags)
+        self.presenter_names = {}
+        self.tracks = [row[0] for row in db.session.query(Track.id).order_by(Track.id)]
+        self.resources = [row[0] for row in db.session.query(Resource.id).order_by(Resource.id)]
+        self.start_dt = datetime.datetime(2015, 5, 1, 16)
+        self.counts = {}
+
+    def person(self):
+        return self.rng.choice(FIRST), self.rng.choice(LAST)
+
+    def title(self):
+        title = self.rng.choice(TITLES)
+        return title % tuple(self.rng.choice(WORDS).capitalize() for _ in range(title.count('%s')))
+
+    def description(self):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(10, 60))).capitalize() + '.'
+
+    def popularity(self, count):
+        return [self.rng.paretovariate(POPULARITY_ALPHA) for _ in range(count)]
+
+    def activity(self, limit):
+        """ How many RSVPs a user makes: mostly none or one, now and then limit """
+        return min(limit, int(self.rng.paretovariate(ACTIVITY_ALPHA)) - 1)
+
+    def record(self, table, rows):
+        insert(table, rows)
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+    def users(self):
+        first_id = next_id(User)
+        taken = set(row[0] for row in db.session.query(User.account_name))
+        image_small = constants.PUBLIC_URL + 'static/penguinhead_small.png'
+        image_large = constants.PUBLIC_URL + 'static/penguinhead.png'
+        rows = []
+        for id in range(first_id, first_id + self.sizes['users']):
+            first, last = self.person()
+            account_name = '%s%s%d' % (first, last, id)
+            while account_name in taken:
+                account_name += 'x'
+            taken.add(account_name)
+            rows.append({'id': id, 'name': '%s %s' % (first, last), 'account_name': account_name,
+                         'email': '%s@synthetic.example.com' % account_name.lower(), 'points': 5,
+                         'staff': False, 'superuser': False, 'public_rsvps': self.rng.random() < 0.3,
+                         'image_small': image_small, 'image_large': image_large})
+        self.record(User.__table__, rows)
+        return rows
+
+    def presenters(self, users):
+        first_id = next_id(Presenter)
+        rows = []
+        for id in range(first_id, first_id + self.sizes['presenters']):
+            # some presenters have accounts
+            if self.rng.random() < 0.3:
+                user = self.rng.choice(users)
+                rows.append({'id': id, 'name': user['name'], 'email': user['email'], 'user_id': user['id']})
+            else:
+                first, last = self.person()
+                rows.append({'id': id, 'name': '%s %s' % (first, last), 'user_id': None,
+                             'email': '%s.%s%d@synthetic.example.com' % (first.lower(), last.lower(), id)})
+            rows[-1]['phone'] = '555-%04d' % self.rng.randint(0, 9999)
+        self.record(Presenter.__table__, rows)
+        return dict((row['id'], row['name']) for row in rows)
+
+    def links(self, table, id_column, other_column, ids, others, most):
+        """ Links each of ids to between 1 and most of others, returns
+            id -> the others it was linked to
+        """
+        rows = []
+        linked = {}
+        for id in ids:
+            linked[id] = self.rng.sample(others, min(len(others), self.rng.randint(1, most)))
+            rows.extend({id_column: id, other_column: other} for other in linked[id])
+        self.record(table, rows)
+        return linked
+
+    def index(self, kind, rows, tags, presenters):
+        """ Adds rows to the search index, with the tags and presenters
+            linked to them by links()
+        """
+        index_rows(kind, [{'id': row['id'], 'title': row['title'], 'body': row['description'],
+                           'tags': u' '.join(self.tags[id] for id in tags.get(row['id'], [])),
+                           'people': u' '.join(self.presenter_names[id] for id in presenters[row['id']])}
+                          for row in rows])
+
+    def submissions(self, users, presenters):
+        first_id = next_id(Submission)
+        ids = range(first_id, first_id + self.sizes['submissions'])
+        rows = []
+        for id in ids:
+            rows.append({'id': id, 'title': self.title(), 'description': self.description(), 'comments': None,
+                         'submitter_id': self.rng.choice(users)['id'],
+                         'trackId': self.rng.choice(self.tracks) if self.tracks else None,
+                         'duration': self.rng.randint(1, 5), 'setupTime': self.rng.randint(0, 3),
+                         'repetition': self.rng.randint(0, 3), 'timeRequest': None,
+                         'eventType': self.rng.choice(EVENT_TYPES), 'players': self.rng.randint(0, 20),
+                         'roundTables': self.rng.randint(0, 4), 'longTables': self.rng.randint(0, 4),
+                         'facilityRequest': None, 'private': self.rng.random() < 0.05, 'event_created': False,
+                         'followUpState': self.rng.choice([0, 0, 0, 1, 1, 2, 2, 2, 3]),
+                         'submitted_dt': self.start_dt - datetime.timedelta(minutes=self.rng.randint(0, 90 * 24 * 60)),
+                         'rsvp_count': 0})
+        tags = self.links(SubmissionToTags, 'submission_id', 'tag_id', ids, self.tag_ids, 3)
+        if self.resources:
+            self.links(SubmissionToResources, 'submission_id', 'resource_id',
+                       [id for id in ids if self.rng.random() < 0.3], self.resources, 2)
+        presenters = self.links(presenter_presenting_in, 'submission_id', 'presenter_id', ids, presenters, 3)
+
+        # each user spends up to their 5 points, mostly on the popular ones
+        choice = WeightedChoice(self.rng, ids, self.popularity(len(ids)))
+        counts = dict((id, 0) for id in ids)
+        rsvp_rows = []
+        for user in users:
+            picked = choice.sample(self.activity(user['points']))
+            for id in picked:
+                rsvp_rows.append({'submission_id': id, 'user_id': user['id']})
+                counts[id] += 1
+            user['spent'] = len(picked)
+        for row in rows:
+            row['rsvp_count'] = counts[row['id']]
+        self.record(Submission.__table__, rows)
+        self.record(rsvps, rsvp_rows)
+        self.index('submission', rows, tags, presenters)
+        users_table = User.__table__
+        for spent in range(1, 6):
+            spenders = [user['id'] for user in users if user['spent'] == spent]
+            for start in range(0, len(spenders), INSERT_BATCH):
+                db.session.execute(users_table.update().where(users_table.c.id.in_(
+                    spenders[start:start + INSERT_BATCH])).values(points=5 - spent))
+
+    def convention(self, users, presenters):
+        convention_id = next_id(Convention)
+        end_dt = self.start_dt + datetime.timedelta(days=CONVENTION_DAYS)
+        self.record(Convention.__table__, [{
+            'id': convention_id, 'name': 'Synthetic Convention %d' % convention_id,
+            'url': 'synthetic%d' % convention_id,
+            'description': 'Generated with seed %s: %s' % (self.seed, ', '.join(
+                '%d %s' % (count, name) for name, count in sorted(self.sizes.items()))),
+            'start_dt': self.start_dt, 'end_dt': end_dt, 'timeslot_duration': datetime.timedelta(hours=1)}])
+
+        first_id = next_id(Rooms)
+        room_ids = range(first_id, first_id + self.sizes['rooms'])
+        self.record(Rooms.__table__, [{'id': id, 'convention_id': convention_id,
+                                       'room_name': '%s %d' % (self.rng.choice(ROOM_NAMES), id)}
+                                      for id in room_ids])
+
+        first_id = next_id(Timeslot)
+        timeslots = []
+        current = self.start_dt
+        while current < end_dt:
+            timeslots.append({'id': first_id + len(timeslots), 'convention_id': convention_id,
+                              'start_dt': current, 'rsvp_conflicts': 0,
+                              'name': '{:%A %I %p}'.format(current)})
+            current += datetime.timedelta(hours=1)
+        self.record(Timeslot.__table__, timeslots)
+        self.record(room_availability, [{'timeslot_id': timeslot['id'], 'room_id': room_id}
+                                        for room_id in room_ids for timeslot in timeslots])
+
+        first_id = next_id(Events)
+        ids = range(first_id, first_id + self.sizes['events'])
+        rows = []
+        scheduled = []
+        for id in ids:
+            row = {'id': id, 'title': self.title(), 'description': self.description(), 'comments': None,
+                   'submitter_id': self.rng.choice(users)['id'],
+                   'track_id': self.rng.choice(self.tracks) if self.tracks else None,
+                   'eventType': self.rng.choice(EVENT_TYPES), 'players': self.rng.randint(0, 20),
+                   'roundTables': self.rng.randint(0, 4), 'longTables': self.rng.randint(0, 4),
+                   'facilityRequest': None, 'duration': 1, 'convention_id': convention_id, 'fixed': False,
+                   'start_dt': None}
+            # a tenth is still waiting for a room and time
+            if self.rng.random() < 0.9:
+                row['start_dt'] = self.rng.choice(timeslots)['start_dt']
+                scheduled.append(id)
+            rows.append(row)
+        self.record(Events.__table__, rows)
+        self.record(room_events, [{'event_id': id, 'room_id': self.rng.choice(room_ids)} for id in scheduled])
+        self.links(room_suitability, 'event_id', 'room_id', ids, room_ids, 3)
+        tags = self.links(event_tags, 'event_id', 'tag_id', ids, self.tag_ids, 3)
+        presenters = self.links(presenter_event, 'events_id', 'presenter_id', ids, presenters, 3)
+        self.index('event', rows, tags, presenters)
+
+        choice = WeightedChoice(self.rng, ids, self.popularity(len(ids)))
+        self.record(event_rsvps, [{'event_id': id, 'user_id': user['id']} for user in users
+                                  for id in choice.sample(self.activity(MAX_EVENT_RSVPS))])
+        return convention_id
+
+    def generate(self):
+        users = self.users()
+        self.presenter_names = self.presenters(users)
+        presenters = sorted(self.presenter_names)
+        self.submissions(users, presenters)
+        convention_id = self.convention(users, presenters)
+        reset_sequences(User, Presenter, Submission, Convention, Rooms, Timeslot, Events)
+        return convention_id
+
+
+def generate_dataset(seed=0, scale=1, **counts):
+    """ Adds a synthetic convention with its users, presenters, submissions,
+        rooms, timeslots, events and RSVPs to the database
+        The sizes are BASE_SIZES times scale, or the counts given (users,
+        presenters, submissions, events, rooms). Returns (convention id,
+        rows inserted per table)
+    """
+    generator = DatasetGenerator(seed, sizes(scale, **counts))
+    try:
+        convention_id = generator.generate()
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    # the cached lists and fragments don't know about the new rows
+    submission_dataset_changed()
+    schedule_dataset_changed()
+    return convention_id, generator.counts
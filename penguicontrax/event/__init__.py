@@ -1,48 +1,68 @@
 from flask import g, request, session, render_template, redirect, Response, Markup
-from .. import app, db
-import xml.etree.ElementTree as ET
+from sqlalchemy import select
+from sqlalchemy.event import listen
+from sqlalchemy.orm import Session, object_session
+from .. import app, db, metrics, artifacts
+from penguicontrax.caching import VersionCounter, namespaced_key
+from penguicontrax.serializers import XMLWriter, buffered, counted
+from penguicontrax.submission import Track
+from penguicontrax.tag import Tag, tag_dataset_ver
+from penguicontrax.user import Presenter
 import datetime, sys
 
 # Associate multiple rooms to multiple events.
 room_events = db.Table('room_events',
     db.Column('event_id', db.Integer, db.ForeignKey('events.id')),
-    db.Column('room_id', db.Integer, db.ForeignKey('rooms.id'))
+    db.Column('room_id', db.Integer, db.ForeignKey('rooms.id')),
+    db.Index('ix_room_events_event_id_room_id', 'event_id', 'room_id'),
+    db.Index('ix_room_events_room_id', 'room_id')
 )
 
 # Associates multiple tags to multiple events.
 event_tags = db.Table('event_tags', db.Model.metadata,
     db.Column('event_id', db.Integer(), db.ForeignKey('events.id', ondelete='CASCADE', onupdate='CASCADE')),
-    db.Column('tag_id', db.Integer(), db.ForeignKey('tags.id', ondelete='CASCADE', onupdate='CASCADE'))
+    db.Column('tag_id', db.Integer(), db.ForeignKey('tags.id', ondelete='CASCADE', onupdate='CASCADE')),
+    db.Index('ix_event_tags_event_id_tag_id', 'event_id', 'tag_id'),
+    db.Index('ix_event_tags_tag_id', 'tag_id')
 )
 
 # Associates multiple resources to multiple events.
 event_resources = db.Table('event_resources', db.Model.metadata,
     db.Column('event_id', db.Integer(), db.ForeignKey('events.id', ondelete='CASCADE', onupdate='CASCADE')),
-    db.Column('resource_id', db.Integer(), db.ForeignKey('resources.id', ondelete='CASCADE', onupdate='CASCADE'))
+    db.Column('resource_id', db.Integer(), db.ForeignKey('resources.id', ondelete='CASCADE', onupdate='CASCADE')),
+    db.Index('ix_event_resources_event_id_resource_id', 'event_id', 'resource_id'),
+    db.Index('ix_event_resources_resource_id', 'resource_id')
 )
 
 # Associates multiple persons to multiple events.
 presenter_event = db.Table('presenter_event',
     db.Column('events_id', db.Integer, db.ForeignKey('events.id', ondelete='CASCADE', onupdate='CASCADE')),
-    db.Column('presenter_id', db.Integer, db.ForeignKey('presenter.id', ondelete='CASCADE', onupdate='CASCADE')))
+    db.Column('presenter_id', db.Integer, db.ForeignKey('presenter.id', ondelete='CASCADE', onupdate='CASCADE')),
+    db.Index('ix_presenter_event_events_id_presenter_id', 'events_id', 'presenter_id'),
+    db.Index('ix_presenter_event_presenter_id', 'presenter_id'))
 
 room_suitability = db.Table('room_suitability',
     db.Column('event_id', db.Integer, db.ForeignKey('events.id', ondelete='CASCADE', onupdate='CASCADE')),
-    db.Column('room_id', db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE', onupdate='CASCADE'))
+    db.Column('room_id', db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE', onupdate='CASCADE')),
+    db.Index('ix_room_suitability_event_id_room_id', 'event_id', 'room_id'),
+    db.Index('ix_room_suitability_room_id', 'room_id')
 )
 
 room_availability = db.Table('room_availability',
     db.Column('timeslot_id', db.Integer, db.ForeignKey('timeslot.id', ondelete='CASCADE', onupdate='CASCADE')),
-    db.Column('room_id', db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE', onupdate='CASCADE'))
+    db.Column('room_id', db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE', onupdate='CASCADE')),
+    db.Index('ix_room_availability_timeslot_id_room_id', 'timeslot_id', 'room_id'),
+    db.Index('ix_room_availability_room_id', 'room_id')
 )
 
 class Events(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (db.Index('ix_events_convention_id_start_dt', 'convention_id', 'start_dt'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String())
     description = db.Column(db.String())
     comments = db.Column(db.String())
-    submitter_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    submitter_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     submitter = db.relationship('User')
     track_id = db.Column(db.Integer(), db.ForeignKey('tracks.id'))
     track = db.relationship('Track')
@@ -71,7 +91,7 @@ class Rooms(db.Model):
     room_name = db.Column(db.String(50))
     room_groups_id = db.Column(db.Integer, db.ForeignKey('room_groups.id'))
     rooms_groups = db.relationship('RoomGroups', backref='rooms')
-    convention_id = db.Column(db.Integer, db.ForeignKey('convention.id'))
+    convention_id = db.Column(db.Integer, db.ForeignKey('convention.id'), index=True)
     convention = db.relationship('Convention', backref='rooms')
     suitable_events = db.relationship('Events', secondary=room_suitability, backref=db.backref('suitable_rooms'), passive_deletes=True)
     available_timeslots = db.relationship('Timeslot', secondary=room_availability, backref=db.backref('available_rooms'), passive_deletes=True)
@@ -98,7 +118,7 @@ class Convention(db.Model):
     description = db.Column(db.Text)
     start_dt = db.Column(db.DateTime)
     end_dt = db.Column(db.DateTime)
-    url = db.Column(db.String())
+    url = db.Column(db.String(), index=True)
     timeslot_duration = db.Column(db.Interval())
 
     def __repr__(self):
@@ -107,7 +127,8 @@ class Convention(db.Model):
 class Timeslot(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.String())
-    convention_id = db.Column(db.Integer(), db.ForeignKey('convention.id', ondelete='CASCADE', onupdate='CASCADE'))
+    convention_id = db.Column(db.Integer(), db.ForeignKey('convention.id', ondelete='CASCADE', onupdate='CASCADE'),
+                              index=True)
     convention = db.relationship('Convention', backref=db.backref('timeslots'))
     start_dt = db.Column(db.DateTime())
     rsvp_conflicts = db.Column(db.Integer())
@@ -146,60 +167,196 @@ class Timeslotentry(db.Model):
     convention_id = db.Column(db.Integer(), db.ForeignKey('convention.id', ondelete='CASCADE', onupdate='CASCADE'))
     convention = db.relationship('Convention', backref=db.backref('timeslot_entries'))
 
-def indent(elem, level=0):
-    i = "\n" + level*"  "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "  "
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-        for elem in elem:
-            indent(elem, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+# The schedule book is rendered to a file once per schedule version and
+# served from it (see penguicontrax.artifacts). schedule_version is bumped
+# after any commit that inserts, changes or deletes an event, room,
+# presenter, track or convention, and by the solver, which writes the
+# schedule outside the ORM; tag renames move tag_version, which is part of
+# the file's version too.
 
+schedule_version = VersionCounter(namespaced_key('SCHEDULE_VERSION'))
+
+
+def mark_schedule_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['schedule_changed'] = True
+
+for model in [Events, Rooms, Convention, Presenter, Track]:
+    listen(model, 'after_insert', mark_schedule_changed)
+    listen(model, 'after_update', mark_schedule_changed)
+    listen(model, 'after_delete', mark_schedule_changed)
 
-def create_schedule_XML(convention_id):
-    """
-    Exports the events in XML format for the schedule book.
 
-    TODO: expand this to match the format of 2013.penguicon.schedule.xml.
+def commit_schedule_changes(session):
+    if session.info.pop('schedule_changed', False):
+        schedule_dataset_changed()
+
+
+def forget_schedule_changes(session, previous_transaction):
+    session.info.pop('schedule_changed', None)
+
+listen(Session, 'after_commit', commit_schedule_changes)
+listen(Session, 'after_soft_rollback', forget_schedule_changes)
+
+
+def schedule_dataset_changed():
+    from penguicontrax import conn
+    from penguicontrax.ical import queue_feed_rebuild
+    if not conn is None:
+        try:
+            version = conn.incr(schedule_version.key)
+            schedule_version.publish(conn, version)
+            metrics.increment('dataset_version_bumps_total', dataset='schedule')
+            schedule_version.changed(version)
+        except:
+            pass
+        else:
+            # the calendar feeds are rendered from the schedule too
+            queue_feed_rebuild()
+            return
+    metrics.increment('dataset_version_bumps_total', dataset='schedule')
+    schedule_version.changed()
+
+
+def schedule_dataset_ver():
+    try:
+        return '%s-%s' % (schedule_version.get(), tag_dataset_ver())
+    except:
+        return '%s-%s' % (schedule_version.local, tag_dataset_ver())
+
+
+def schedule_time(dt):
+    """ 4 PM or 4:30 PM, as the schedule book prints it """
+    hour = dt.hour % 12 or 12
+    minutes = ':%02d' % dt.minute if dt.minute else ''
+    return u'%d%s %s' % (hour, minutes, 'AM' if dt.hour < 12 else 'PM')
+
+
+def schedule_length(duration):
+    """ 45 minutes, 2 hours or 1 hour and 50 minutes, from a duration in
+        15 minute intervals
     """
-    root = ET.Element('events')
-    root.attrib['xmlns:xsi'] = 'http://www.w3.org/2001/XMLSchema-instance'
-    document_elem = ET.SubElement(root, 'document')
-    for event in Events.query.filter_by(convention_id=convention_id).all():
-        event_elem = ET.SubElement(document_elem, 'event')
-        title_elem = ET.SubElement(event_elem, 'title')
-        title_elem.text = event.title
-    indent(root)
-    return ET.tostring(root, encoding='utf-8')
+    hours, minutes = divmod(15 * duration, 60)
+    parts = []
+    if hours:
+        parts.append(u'%d hour%s' % (hours, '' if hours == 1 else 's'))
+    if minutes:
+        parts.append(u'%d minutes' % minutes)
+    return u' and '.join(parts)
+
+
+def load_schedule(convention_id=None, only=None):
+    """ The scheduled events of a convention (or of every convention) as
+        dicts with their rooms, presenters and tags, in order of time, room
+        and title; only is an extra condition on the events table. Four
+        queries however many events there are: the events with their
+        tracks, then the names on each side of room_events, presenter_event
+        and event_tags
+    """
+    events = Events.__table__
+    tracks = Track.__table__
+    condition = events.c.start_dt != None
+    if convention_id is not None:
+        condition &= events.c.convention_id == convention_id
+    if only is not None:
+        condition &= only
+
+    def names_by_event(association, event_column, table, other_column, name_column):
+        names = {}
+        query = select([event_column, name_column]) \
+            .select_from(association.join(table, other_column == table.c.id)
+                                    .join(events, event_column == events.c.id)) \
+            .where(condition).order_by(name_column)
+        for event_id, name in db.session.execute(query):
+            if name:
+                names.setdefault(event_id, []).append(name)
+        return names
+
+    rows = db.session.execute(
+        select([events.c.id, events.c.title, events.c.description, events.c.start_dt, events.c.duration,
+                tracks.c.name.label('track')])
+        .select_from(events.outerjoin(tracks, events.c.track_id == tracks.c.id))
+        .where(condition)).fetchall()
+    rooms = Rooms.__table__
+    room_names = names_by_event(room_events, room_events.c.event_id, rooms, room_events.c.room_id,
+                                rooms.c.room_name)
+    presenters = Presenter.__table__
+    presenter_names = names_by_event(presenter_event, presenter_event.c.events_id, presenters,
+                                     presenter_event.c.presenter_id, presenters.c.name)
+    tags = Tag.__table__
+    tag_names = names_by_event(event_tags, event_tags.c.event_id, tags, event_tags.c.tag_id, tags.c.desc)
+
+    schedule = []
+    for row in rows:
+        categories = [row.track] if row.track else []
+        categories += [name for name in tag_names.get(row.id, []) if name != row.track]
+        schedule.append({'id': row.id, 'title': row.title, 'description': row.description, 'start_dt': row.start_dt,
+                         'duration': row.duration, 'categories': categories,
+                         'rooms': room_names.get(row.id, []), 'presenters': presenter_names.get(row.id, [])})
+    schedule.sort(key=lambda event: (event['start_dt'], event['rooms'], event['title']))
+    return schedule
+
+def create_schedule_XML(convention_id, progress=None):
+    """
+    Exports the scheduled events in the format of the 2013 schedule book
+    (2013.penguicon.schedule.xml, which import2013schedule reads): a <time>
+    before the events starting at each time, a <day> when the day changes,
+    and a section per event with its title, track and tags, rooms,
+    presenters, description and, unless it's an hour long, its length.
+    Yields the document a piece at a time, calling progress() for each
+    event if given.
+    """
+    writer = XMLWriter(pretty=True)
+    yield writer.declaration(standalone=True)
+    yield writer.start('events', {'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance'})
+    yield writer.start('document')
+    schedule = load_schedule(convention_id)
+    if progress is not None:
+        schedule = counted(schedule, progress)
+    day = time = None
+    for event in schedule:
+        if event['start_dt'].date() != day:
+            day = event['start_dt'].date()
+            yield writer.element('day', u'{:%A}'.format(day))
+        if event['start_dt'] != time:
+            time = event['start_dt']
+            yield writer.element('time', schedule_time(time))
+        yield writer.start('div', {'class': 'section'})
+        yield writer.element('div', event['title'], {'class': 'what question'})
+        yield writer.element('div', u', '.join(event['categories']), {'class': 'what question'})
+        yield writer.element('div', u', '.join(event['rooms']), {'class': 'where question'})
+        yield writer.start('div', {'class': 'what question'})
+        yield writer.element('div', u', '.join(event['presenters']), {'class': 'who question'})
+        if event['description']:
+            yield writer.text(u' %s ' % event['description'])
+        if event['duration'] and event['duration'] != 4:
+            yield writer.element('div', schedule_length(event['duration']), {'class': 'when question'})
+        yield writer.end()
+        yield writer.end()
+    yield writer.end()
+    yield writer.end()
 
 def get_schedule(convention):
-    schedule_text = create_schedule_XML(convention.id)
-
-    # Return XML prolog and XML schedule.
-    return Response(
-        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' +
-        schedule_text,
-        mimetype='text/xml',
-        headers={'Content-Disposition':
-                 'attachment;filename=penguicon.schedule.xml'}
-    )
+    """ Sends the schedule book, rendered once per schedule version """
+    def build(f):
+        for chunk in buffered(create_schedule_XML(convention.id)):
+            f.write(chunk)
+    response = artifacts.artifact_response('schedule-%d.xml' % convention.id, schedule_dataset_ver(),
+                                           'text/xml', build)
+    response.headers['Content-Disposition'] = 'attachment;filename=penguicon.schedule.xml'
+    return response
 
 @app.route('/convention/<convention_url>/schedulexml', methods=['GET'])
 def get_schedule_url(convention_url):
-    convention = Convention.query.fitler_by(url=convention_url).first()
+    convention = Convention.query.filter_by(url=convention_url).first()
     if convention is None:
         return redirect('/')
     return get_schedule(convention)
 
 @app.route('/conventionschedulexml', methods=['GET'])
 def get_schedule_args():
-    convention = Convention.query.filter_by(id=request.args['id']).first
+    convention = Convention.query.filter_by(id=request.args['id']).first() if 'id' in request.args else None
     if convention is None:
         return redirect('/')
     return get_schedule(convention)
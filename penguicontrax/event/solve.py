@@ -5,9 +5,27 @@ class SolveTypes:
     ECTTO = 4
 
 def solve_convetion_modeler(convention_id_str):
+    """ rq job that schedules a convention; its duration and outcome are
+        recorded in the solver metrics
+    """
+    import time
+    from penguicontrax import metrics
+    start = time.time()
+    outcome = 'error'
+    try:
+        status, outcome = run_modeler(convention_id_str)
+        return status
+    finally:
+        metrics.increment('solver_jobs_total', outcome=outcome)
+        metrics.observe('solver_duration_seconds', time.time() - start, metrics.SOLVER_BUCKETS, outcome=outcome)
+        # the rq work horse exits right after the job
+        metrics.flush()
+
+def run_modeler(convention_id_str):
+    """ Returns (the solver's output, outcome) """
     import os, subprocess, sys
     from penguicontrax import constants
-    from penguicontrax.event import generate_schedule, Convention
+    from penguicontrax.event import generate_schedule, Convention, schedule_dataset_changed
     status = ''
     d = os.path.join(os.getcwd(), 'penguicontrax')
     model = subprocess.Popen([constants.MODELER_PATH, '-d', constants.DATABASE_URL, '-f', 'output.lp', '-c', convention_id_str, '-m', '0'], stdout = subprocess.PIPE, cwd=d)
@@ -16,7 +34,7 @@ def solve_convetion_modeler(convention_id_str):
         status += model.communicate()[0].replace(os.linesep, '<br/>')
         ret = model.poll()
     if ret != 0:
-        return status
+        return status, 'model_failed'
     sol = subprocess.Popen([constants.CLP_PATH, 'output.lp', '-solve', '-solu', 'output.sol'], stdout = subprocess.PIPE, cwd=d)
     ret = None
     while ret is None:
@@ -29,8 +47,10 @@ def solve_convetion_modeler(convention_id_str):
         ret = db.poll()
     status += 'Applying schedule to database...<br/>'
     generate_schedule(Convention.query.filter_by(id=int(convention_id_str)).first())
+    # the modeler wrote the events behind the ORM's back
+    schedule_dataset_changed()
     status += 'Finished'
-    return status
+    return status, 'finished'
 
 '''
 def solve_convention_pulp(convention, type = SolveTypes.TTD, write_files = False):
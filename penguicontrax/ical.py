@@ -0,0 +1,292 @@
+import datetime
+import hashlib
+import hmac
+import time
+import urlparse
+
+from flask import request, url_for
+from sqlalchemy import select
+from sqlalchemy.event import listen
+from sqlalchemy.orm import Session, object_session
+from werkzeug.security import safe_str_cmp
+from penguicontrax import app, constants
+from penguicontrax.caching import namespaced_key
+from penguicontrax.event import Convention, Events, event_tags, load_schedule
+from penguicontrax.submission import Track
+from penguicontrax.tag import Tag
+from penguicontrax.user import User, event_rsvps
+
+# Calendar apps poll their subscriptions often, so the iCalendar feeds are
+# rendered by rq jobs ahead of time and kept in redis as ready to send
+# hashes of body, ETag and Last-Modified. A feed is named after its path
+# (convention/<url>, convention/<url>/track/<name>, convention/<url>/tag/<name>
+# or user/<id>), so a poll that finds nothing changed is one HGET of the
+# ETag and never touches the database. A feed is rendered in the request
+# the first time it's asked for, which adds it to FEEDS_KEY; after that a
+# change to the schedule queues a rebuild of every feed there, and a change
+# to someone's event RSVPs a rebuild of theirs. Rebuilding a feed whose
+# events didn't change keeps its ETag. Without redis every poll renders.
+
+FEEDS_KEY = namespaced_key('ICAL_FEEDS')
+REBUILD_QUEUED_KEY = namespaced_key('ICAL_REBUILD_QUEUED')
+REBUILD_QUEUED_TIMEOUT = 60 * 60    # in case the queued job is lost
+EVENT_LENGTH = 4    # in 15 minute intervals, for events without a duration
+
+
+def feed_key(feed):
+    return namespaced_key('ICAL:' + feed.encode('utf-8'))
+
+
+def user_feed_token(user_id):
+    """ The secret in a user's feed URL, since calendar apps can't log in """
+    return hmac.new(str(app.secret_key), 'user/%d' % user_id, hashlib.sha1).hexdigest()[:20]
+
+
+@app.template_filter()
+def calendar_url(user):
+    return url_for('user_calendar', user_id=user.id, token=user_feed_token(user.id), _external=True)
+
+
+def escape_text(text):
+    """ Escapes a TEXT value, dropping the control characters it can't have """
+    text = text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\n', '\\n')
+    return u''.join(c for c in text if c >= u' ' or c == u'\t')
+
+
+def fold(line):
+    """ Splits a content line into lines of at most 75 octets (RFC 5545 3.1)
+        without cutting a UTF-8 sequence in two
+    """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return encoded + '\r\n'
+    output = []
+    while len(encoded) > 75:
+        cut = 75
+        while ord(encoded[cut]) & 0xC0 == 0x80:
+            cut -= 1
+        output.append(encoded[:cut])
+        encoded = ' ' + encoded[cut:]
+    output.append(encoded)
+    return '\r\n'.join(output) + '\r\n'
+
+
+def format_dt(dt):
+    """ A floating local time; conventions are scheduled in their own time """
+    return dt.strftime('%Y%m%dT%H%M%S')
+
+
+def render_feed(name, events, stamp):
+    """ The feed as an iCalendar document; stamp (UTC) is when its events
+        last changed
+    """
+    host = urlparse.urlparse(constants.PUBLIC_URL).hostname or 'penguicontrax'
+    dtstamp = stamp.strftime('%Y%m%dT%H%M%SZ')
+    lines = [u'BEGIN:VCALENDAR', u'VERSION:2.0',
+             u'PRODID:-//%s//PenguiconTrax//EN' % escape_text(constants.ORGANIZATION),
+             u'CALSCALE:GREGORIAN', u'METHOD:PUBLISH', u'X-WR-CALNAME:' + escape_text(name)]
+    for event in events:
+        end_dt = event['start_dt'] + datetime.timedelta(minutes=15 * (event['duration'] or EVENT_LENGTH))
+        lines += [u'BEGIN:VEVENT', u'UID:event-%d@%s' % (event['id'], host), u'DTSTAMP:' + dtstamp,
+                  u'DTSTART:' + format_dt(event['start_dt']), u'DTEND:' + format_dt(end_dt),
+                  u'SUMMARY:' + escape_text(event['title'] or u'')]
+        description = event['description'] or u''
+        if event['presenters']:
+            description = u'%s\n\n%s' % (u', '.join(event['presenters']), description)
+        if description.strip():
+            lines.append(u'DESCRIPTION:' + escape_text(description.strip()))
+        if event['rooms']:
+            lines.append(u'LOCATION:' + escape_text(u', '.join(event['rooms'])))
+        if event['categories']:
+            lines.append(u'CATEGORIES:' + u','.join(escape_text(category) for category in event['categories']))
+        lines.append(u'END:VEVENT')
+    lines.append(u'END:VCALENDAR')
+    return ''.join(fold(line) for line in lines)
+
+
+def feed_schedule(feed):
+    """ The name and events of a feed, or None if what it follows is gone """
+    events = Events.__table__
+    parts = feed.split('/', 3)
+    if parts[0] == 'user':
+        user = User.query.filter_by(id=int(parts[1])).first()
+        if user is None:
+            return None
+        rsvped = select([event_rsvps.c.event_id]).where(event_rsvps.c.user_id == user.id)
+        return u'%s: %s' % (constants.ORGANIZATION, user.name), load_schedule(only=events.c.id.in_(rsvped))
+    convention = Convention.query.filter_by(url=parts[1]).first()
+    if convention is None:
+        return None
+    if len(parts) == 2:
+        return convention.name, load_schedule(convention.id)
+    if parts[2] == 'track':
+        track = Track.query.filter_by(name=parts[3]).first()
+        if track is None:
+            return None
+        return u'%s: %s' % (convention.name, track.name), \
+            load_schedule(convention.id, events.c.track_id == track.id)
+    tag = Tag.query.filter_by(name=parts[3]).first()
+    if tag is None:
+        return None
+    tagged = select([event_tags.c.event_id]).where(event_tags.c.tag_id == tag.id)
+    return u'%s: %s' % (convention.name, tag.desc), load_schedule(convention.id, events.c.id.in_(tagged))
+
+
+def feed_etag(name, events):
+    """ Changes only when what the feed shows does """
+    content = repr((constants.CACHE_SCHEMA_VERSION, name, [sorted(event.items()) for event in events]))
+    return hashlib.sha1(content).hexdigest()[:20]
+
+
+def build_feed(feed, conn):
+    """ Renders feed into redis unless its events are unchanged, returns
+        (body, etag, last modified) or None if the feed is gone
+    """
+    schedule = feed_schedule(feed)
+    key = feed_key(feed)
+    if schedule is None:
+        pipe = conn.pipeline()
+        pipe.delete(key)
+        pipe.srem(FEEDS_KEY, feed.encode('utf-8'))
+        pipe.execute()
+        return None
+    name, events = schedule
+    etag = feed_etag(name, events)
+    stored = conn.hmget(key, 'etag', 'modified', 'body')
+    if stored[0] == etag:
+        return stored[2], etag, float(stored[1])
+    modified = time.time()
+    body = render_feed(name, events, datetime.datetime.utcfromtimestamp(modified))
+    pipe = conn.pipeline()
+    pipe.hmset(key, {'body': body, 'etag': etag, 'modified': repr(modified)})
+    pipe.sadd(FEEDS_KEY, feed.encode('utf-8'))
+    pipe.execute()
+    return body, etag, modified
+
+
+def build_feeds(feeds=None):
+    """ rq job that renders the given feeds that have been asked for, or
+        every one of them
+    """
+    from penguicontrax import conn
+    if feeds is None:
+        # changes from now on need another rebuild
+        conn.delete(REBUILD_QUEUED_KEY)
+        feeds = [feed.decode('utf-8') for feed in conn.smembers(FEEDS_KEY)]
+    else:
+        feeds = [feed for feed in feeds if conn.sismember(FEEDS_KEY, feed.encode('utf-8'))]
+    for feed in sorted(feeds):
+        build_feed(feed, conn)
+    return 'Built %d calendar feeds' % len(feeds)
+
+
+def queue_feed_rebuild(*feeds):
+    """ Queues a rebuild of the feeds, or of all of them; there's only ever
+        one rebuild of all of them waiting
+    """
+    from penguicontrax import conn
+    from rq import Queue
+    if conn is None:
+        return
+    try:
+        if feeds:
+            Queue('low', connection=conn).enqueue(build_feeds, list(feeds))
+        elif conn.set(REBUILD_QUEUED_KEY, 1, ex=REBUILD_QUEUED_TIMEOUT, nx=True):
+            Queue('low', connection=conn).enqueue(build_feeds)
+    except:
+        pass
+
+
+# Event RSVPs are made through User.event_rsvped_to or Events.rsvped_by;
+# the users are collected as they change and their feeds queued once the
+# change is committed.
+
+def mark_rsvps_changed(user, value, initiator):
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('ical_users', set()).add(user)
+
+listen(User.event_rsvped_to, 'append', mark_rsvps_changed)
+listen(User.event_rsvped_to, 'remove', mark_rsvps_changed)
+
+
+def collect_rsvp_changes(session, flush_context):
+    # ids are only known once new users are flushed
+    users = session.info.pop('ical_users', None)
+    if users:
+        session.info.setdefault('ical_user_ids', set()).update(user.id for user in users if user.id is not None)
+
+
+def commit_rsvp_changes(session):
+    user_ids = session.info.pop('ical_user_ids', None)
+    if user_ids:
+        queue_feed_rebuild(*['user/%d' % user_id for user_id in sorted(user_ids)])
+
+
+def forget_rsvp_changes(session, previous_transaction):
+    session.info.pop('ical_users', None)
+    session.info.pop('ical_user_ids', None)
+
+listen(Session, 'after_flush', collect_rsvp_changes)
+listen(Session, 'after_commit', commit_rsvp_changes)
+listen(Session, 'after_soft_rollback', forget_rsvp_changes)
+
+
+def feed_response(feed):
+    """ Sends a feed from redis, rendering it if it isn't there yet, or
+        404 if there's nothing to follow
+    """
+    from penguicontrax import conn
+    stored = None
+    if conn is not None:
+        try:
+            key = feed_key(feed)
+            if request.if_none_match:
+                etag = conn.hget(key, 'etag')
+                if etag is not None and etag in request.if_none_match:
+                    response = app.response_class(status=304)
+                    response.set_etag(etag)
+                    return response
+            body, etag, modified = conn.hmget(key, 'body', 'etag', 'modified')
+            stored = (body, etag, float(modified)) if body is not None else build_feed(feed, conn)
+            if stored is None:
+                return 'Not found', 404
+        except:
+            stored = None
+    if stored is None:
+        schedule = feed_schedule(feed)
+        if schedule is None:
+            return 'Not found', 404
+        name, events = schedule
+        modified = time.time()
+        stored = (render_feed(name, events, datetime.datetime.utcfromtimestamp(modified)),
+                  feed_etag(name, events), modified)
+    body, etag, modified = stored
+    response = app.response_class(body, mimetype='text/calendar')
+    response.cache_control.no_cache = True
+    response.set_etag(etag)
+    response.last_modified = modified
+    return response.make_conditional(request)
+
+
+@app.route('/convention/<convention_url>/schedule.ics')
+def convention_calendar(convention_url):
+    return feed_response(u'convention/' + convention_url)
+
+
+@app.route('/convention/<convention_url>/track/<track_name>.ics')
+def track_calendar(convention_url, track_name):
+    return feed_response(u'convention/%s/track/%s' % (convention_url, track_name))
+
+
+@app.route('/convention/<convention_url>/tag/<tag_name>.ics')
+def tag_calendar(convention_url, tag_name):
+    return feed_response(u'convention/%s/tag/%s' % (convention_url, tag_name))
+
+
+@app.route('/calendar/<int:user_id>/<token>.ics')
+def user_calendar(user_id, token):
+    if not safe_str_cmp(token.encode('utf-8'), user_feed_token(user_id)):
+        return 'Not found', 404
+    return feed_response(u'user/%d' % user_id)
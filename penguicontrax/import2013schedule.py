@@ -5,6 +5,7 @@ from submission import Submission, Track, Resource
 from tag import Tag, normalize_tag_name
 from user import Presenter, User
 from event import Convention, Rooms, Events
+from search import index_documents
 import datetime, random
 from user.Login import generate_account_name, gravatar_image_update
 import sys
@@ -158,6 +159,8 @@ def import_old(path, as_convention = False, random_rsvp_users = 0, submission_li
                 penguicontrax.db.session.add(submission)
                 submission_count = submission_count + 1
         print "New submission"
+        penguicontrax.db.session.flush()
+        index_documents('submission' if as_convention == False else 'event', existing_submissions)
         penguicontrax.db.session.commit()
 
     if random_rsvp_users > 0:
@@ -171,11 +174,9 @@ def import_old(path, as_convention = False, random_rsvp_users = 0, submission_li
             user.superuser = False
             generate_account_name(user)
             gravatar_image_update(user)
-            for rsvp_index in range(user.points):
-                rand = random.randint(0, len(existing_submissions) - 1)
-                while user in existing_submissions[rand].rsvped_by:
-                    rand = random.randint(0, len(existing_submissions) - 1)
+            for rand in random.sample(range(len(existing_submissions)), min(user.points, len(existing_submissions))):
                 existing_submissions[rand].rsvped_by.append(user)
+                existing_submissions[rand].rsvp_count = (existing_submissions[rand].rsvp_count or 0) + 1
             user.points = 0
             penguicontrax.db.session.add(user)
         penguicontrax.db.session.commit()
@@ -0,0 +1,243 @@
+import collections
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from flask import request, Response
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+from penguicontrax import app, db, conn, constants
+from penguicontrax.caching import namespaced_key
+
+# Prometheus metrics at /metrics. Counters and histograms are added up in a
+# redis hash shared by every process, web and rq workers alike, so scraping
+# any one gunicorn worker reports the whole deployment. Each process buffers
+# its increments and writes them in one pipeline every
+# METRICS_FLUSH_INTERVAL seconds (rq jobs flush when they finish), along
+# with its own gauges, which are summed over the processes that reported
+# recently. Without redis every process reports only itself.
+
+METRICS_KEY = namespaced_key('METRICS')
+METRICS_PROCESSES_KEY = namespaced_key('METRICS_PROCESSES')
+METRICS_FLUSH_INTERVAL = 5
+# a process that hasn't reported for this long no longer counts in the gauges
+METRICS_PROCESS_TIMEOUT = 4 * METRICS_FLUSH_INTERVAL
+PREFIX = 'penguicontrax_'
+SOLVER_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600]
+
+# name: (type, help), in the order they're exported
+METRICS = collections.OrderedDict([
+    ('submissions_cache_requests_total', ('counter', 'Requests for the full submission list, by cache result')),
+    ('submissions_cache_hit_ratio', ('gauge', 'Share of submission list requests answered from the cache')),
+    ('dataset_version_bumps_total', ('counter', 'Changes to a dataset that invalidate its cached copies')),
+    ('watch_error_retries_total', ('counter', 'Redis transactions retried after a WatchError')),
+    ('rq_queue_length', ('gauge', 'Jobs waiting in an rq queue')),
+    ('solver_jobs_total', ('counter', 'Schedule solver runs, by outcome')),
+    ('solver_duration_seconds', ('histogram', 'Time the schedule solver took, by outcome')),
+    ('db_connections_in_use', ('gauge', 'Database connections checked out of the pools')),
+    ('db_pool_size', ('gauge', 'Connections the database pools keep open')),
+    ('processes', ('gauge', 'Processes reporting metrics')),
+])
+
+
+def sample_name(name, labels):
+    if len(labels) == 0:
+        return PREFIX + name
+    escaped = ('%s="%s"' % (label, unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for label, value in sorted(labels.items()))
+    return '%s%s{%s}' % (PREFIX, name, ','.join(escaped))
+
+
+def format_value(value):
+    value = float(value)
+    return '%d' % value if value.is_integer() else repr(value)
+
+
+def sample_order(sample):
+    """ Sorts histogram buckets by their bound, after the other labels """
+    match = re.search(r'le="([^"]*)",?', sample[0])
+    if match is None:
+        return sample[0], 0
+    bound = float('inf') if match.group(1) == '+Inf' else float(match.group(1))
+    return sample[0][:match.start()] + sample[0][match.end():], bound
+
+
+class MetricsBuffer(object):
+    """ The counts this process hasn't written to redis yet """
+
+    def __init__(self):
+        self.pending = collections.defaultdict(float)
+        self.connections_in_use = 0
+        self.lock = threading.Lock()
+        self.flusher_pid = None
+
+    def add(self, samples):
+        self.start()
+        with self.lock:
+            for sample, amount in samples:
+                self.pending[sample] += amount
+
+    def start(self):
+        # threads don't survive a fork, so each worker starts its own
+        if conn is None or self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+            # counts made before the fork were the parent's to write
+            self.pending.clear()
+            flusher = threading.Thread(target=self.run)
+            flusher.daemon = True
+            flusher.start()
+
+    def run(self):
+        while 1:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def gauges(self):
+        gauges = {'db_connections_in_use': self.connections_in_use}
+        try:
+            gauges['db_pool_size'] = db.engine.pool.size()
+        except Exception as e:
+            pass
+        return gauges
+
+    def flush(self):
+        if conn is None:
+            return
+        with self.lock:
+            pending, self.pending = self.pending, collections.defaultdict(float)
+        try:
+            with conn.pipeline(transaction=False) as pipe:
+                for sample, amount in pending.items():
+                    pipe.hincrbyfloat(METRICS_KEY, sample, amount)
+                pipe.hset(METRICS_PROCESSES_KEY, '%s:%d' % (socket.gethostname(), os.getpid()),
+                          json.dumps({'time': time.time(), 'gauges': self.gauges()}))
+                pipe.execute()
+        except Exception as e:
+            # kept for the next try
+            with self.lock:
+                for sample, amount in pending.items():
+                    self.pending[sample] += amount
+
+    def totals(self):
+        """ Returns ({sample: value} of every counter, [gauges of every live
+            process])
+        """
+        if conn is not None:
+            self.flush()
+            try:
+                with conn.pipeline(transaction=False) as pipe:
+                    pipe.hgetall(METRICS_KEY)
+                    pipe.hgetall(METRICS_PROCESSES_KEY)
+                    counters, processes = pipe.execute()
+                live = []
+                for process, report in processes.items():
+                    report = json.loads(report)
+                    if report['time'] < time.time() - METRICS_PROCESS_TIMEOUT:
+                        conn.hdel(METRICS_PROCESSES_KEY, process)
+                    else:
+                        live.append(report['gauges'])
+                return dict((sample, float(value)) for sample, value in counters.items()), live
+            except Exception as e:
+                pass
+        with self.lock:
+            return dict(self.pending), [self.gauges()]
+
+buffer = MetricsBuffer()
+
+
+def increment(name, amount=1, **labels):
+    """ Adds amount to the counter name with the given labels """
+    buffer.add([(sample_name(name, labels), amount)])
+
+
+def observe(name, value, buckets, **labels):
+    """ Records value in the histogram name with the given labels """
+    samples = [(sample_name(name + '_bucket', dict(labels, le=bound)), 1 if value <= bound else 0)
+               for bound in buckets]
+    samples.append((sample_name(name + '_bucket', dict(labels, le='+Inf')), 1))
+    samples.append((sample_name(name + '_sum', labels), value))
+    samples.append((sample_name(name + '_count', labels), 1))
+    buffer.add(samples)
+
+
+def flush():
+    """ Writes this process's counts now, for processes about to exit """
+    buffer.flush()
+
+
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    with buffer.lock:
+        buffer.connections_in_use += 1
+    buffer.start()
+
+
+def count_checkin(dbapi_connection, connection_record):
+    with buffer.lock:
+        buffer.connections_in_use -= 1
+
+event.listen(Pool, 'checkout', count_checkout)
+event.listen(Pool, 'checkin', count_checkin)
+
+
+def queue_lengths():
+    lengths = {}
+    if conn is None:
+        return lengths
+    try:
+        from rq import Queue
+        from rq.queue import get_failed_queue
+        for name in constants.RQ_QUEUES:
+            lengths[name] = Queue(name, connection=conn).count
+        lengths['failed'] = get_failed_queue(connection=conn).count
+    except Exception as e:
+        pass
+    return lengths
+
+
+def exposition():
+    """ Every metric in the Prometheus text format """
+    counters, processes = buffer.totals()
+    samples = collections.defaultdict(list)
+    for sample, value in counters.items():
+        samples[sample[len(PREFIX):].split('{')[0]].append((sample, value))
+
+    hits = sum(value for sample, value in samples['submissions_cache_requests_total'] if 'result="hit"' in sample)
+    requests = sum(value for sample, value in samples['submissions_cache_requests_total'])
+    if requests > 0:
+        samples['submissions_cache_hit_ratio'].append((sample_name('submissions_cache_hit_ratio', {}), hits / requests))
+    for name, length in queue_lengths().items():
+        samples['rq_queue_length'].append((sample_name('rq_queue_length', {'queue': name}), length))
+    for gauge in ['db_connections_in_use', 'db_pool_size']:
+        values = [process[gauge] for process in processes if gauge in process]
+        if len(values) > 0:
+            samples[gauge].append((sample_name(gauge, {}), sum(values)))
+    samples['processes'].append((sample_name('processes', {}), len(processes)))
+
+    lines = []
+    for name, (type, help) in METRICS.items():
+        lines.append('# HELP %s%s %s' % (PREFIX, name, help))
+        lines.append('# TYPE %s%s %s' % (PREFIX, name, type))
+        family = samples[name]
+        if type == 'histogram':
+            family = samples[name + '_bucket'] + samples[name + '_sum'] + samples[name + '_count']
+        for sample, value in sorted(family, key=sample_order):
+            lines.append('%s %s' % (sample, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    """ For Prometheus; with METRICS_TOKEN set, scrapers have to send it as
+        a bearer token
+    """
+    if constants.METRICS_TOKEN is not None and \
+            request.headers.get('Authorization') != 'Bearer ' + constants.METRICS_TOKEN:
+        return 'Unauthorized', 401
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
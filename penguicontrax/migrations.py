@@ -0,0 +1,116 @@
+from datetime import datetime
+
+from sqlalchemy import and_, func, inspect, select
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from penguicontrax import app, db
+from penguicontrax.submission import Submission
+from penguicontrax.user import rsvps
+
+# Upgrades databases made by older versions in place. db.create_all() creates
+# missing tables, with their indexes, but never changes existing ones, so every
+# change to an existing table is a numbered migration below. schema_version
+# records the migrations applied; upgrade() runs the others in order. Every
+# migration is safe to run on a database that already has its changes, as new
+# databases do. init() upgrades in every process, so processes starting
+# together race: on PostgreSQL they take turns holding an advisory lock, and
+# elsewhere a migration that fails because another process applied it first
+# is skipped once schema_version says so.
+
+# key of the PostgreSQL advisory lock held while upgrading
+UPGRADE_LOCK = 0x7472617853
+
+schema_version = db.Table('schema_version',
+                          db.Column('version', db.Integer, primary_key=True),
+                          db.Column('description', db.String()),
+                          db.Column('applied_dt', db.DateTime()))
+
+
+def add_rsvp_count(connection):
+    """ Adds submissions.rsvp_count and counts the RSVPs into it """
+    submissions = Submission.__table__
+    if 'rsvp_count' not in [column['name'] for column in inspect(connection).get_columns('submissions')]:
+        connection.execute('ALTER TABLE submissions ADD COLUMN rsvp_count INTEGER')
+    connection.execute(submissions.update().values(rsvp_count=select([func.count()]).where(
+        rsvps.c.submission_id == submissions.c.id).as_scalar()))
+
+
+def create_indexes(connection):
+    """ Creates the indexes declared on the models that the database lacks
+        A unique index that rows already in the table violate is created
+        as a plain one, so lookups are still indexed, and reported
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    preparer = connection.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            if index.unique and has_duplicates(connection, index):
+                app.logger.warning('Duplicate %s in %s, creating %s without the unique constraint',
+                                   ', '.join(column.name for column in index.columns), table.name, index.name)
+                connection.execute('CREATE INDEX %s ON %s (%s)' % (
+                    preparer.quote(index.name), preparer.format_table(table),
+                    ', '.join(preparer.quote(column.name) for column in index.columns)))
+            else:
+                index.create(connection)
+
+
+def has_duplicates(connection, index):
+    columns = list(index.columns)
+    return connection.execute(select(columns).where(and_(*[column != None for column in columns])).group_by(
+        *columns).having(func.count() > 1).limit(1)).first() is not None
+
+
+MIGRATIONS = [
+    (1, 'Add submissions.rsvp_count', add_rsvp_count),
+    (2, 'Index the user, submission and association table lookups', create_indexes),
+]
+
+
+def current_version(connection):
+    try:
+        schema_version.create(connection, checkfirst=True)
+    except (IntegrityError, OperationalError, ProgrammingError):
+        # created by another process since the check
+        if not connection.dialect.has_table(connection, schema_version.name):
+            raise
+    return connection.execute(select([func.max(schema_version.c.version)])).scalar() or 0
+
+
+def apply_migrations(connection):
+    applied = []
+    version = current_version(connection)
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            with connection.begin():
+                migration(connection)
+                connection.execute(schema_version.insert(), version=number, description=description,
+                                   applied_dt=datetime.now())
+        except (IntegrityError, OperationalError, ProgrammingError):
+            if current_version(connection) >= number:
+                # another process applied it first
+                continue
+            raise
+        app.logger.info('Applied migration %d: %s', number, description)
+        applied.append(number)
+    return applied
+
+
+def upgrade():
+    """ Applies the migrations the database hasn't had yet, each in its own
+        transaction, and returns their versions
+    """
+    with db.engine.connect() as connection:
+        if connection.dialect.name != 'postgresql':
+            return apply_migrations(connection)
+        connection.execute(select([func.pg_advisory_lock(UPGRADE_LOCK)]))
+        try:
+            return apply_migrations(connection)
+        finally:
+            connection.execute(select([func.pg_advisory_unlock(UPGRADE_LOCK)]))
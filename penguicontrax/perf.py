@@ -0,0 +1,265 @@
+import bisect
+import threading
+import time
+
+import redis
+from jinja2 import Template
+from flask import g, request, render_template, redirect, jsonify, _app_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from penguicontrax import app, conn, constants
+
+# Per-request performance counters. While enabled (PERF_INSTRUMENTATION=1,
+# or enable()) every request records its wall time, the number and time of
+# its SQL statements and redis round trips, the time spent rendering
+# templates and whether the submission list came from the cache. Each
+# response reports them in a Server-Timing header, and /debug/perf shows
+# staff histograms of them per endpoint. The histograms are kept by each
+# process, since the last time it started or they were reset. While
+# disabled the handlers that are hooked in return right away.
+
+# upper bounds of the histogram buckets; a last bucket takes everything above
+TIME_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+# name, unit and buckets of the measured values, in the order they're shown
+METRICS = [('total', 'ms', TIME_BUCKETS),
+           ('sql', 'ms', TIME_BUCKETS),
+           ('sql_queries', 'queries', COUNT_BUCKETS),
+           ('redis', 'ms', TIME_BUCKETS),
+           ('redis_round_trips', 'round trips', COUNT_BUCKETS),
+           ('template', 'ms', TIME_BUCKETS)]
+PERCENTILES = [50, 90, 99]
+
+enabled = False
+
+
+class Histogram(object):
+    """ Counts of values between fixed bounds """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """ The upper bound of the bucket holding the given percentile
+            (or the largest value, when that's in the last bucket)
+        """
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': float(self.total) / self.count if self.count else 0,
+            'max': self.max,
+            'percentiles': dict(('p%d' % percent, self.percentile(percent)) for percent in PERCENTILES),
+            'buckets': [[bound, count] for bound, count in zip(self.bounds + [None], self.counts)],
+        }
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.histograms = dict((name, Histogram(buckets)) for name, unit, buckets in METRICS)
+        self.caches = {}
+
+    def add(self, measurement):
+        for name, histogram in self.histograms.items():
+            histogram.add(measurement.values[name])
+        for name, hits in measurement.caches.items():
+            counts = self.caches.setdefault(name, {'hit': 0, 'miss': 0})
+            for hit in hits:
+                counts['hit' if hit else 'miss'] += 1
+
+
+class Measurement(object):
+    """ What one request has used so far """
+
+    def __init__(self):
+        self.start = time.time()
+        self.values = dict((name, 0) for name, unit, buckets in METRICS)
+        self.caches = {}
+
+    def server_timing(self):
+        values = self.values
+        timings = ['total;dur=%.1f' % values['total'],
+                   'sql;dur=%.1f;desc="%d queries"' % (values['sql'], values['sql_queries']),
+                   'redis;dur=%.1f;desc="%d round trips"' % (values['redis'], values['redis_round_trips']),
+                   'template;dur=%.1f' % values['template']]
+        for name, hits in sorted(self.caches.items()):
+            timings.append('%s;desc="%s"' % (name, ' '.join('hit' if hit else 'miss' for hit in hits)))
+        return ', '.join(timings)
+
+
+stats = {}
+stats_lock = threading.Lock()
+
+
+def current():
+    """ The measurement of the request being handled, if there is one """
+    if not enabled or _app_ctx_stack.top is None:
+        return None
+    return getattr(g, 'perf', None)
+
+
+def add_time(name, start):
+    measurement = current()
+    if measurement is not None:
+        measurement.values[name] += (time.time() - start) * 1000
+
+
+def record_cache(name, hit):
+    """ Notes a cache lookup by the current request """
+    measurement = current()
+    if measurement is not None:
+        measurement.caches.setdefault(name, []).append(hit)
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if current() is not None:
+        context.perf_start = time.time()
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'perf_start', None)
+    measurement = current()
+    if measurement is not None and start is not None:
+        measurement.values['sql_queries'] += 1
+        measurement.values['sql'] += (time.time() - start) * 1000
+
+
+class TimedTemplate(Template):
+    """ Adds its render time to the current request's """
+
+    def render(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            add_time('template', start)
+
+
+class TimedConnection(redis.Connection):
+    """ Counts the round trips to redis (a pipeline sends all its commands
+        at once) and the time spent on them
+    """
+
+    def send_packed_command(self, command):
+        measurement = current()
+        if measurement is not None:
+            measurement.values['redis_round_trips'] += 1
+        start = time.time()
+        try:
+            return redis.Connection.send_packed_command(self, command)
+        finally:
+            add_time('redis', start)
+
+    def read_response(self):
+        start = time.time()
+        try:
+            return redis.Connection.read_response(self)
+        finally:
+            add_time('redis', start)
+
+
+def use_connection_class(connection_class):
+    """ Replaces the redis connection pool by one making connection_class """
+    if conn is None:
+        return
+    pool = conn.connection_pool
+    conn.connection_pool = redis.ConnectionPool(connection_class=connection_class,
+                                                max_connections=pool.max_connections, **pool.connection_kwargs)
+    pool.disconnect()
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    # SQLAlchemy can't take class wide listeners off again, so they stay
+    # once added and do nothing while disabled
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    # templates already loaded were made with the plain class
+    app.jinja_env.template_class = TimedTemplate
+    app.jinja_env.cache.clear()
+    use_connection_class(TimedConnection)
+    enabled = True
+
+
+def disable():
+    global enabled
+    if not enabled:
+        return
+    enabled = False
+    app.jinja_env.template_class = Template
+    app.jinja_env.cache.clear()
+    use_connection_class(redis.Connection)
+
+
+def reset():
+    with stats_lock:
+        stats.clear()
+
+
+@app.before_request
+def start_measurement():
+    if enabled:
+        g.perf = Measurement()
+
+
+@app.after_request
+def finish_measurement(response):
+    measurement = current()
+    if measurement is None:
+        return response
+    measurement.values['total'] = (time.time() - measurement.start) * 1000
+    with stats_lock:
+        stats.setdefault(request.endpoint or 'unmatched', EndpointStats()).add(measurement)
+    response.headers['Server-Timing'] = measurement.server_timing()
+    return response
+
+
+def snapshot():
+    """ The histograms of every endpoint, as JSON friendly dicts """
+    with stats_lock:
+        return dict((endpoint, {
+            'metrics': dict((name, histogram.as_dict()) for name, histogram in endpoint_stats.histograms.items()),
+            'caches': dict((name, dict(counts)) for name, counts in endpoint_stats.caches.items()),
+        }) for endpoint, endpoint_stats in stats.items())
+
+
+@app.route('/debug/perf', methods=['GET', 'POST'])
+def debug_perf():
+    """ The request histograms; ?format=json returns them as JSON, and a
+        POST starts them over
+    """
+    if g.user is None or not g.user.staff:
+        return redirect('/')
+    if request.method == 'POST':
+        reset()
+        return redirect('/debug/perf')
+    endpoints = snapshot()
+    if request.args.get('format') == 'json':
+        return jsonify(enabled=enabled, endpoints=endpoints)
+    return render_template('debug_perf.html', user=g.user, enabled=enabled, metrics=METRICS,
+                           percentiles=PERCENTILES, endpoints=sorted(endpoints.items()))
+
+
+if constants.PERF_INSTRUMENTATION:
+    enable()
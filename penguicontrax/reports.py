@@ -0,0 +1,284 @@
+import glob
+import json
+import os
+import tempfile
+import time
+
+from flask import request, Response, send_file, url_for
+from redis import ConnectionError
+from sqlalchemy import func
+from penguicontrax import app, db, constants, artifacts
+from penguicontrax.caching import namespaced_key
+from penguicontrax.serializers import buffered
+
+# Exports of the whole database can take longer than a request should, so
+# rq jobs build them instead: POST /reports/<report> queues one and answers
+# with the URL of its status, which counts the rows written so far and,
+# once the report is finished, links to the download. A job is named after
+# the artifact it builds (see penguicontrax.artifacts), that is after the
+# report and its dataset version, so every request for the same report of
+# the same data shares one job. The worker may well run on another machine
+# than the web workers, so the finished report is copied into redis next to
+# its status, and both are kept for REPORT_RETENTION seconds. Without redis
+# the report is built in the request into ARTIFACT_DIR, under a name of its
+# own so that the synchronous routes don't delete it when they build a newer
+# version, and kept there for REPORT_RETENTION seconds too.
+
+STATUS_KEY = 'REPORT:%s'
+FILE_KEY = 'REPORT_FILE:%s'
+LOCAL_PREFIX = 'job-'       # for the names of reports built without redis
+CHUNK_SIZE = 64 * 1024      # bytes copied to or from redis at a time
+PROGRESS_INTERVAL = 1       # seconds between saving a job's row count
+REPORT_TIMEOUT = 60 * 60    # seconds a job may run
+
+
+class Report(object):
+    """ An export a job can build: the name of its artifact, the file name
+        and mimetype it's downloaded with, and functions returning its
+        dataset version and number of rows and writing it to a file
+        (calling progress() for every row)
+    """
+
+    def __init__(self, name, filename, mimetype, version, count, write):
+        self.name = name
+        self.filename = filename
+        self.mimetype = mimetype
+        self.version = version
+        self.count = count
+        self.write = write
+
+
+def count_rows(*selectables):
+    return sum(db.session.query(func.count()).select_from(selectable).scalar() for selectable in selectables)
+
+
+def get_report(report, convention_id=None):
+    """ The Report called report (schedule.xml needs a convention), or None """
+    from penguicontrax import report_xml, write_report_csv
+    from penguicontrax.event import Events, create_schedule_XML, schedule_dataset_ver
+    from penguicontrax.submission import Submission, SubmissionToTags, submission_dataset_ver
+    from penguicontrax.tag import Tag, tag_dataset_ver
+    if report == 'report.csv':
+        return Report('report.csv', 'report.csv', 'text/csv', submission_dataset_ver,
+                      lambda: count_rows(Submission.__table__), write_report_csv)
+    if report == 'report.xml':
+        def write(f, progress):
+            for chunk in buffered(report_xml(progress)):
+                f.write(chunk)
+        return Report('report.xml', 'report.xml', 'text/xml',
+                      lambda: '%s-%s' % (submission_dataset_ver(), tag_dataset_ver()),
+                      lambda: count_rows(Submission.__table__, Tag.__table__, SubmissionToTags), write)
+    if report == 'schedule.xml' and convention_id is not None:
+        def write(f, progress):
+            for chunk in buffered(create_schedule_XML(convention_id, progress)):
+                f.write(chunk)
+        events = Events.__table__
+        return Report('schedule-%d.xml' % convention_id, 'penguicon.schedule.xml', 'text/xml', schedule_dataset_ver,
+                      lambda: count_rows(events.select().where((events.c.convention_id == convention_id) &
+                                                               (events.c.start_dt != None)).alias()), write)
+    return None
+
+
+def status_key(report_id):
+    return namespaced_key(STATUS_KEY % report_id)
+
+
+def file_key(report_id):
+    return namespaced_key(FILE_KEY % report_id)
+
+
+class Progress(object):
+    """ Counts the rows a job has written, saving the count to its status
+        every PROGRESS_INTERVAL seconds
+    """
+
+    def __init__(self, conn, key):
+        self.conn = conn
+        self.key = key
+        self.rows = 0
+        self.saved = time.time()
+
+    def __call__(self):
+        self.rows += 1
+        if time.time() - self.saved >= PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        self.conn.hset(self.key, 'rows', self.rows)
+        self.saved = time.time()
+
+
+def store_report(conn, report_id, f):
+    """ Copies the report in f into redis a chunk at a time, then puts it
+        in place at once
+    """
+    key = file_key(report_id)
+    partial = '%s:%d' % (key, os.getpid())
+    conn.set(partial, '')
+    f.seek(0)
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+        conn.append(partial, chunk)
+    pipe = conn.pipeline()
+    pipe.rename(partial, key)
+    pipe.expire(key, constants.REPORT_RETENTION)
+    pipe.execute()
+
+
+def run_report(report_id, report, convention_id=None):
+    """ rq job that builds a report and stores it in redis """
+    from penguicontrax import conn
+    key = status_key(report_id)
+    spec = get_report(report, convention_id)
+    conn.hmset(key, {'status': 'running', 'started': repr(time.time()), 'rows': 0, 'total': spec.count()})
+    progress = Progress(conn, key)
+    try:
+        with tempfile.TemporaryFile() as f:
+            spec.write(f, progress)
+            store_report(conn, report_id, f)
+    except Exception as e:
+        conn.hmset(key, {'status': 'failed', 'error': str(e)})
+        raise
+    progress.save()
+    conn.hmset(key, {'status': 'finished', 'finished': repr(time.time())})
+    conn.expire(key, constants.REPORT_RETENTION)
+    return 'Built %s, %d rows' % (spec.name, progress.rows)
+
+
+def job_lost(conn, job_id):
+    """ Whether the job is gone without saying so, like when its worker
+        was killed
+    """
+    from rq.exceptions import NoSuchJobError
+    from rq.job import Job
+    if job_id is None:
+        return False
+    try:
+        return Job.fetch(job_id, connection=conn).is_failed
+    except NoSuchJobError:
+        return True
+
+
+def request_report(spec, report_id, report, convention_id=None):
+    """ Returns the status of the job building the report, queueing it
+        unless it's already queued, running or finished
+    """
+    from penguicontrax import conn
+    from rq import Queue
+    key = status_key(report_id)
+    status = conn.hgetall(key)
+    state = status.get('status')
+    if state == 'failed' or (state in ('queued', 'running') and job_lost(conn, status.get('job'))) or \
+            (state == 'finished' and not conn.exists(file_key(report_id))):
+        # try again; a finished report may have been evicted
+        conn.delete(key)
+        status = {}
+    if status:
+        return status
+    now = repr(time.time())
+    fields = {'report': report, 'convention': convention_id or '', 'name': spec.name, 'filename': spec.filename,
+              'mimetype': spec.mimetype, 'requested': now}
+    if conn.hsetnx(key, 'status', 'queued'):
+        job = Queue('low', connection=conn).enqueue_call(run_report, args=(report_id, report, convention_id),
+                                                         timeout=REPORT_TIMEOUT)
+        fields['job'] = job.id
+        conn.hmset(key, fields)
+    conn.expire(key, constants.REPORT_RETENTION)
+    return conn.hgetall(key)
+
+
+def load_status(report_id):
+    """ The status of a report job, or None if there's no such job """
+    from penguicontrax import conn
+    if conn is not None:
+        try:
+            return conn.hgetall(status_key(report_id)) or None
+        except ConnectionError:
+            pass
+    # without redis, reports are finished as soon as they're requested
+    paths = glob.glob(artifacts.artifact_path(LOCAL_PREFIX + '*', report_id))
+    if paths:
+        name = os.path.basename(paths[0]).split('.', 1)[1][len(LOCAL_PREFIX):]
+        return {'status': 'finished', 'name': name, 'path': paths[0]}
+    return None
+
+
+def status_json(report_id, status):
+    state = status.get('status')
+    rows = int(status.get('rows') or 0)
+    total = int(status.get('total') or 0)
+    data = {'id': report_id, 'report': status.get('report'), 'status': state, 'rows': rows, 'total': total,
+            'progress': 1.0 if state == 'finished' else float(rows) / total if total else 0.0,
+            'status_url': url_for('report_status', report_id=report_id)}
+    if state == 'finished':
+        data['download_url'] = url_for('report_download', report_id=report_id)
+    if 'error' in status:
+        data['error'] = status['error']
+    return data
+
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data), status=status, headers=headers, mimetype='application/json')
+
+
+@app.route('/reports/<report>', methods=['POST'])
+def queue_report(report):
+    """ Queues the report (report.csv, report.xml or, with ?convention=id,
+        schedule.xml) for the current data
+    """
+    from penguicontrax.event import Convention
+    convention_id = request.values.get('convention', type=int)
+    if report == 'schedule.xml' and Convention.query.filter_by(id=convention_id).first() is None:
+        return 'Unknown convention', 404
+    spec = get_report(report, convention_id)
+    if spec is None:
+        return 'Unknown report', 404
+    from penguicontrax import conn
+    report_id = artifacts.artifact_key(spec.name, spec.version())
+    status = None
+    if conn is not None:
+        try:
+            status = request_report(spec, report_id, report, convention_id)
+        except ConnectionError:
+            pass
+    if status is None:
+        # no redis to queue it on, build it here
+        artifacts.build_artifact(LOCAL_PREFIX + spec.name, report_id, lambda f: spec.write(f, None), keep_old=True)
+        artifacts.expire_artifacts(constants.REPORT_RETENTION)
+        status = {'status': 'finished', 'report': report}
+    data = status_json(report_id, status)
+    return json_response(data, 200 if data['status'] == 'finished' else 202, {'Location': data['status_url']})
+
+
+@app.route('/reports/jobs/<report_id>')
+def report_status(report_id):
+    status = load_status(report_id)
+    if status is None:
+        return 'Unknown report', 404
+    return json_response(status_json(report_id, status))
+
+
+@app.route('/reports/jobs/<report_id>/download')
+def report_download(report_id):
+    from penguicontrax import conn
+    status = load_status(report_id)
+    if status is None or status.get('status') != 'finished':
+        return 'Report not finished', 404
+    filename = status.get('filename', status['name'])
+    if 'path' in status:
+        response = send_file(status['path'], mimetype=status.get('mimetype'), as_attachment=True,
+                             attachment_filename=filename, add_etags=False, cache_timeout=0)
+        response.last_modified = os.path.getmtime(status['path'])
+    else:
+        key = file_key(report_id)
+        size = conn.strlen(key)
+        if not size:
+            return 'Report expired', 410
+        def chunks():
+            for start in xrange(0, size, CHUNK_SIZE):
+                yield conn.getrange(key, start, start + CHUNK_SIZE - 1)
+        response = Response(chunks(), mimetype=status.get('mimetype') or 'application/octet-stream',
+                            headers={'Content-Length': size,
+                                     'Content-Disposition': 'attachment; filename=%s' % filename})
+        response.last_modified = float(status['finished'])
+    response.set_etag(report_id)
+    return response.make_conditional(request)
@@ -0,0 +1,84 @@
+from sqlalchemy import and_, bindparam, exists, select
+from penguicontrax import db, audit
+from penguicontrax.user import User, rsvps, forget_user
+from penguicontrax.submission import Submission, submission_dataset_changed
+
+# RSVPs spend one of the user's points. Each change is a single transaction:
+# the points are checked and spent by one conditional UPDATE, so parallel
+# clicks can't overdraw them, and the association row, the submission's
+# rsvp_count and the audit entry are written before the one commit.
+# Submissions from before rsvp_count have it NULL until migration 1 fills it
+# in; the first change to one counts its RSVPs instead.
+# The statements are built once and compiled once per process.
+
+users = User.__table__
+submissions = Submission.__table__
+
+spend_point = users.update().where(users.c.id == bindparam('uid')).values(points=users.c.points - 1)
+spend_point_if_left = spend_point.where(users.c.points > 0)
+refund_points = users.update().where(users.c.id == bindparam('uid')).values(
+    points=users.c.points + bindparam('n', type_=db.Integer))
+insert_rsvp = rsvps.insert().from_select(
+    ['submission_id', 'user_id'],
+    select([submissions.c.id, bindparam('uid', type_=db.Integer)]).where(and_(
+        submissions.c.id == bindparam('sid'),
+        ~exists().where(and_(rsvps.c.submission_id == bindparam('sid'), rsvps.c.user_id == bindparam('uid')))))
+)
+delete_rsvp = rsvps.delete().where(and_(rsvps.c.submission_id == bindparam('sid'),
+                                        rsvps.c.user_id == bindparam('uid')))
+count_rsvps = submissions.update().where(submissions.c.id == bindparam('sid')).values(
+    rsvp_count=db.case([(submissions.c.rsvp_count == None,
+                         select([db.func.count()]).where(rsvps.c.submission_id == submissions.c.id).as_scalar())],
+                       else_=submissions.c.rsvp_count + bindparam('n', type_=db.Integer)))
+
+compiled_cache = {}
+
+
+def execute(statement, **params):
+    connection = db.session.connection().execution_options(compiled_cache=compiled_cache)
+    return connection.execute(statement, **params).rowcount
+
+
+def add_rsvp(user, submission, exempt=False):
+    """ RSVPs user to submission, returns False if the user has no points
+        left or already RSVPed. exempt users (staff) may go below zero
+    """
+    user_id, submission_id = user.id, submission.id
+    try:
+        if execute(spend_point if exempt else spend_point_if_left, uid=user_id) == 0:
+            db.session.rollback()
+            return False
+        if execute(insert_rsvp, uid=user_id, sid=submission_id) == 0:
+            db.session.rollback()
+            return False
+        execute(count_rsvps, sid=submission_id, n=1)
+        audit.audit_rsvp(user, submission, commit=False)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    forget_user(user_id)
+    submission_dataset_changed(submission_id)
+    return True
+
+
+def remove_rsvp(user, submission):
+    """ Takes back user's RSVP to submission and refunds the point,
+        returns False if there was no RSVP
+    """
+    user_id, submission_id = user.id, submission.id
+    try:
+        removed = execute(delete_rsvp, uid=user_id, sid=submission_id)
+        if removed == 0:
+            db.session.rollback()
+            return False
+        execute(refund_points, uid=user_id, n=removed)
+        execute(count_rsvps, sid=submission_id, n=-removed)
+        audit.audit_rsvp(user, submission, False, commit=False)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    forget_user(user_id)
+    submission_dataset_changed(submission_id)
+    return True
@@ -0,0 +1,236 @@
+import re
+
+from sqlalchemy import and_, or_, case, text, Integer, Float, literal_column, select
+from sqlalchemy.event import listen
+from sqlalchemy.orm import Session, attributes, object_session, subqueryload
+from penguicontrax import db
+from penguicontrax.submission import Submission, SubmissionToTags, presenter_presenting_in
+from penguicontrax.event import Events, event_tags, presenter_event
+from penguicontrax.tag import Tag
+from penguicontrax.user import Presenter
+
+# Full text search over the title, description, presenter names and tags of
+# submissions and events. Each kind has its own index table keyed by the row
+# id: an FTS5 table on SQLite, a table of weighted tsvectors with a GIN index
+# on PostgreSQL. Databases without either fall back to LIKE over the rows.
+# Submissions are indexed by the code that saves them; the documents that
+# change through something else, a renamed or deleted tag, a renamed
+# presenter or a new event, are collected as the session flushes and
+# reindexed in the same transaction just before it commits.
+
+SEARCH_KINDS = {
+    'submission': (Submission, 'search_submissions'),
+    'event': (Events, 'search_events')
+}
+# rows indexed per query when rebuilding an index
+INDEX_BATCH_SIZE = 500
+# (kind, document id column, tag id column) of the tags of each kind
+TAG_LINKS = [('submission', SubmissionToTags.c.submission_id, SubmissionToTags.c.tag_id),
+             ('event', event_tags.c.event_id, event_tags.c.tag_id)]
+# (kind, document id column, presenter id column) of the presenters of each kind
+PRESENTER_LINKS = [('submission', presenter_presenting_in.c.submission_id, presenter_presenting_in.c.presenter_id),
+                   ('event', presenter_event.c.events_id, presenter_event.c.presenter_id)]
+
+words = re.compile(r'\w+', re.UNICODE)
+
+# engine url -> 'fts5', 'tsvector' or 'like'
+backends = {}
+
+
+def search_backend():
+    """ Returns the search backend of the current database, creating (and
+        filling) the index tables the first time it is used
+    """
+    url = str(db.engine.url)
+    backend = backends.get(url)
+    if backend is None:
+        backend = backends[url] = create_search_index()
+    return backend
+
+
+def create_search_index():
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        backend = 'fts5'
+    elif dialect == 'postgresql':
+        backend = 'tsvector'
+    else:
+        return 'like'
+    created = []
+    for kind, (model, table) in SEARCH_KINDS.items():
+        if db.engine.dialect.has_table(db.session.connection(), table):
+            continue
+        try:
+            if backend == 'fts5':
+                db.session.execute("CREATE VIRTUAL TABLE %s USING fts5(title, people, tags, body, "
+                                   "tokenize='porter unicode61')" % table)
+            else:
+                db.session.execute("CREATE TABLE %s (id INTEGER PRIMARY KEY, document TSVECTOR)" % table)
+                db.session.execute("CREATE INDEX %s_document ON %s USING gin(document)" % (table, table))
+        except Exception as e:
+            # SQLite built without FTS5
+            db.session.rollback()
+            return 'like'
+        created.append(kind)
+    db.session.commit()
+    for kind in created:
+        rebuild_search_index(kind, backend)
+    return backend
+
+
+def document(element):
+    return {
+        'id': element.id,
+        'title': element.title or u'',
+        'people': u' '.join(presenter.name or u'' for presenter in element.presenters),
+        'tags': u' '.join(u'%s %s' % (tag.name, tag.desc or u'') for tag in element.tags),
+        'body': element.description or u''
+    }
+
+
+def index_documents(kind, elements, backend=None):
+    """ Adds or replaces the index entries of elements (submissions or events)
+        The elements must have ids, so flush new ones first. The changes
+        are part of the session's transaction; the caller commits
+    """
+    backend = backend or search_backend()
+    if backend == 'like':
+        return
+    index_rows(kind, [document(element) for element in elements], backend)
+
+
+def index_rows(kind, rows, backend=None):
+    """ index_documents for rows already made into dicts like document()'s """
+    backend = backend or search_backend()
+    if backend == 'like' or len(rows) == 0:
+        return
+    table = SEARCH_KINDS[kind][1]
+    db.session.execute(text('DELETE FROM %s WHERE %s = :id' % (table, 'rowid' if backend == 'fts5' else 'id')),
+                       [{'id': row['id']} for row in rows])
+    if backend == 'fts5':
+        db.session.execute(text('INSERT INTO %s (rowid, title, people, tags, body) '
+                                'VALUES (:id, :title, :people, :tags, :body)' % table), rows)
+    else:
+        db.session.execute(text("INSERT INTO %s (id, document) VALUES (:id, "
+                                "setweight(to_tsvector('english', :title), 'A') || "
+                                "setweight(to_tsvector('english', :tags), 'B') || "
+                                "setweight(to_tsvector('english', :people), 'B') || "
+                                "setweight(to_tsvector('english', :body), 'C'))" % table), rows)
+
+
+def reindex(kind, ids, backend=None):
+    """ index_documents for the rows with the given ids, loaded again so
+        collections already in the session are current
+    """
+    backend = backend or search_backend()
+    if backend == 'like':
+        return
+    model = SEARCH_KINDS[kind][0]
+    for start in range(0, len(ids), INDEX_BATCH_SIZE):
+        batch = model.query.filter(model.id.in_(ids[start:start + INDEX_BATCH_SIZE])).options(
+            subqueryload(model.tags), subqueryload(model.presenters)).populate_existing().all()
+        index_documents(kind, batch, backend)
+
+
+def rebuild_search_index(kind, backend=None):
+    backend = backend or search_backend()
+    if backend == 'like':
+        return
+    model, table = SEARCH_KINDS[kind]
+    db.session.execute('DELETE FROM %s' % table)
+    reindex(kind, [row[0] for row in db.session.query(model.id)], backend)
+    db.session.commit()
+
+
+def mark_for_reindex(session, kind, ids):
+    session.info.setdefault('search_reindex', {}).setdefault(kind, set()).update(ids)
+
+
+def mark_linked_documents(session, links, target_id):
+    for kind, document_id, target_column in links:
+        mark_for_reindex(session, kind, [row[0] for row in session.execute(
+            select([document_id]).where(target_column == target_id))])
+
+
+def collect_renames(session, flush_context, instances):
+    # before the flush, while the links of deleted tags are still there
+    for target in session.dirty:
+        if isinstance(target, Tag) and (attributes.get_history(target, 'name').has_changes() or
+                                        attributes.get_history(target, 'desc').has_changes()):
+            mark_linked_documents(session, TAG_LINKS, target.id)
+        elif isinstance(target, Presenter) and attributes.get_history(target, 'name').has_changes():
+            mark_linked_documents(session, PRESENTER_LINKS, target.id)
+    for target in session.deleted:
+        if isinstance(target, Tag):
+            mark_linked_documents(session, TAG_LINKS, target.id)
+
+
+def mark_event_created(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        mark_for_reindex(session, 'event', [target.id])
+
+
+def reindex_marked(session):
+    # commit would flush next anyway; what it flushes may need reindexing
+    session.flush()
+    marked = session.info.pop('search_reindex', None)
+    backend = backends.get(str(db.engine.url))
+    if not marked or backend is None:
+        # an index that isn't there yet is filled with everything when it's created
+        return
+    for kind, ids in sorted(marked.items()):
+        reindex(kind, sorted(ids), backend)
+
+
+def forget_marked(session, previous_transaction):
+    session.info.pop('search_reindex', None)
+
+listen(Session, 'before_flush', collect_renames)
+listen(Events, 'after_insert', mark_event_created)
+listen(Session, 'before_commit', reindex_marked)
+listen(Session, 'after_soft_rollback', forget_marked)
+
+
+def ranked(kind, q):
+    """ Returns a selectable of (doc_id, rank) for the rows matching the
+        query q, where a higher rank is a better match. Every word of q has
+        to match, the last one as a prefix so it works while typing.
+        Returns None if q has no words
+    """
+    terms = words.findall(q)
+    if len(terms) == 0:
+        return None
+    backend = search_backend()
+    model, table = SEARCH_KINDS[kind]
+    if backend == 'fts5':
+        match = ' '.join('"%s"' % term for term in terms) + '*'
+        # bm25 is lower for better matches; titles weigh most, descriptions least
+        return text('SELECT rowid AS doc_id, -bm25(%s, 10.0, 5.0, 5.0, 1.0) AS rank FROM %s '
+                    'WHERE %s MATCH :match' % (table, table, table)).bindparams(match=match).columns(
+            doc_id=Integer, rank=Float).alias('ranked')
+    elif backend == 'tsvector':
+        query = ' & '.join(terms) + ':*'
+        return text("SELECT id AS doc_id, ts_rank(document, to_tsquery('english', :query)) AS rank FROM %s "
+                    "WHERE document @@ to_tsquery('english', :query)" % table).bindparams(query=query).columns(
+            doc_id=Integer, rank=Float).alias('ranked')
+    criteria = []
+    rank = literal_column('1.0')
+    for term in terms:
+        pattern = '%' + term + '%'
+        rank = rank + case([(model.title.like(pattern), 1.0)], else_=0.0)
+        criteria.append(or_(model.title.like(pattern),
+                            model.description.like(pattern),
+                            model.presenters.any(Presenter.name.like(pattern)),
+                            model.tags.any(Tag.name.like(pattern))))
+    return select([model.id.label('doc_id'), rank.label('rank')]).where(and_(*criteria)).alias('ranked')
+
+
+def search(kind, q, limit=50):
+    """ Returns [(id, rank)] of the best matches of q, best first """
+    matches = ranked(kind, q)
+    if matches is None:
+        return []
+    rows = db.session.execute(select([matches.c.doc_id, matches.c.rank]).order_by(
+        matches.c.rank.desc(), matches.c.doc_id).limit(limit))
+    return [(row[0], row[1]) for row in rows]
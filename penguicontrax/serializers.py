@@ -0,0 +1,213 @@
+import csv
+import operator
+import xml.etree.ElementTree as ET
+
+from sqlalchemy import select
+
+
+class Echo(object):
+    """ A writable file object that returns what was written
+        Lets csv.writer format one line at a time for streaming
+    """
+    def write(self, value):
+        return value
+
+
+def escape_xml_text(text):
+    return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+
+
+def escape_xml_attribute(text):
+    return escape_xml_text(text).replace(u'"', u'&quot;').replace(u'\n', u'&#10;')
+
+
+class XMLWriter(object):
+    """ Writes an XML document an element at a time, without building a tree
+        Every method returns the next piece of the document as UTF-8, so
+        memory doesn't grow with the document. The output is what
+        ElementTree.tostring makes of the same tree, and with pretty set,
+        what it makes after event.indent: one element per line, indented
+        by two spaces per level
+    """
+
+    def __init__(self, pretty=False):
+        self.pretty = pretty
+        self.open = []
+        self.pending = None     # a start tag that may still become <tag />
+        self.started = False
+        self.inline = False     # text was written, so no newline before what follows
+
+    def declaration(self, standalone=False):
+        return '<?xml version="1.0" encoding="UTF-8"%s?>\n' % (' standalone="yes"' if standalone else '')
+
+    def tag(self, tag, attrib):
+        if not attrib:
+            return u'<' + tag
+        return u'<%s %s' % (tag, u' '.join(u'%s="%s"' % (name, escape_xml_attribute(unicode(value)))
+                                           for name, value in sorted(attrib.items())))
+
+    def before(self):
+        """ Closes a pending start tag and starts a new line if pretty """
+        output = u''
+        if self.pending is not None:
+            output = self.pending + u'>'
+            self.pending = None
+        if self.pretty and self.started and not self.inline:
+            output += u'\n' + u'  ' * len(self.open)
+        self.started = True
+        self.inline = False
+        return output
+
+    def start(self, tag, attrib=None):
+        output = self.before()
+        self.pending = self.tag(tag, attrib)
+        self.open.append(tag)
+        return output.encode('utf-8')
+
+    def end(self):
+        tag = self.open.pop()
+        if self.pending is not None:
+            output = self.pending + u' />'
+            self.pending = None
+            return output.encode('utf-8')
+        if not self.pretty or self.inline:
+            self.inline = False
+            return (u'</%s>' % tag).encode('utf-8')
+        # like indent, which ends a root with children with a newline too
+        return (u'\n%s</%s>%s' % (u'  ' * len(self.open), tag, u'' if self.open else u'\n')).encode('utf-8')
+
+    def element(self, tag, text=None, attrib=None):
+        """ An element without children """
+        output = self.before() + self.tag(tag, attrib)
+        if text:
+            output += u'>%s</%s>' % (escape_xml_text(text), tag)
+        else:
+            output += u' />'
+        return output.encode('utf-8')
+
+    def text(self, text):
+        """ Text inside the open element after its last child (mixed content),
+            which like indent leaves on the same line
+        """
+        output = u''
+        if self.pending is not None:
+            output = self.pending + u'>'
+            self.pending = None
+        self.inline = True
+        return (output + escape_xml_text(text)).encode('utf-8')
+
+
+def buffered(pieces, chunk_size=64 * 1024):
+    """ Joins small pieces of a document into chunks of about chunk_size """
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if size > 0:
+        yield ''.join(buffer)
+
+
+def counted(rows, progress):
+    """ Passes the rows through, calling progress() for each """
+    for row in rows:
+        progress()
+        yield row
+
+
+class TableSerializer(object):
+    """ Serializes rows of one table, limited to the given fields
+        Everything that depends on the table (column objects, attribute
+        getters, XML tag names) is worked out once here, so serializing a
+        row is a single getter call. Rows can be ORM objects (through
+        from_objects) or plain Core result rows from execute(), which skips
+        hydrating the ORM entirely.
+    """
+
+    def __init__(self, table, fields=None):
+        self.table = table
+        self.fields = tuple(fields if fields is not None else table.columns.keys())
+        self.columns = [table.columns[field] for field in self.fields]
+        self.tags = [str(field) for field in self.fields]
+        getter = operator.attrgetter(*self.fields)
+        if len(self.fields) == 1:
+            self.getter = lambda element: (getter(element),)
+        else:
+            self.getter = getter
+
+    def select(self, *criteria):
+        """ Returns a Core select of just the serialized columns """
+        query = select(self.columns)
+        for criterion in criteria:
+            query = query.where(criterion)
+        return query
+
+    def execute(self, *criteria):
+        """ Runs select() and returns the result rows as tuples """
+        from penguicontrax import db
+        # stream_results keeps postgres from buffering the whole result
+        return db.session.execute(self.select(*criteria).execution_options(stream_results=True))
+
+    def from_objects(self, elements):
+        """ Converts ORM objects to row tuples """
+        getter = self.getter
+        return (getter(element) for element in elements)
+
+    def dicts(self, rows):
+        """ Yields a dict of field -> value per row """
+        fields = self.fields
+        for row in rows:
+            yield dict(zip(fields, row))
+
+    def json(self, rows):
+        """ Returns the rows as a JSON array, encoded as it is iterated """
+        from penguicontrax.api.streaming import JSONStream
+        return JSONStream(self.dicts(rows))
+
+    def xml(self, rows, parent_node, collection_name, element_name):
+        """ Appends the rows to parent_node, one element per row """
+        collection = ET.SubElement(parent_node, collection_name)
+        tags = self.tags
+        SubElement = ET.SubElement
+        for row in rows:
+            element_node = SubElement(collection, element_name)
+            for index, value in enumerate(row):
+                SubElement(element_node, tags[index]).text = unicode(value)
+        return collection
+
+    def xml_stream(self, rows, writer, collection_name, element_name):
+        """ Yields the rows as XML through writer, one element per row """
+        tags = self.tags
+        yield writer.start(collection_name)
+        for row in rows:
+            yield writer.start(element_name)
+            for index, value in enumerate(row):
+                yield writer.element(tags[index], unicode(value))
+            yield writer.end()
+        yield writer.end()
+
+    def csv(self, rows):
+        """ Yields the rows as CSV lines, starting with a header line """
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.tags)
+        for row in rows:
+            yield writer.writerow([unicode(value).encode('utf-8') if value is not None else ''
+                                   for value in row])
+
+
+serializers = {}
+
+
+def get_serializer(table, fields=None):
+    """ Returns the compiled serializer of the table and field whitelist
+        Serializers are built on first use and shared afterwards
+    """
+    key = (table.name, tuple(fields) if fields is not None else None)
+    serializer = serializers.get(key)
+    if serializer is None:
+        serializer = serializers[key] = TableSerializer(table, fields)
+    return serializer
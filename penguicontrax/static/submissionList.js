@@ -12,12 +12,79 @@
         return Math.floor(Math.random()*100000);
     }
 
+    // the last fetched list for each state is kept in localStorage so a page
+    // load only has to fetch what changed since then from /api/submissions/changes
+    var SNAPSHOT_PREFIX = 'ptrax.submissions.';
+
+    function loadSnapshot(state) {
+        try {
+            return JSON.parse(window.localStorage.getItem(SNAPSHOT_PREFIX + state));
+        } catch (e) {
+            return null;
+        }
+    }
+
+    function saveSnapshot(state, version, submissions) {
+        try {
+            window.localStorage.setItem(SNAPSHOT_PREFIX + state, JSON.stringify({
+                version: version,
+                submissions: submissions
+            }));
+        } catch (e) {
+            //storage is full or disabled, the next page load does a full fetch
+        }
+    }
+
+    function applyChanges(submissions, changes) {
+        var changed = {};
+        _.forEach(changes.deletes, function (id) {
+            changed[id] = true;
+        });
+        _.forEach(changes.upserts, function (submission) {
+            changed[submission.id] = true;
+        });
+        return _.reject(submissions, function (submission) {
+            return changed[submission.id];
+        }).concat(changes.upserts);
+    }
+
+    function findSubmissions(state) {
+        var version = getCookieOrRandom('submission_ver');
+        var snapshot = loadSnapshot(state);
+
+        function fullFetch() {
+            return $.getJSON('/api/submissions', {state: state, ver: version}).then(function (submissions) {
+                saveSnapshot(state, version, submissions);
+                return submissions;
+            });
+        }
+
+        if (!snapshot || isNaN(parseInt(snapshot.version, 10))) {
+            return fullFetch();
+        }
+        if (String(snapshot.version) === String(version)) {
+            return $.Deferred().resolve(snapshot.submissions);
+        }
+        return $.getJSON('/api/submissions/changes', {since: snapshot.version, state: state}).then(function (changes) {
+            if (changes.resync) {
+                return fullFetch();
+            }
+            var submissions = applyChanges(snapshot.submissions, changes);
+            saveSnapshot(state, changes.version, submissions);
+            return submissions;
+        }, fullFetch);
+    }
+
     ptrax.model.Submissions = can.Model.extend({
-        'findAll': "/api/submissions?state=0,1,2&ver=" + getCookieOrRandom('submission_ver')
+        'findAll': function () {
+            return findSubmissions('0,1,2');
+        }
     }, {});
 
     ptrax.model.RejectedSubmissions = can.Model.extend({
-        'findAll': "/api/submissions?state=3&ver=" + getCookieOrRandom('submission_ver')
+        'findAll': function () {
+            return findSubmissions('3');
+        }
     }, {});
 
     ptrax.SubmissionList = can.Control.extend({
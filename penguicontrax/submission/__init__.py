@@ -3,10 +3,13 @@ import datetime
 import json
 import os
 
-from flask import g, request, session, render_template, redirect, Response, Markup, url_for
+from flask import g, request, session, render_template, redirect, Response, Markup, url_for, stream_with_context
 from sqlalchemy.orm import relationship
-from .. import app, db, dump_table_json, uncacheable_response
-from penguicontrax.tag import Tag, get_tag, create_tag
+from redis import WatchError
+from .. import app, db, uncacheable_response, metrics
+from penguicontrax.caching import VersionCounter, cache_key, load_cache_generation, namespaced_key
+from penguicontrax.serializers import get_serializer
+from penguicontrax.tag import Tag, get_tags, create_tag, tag_names
 from penguicontrax.user import User, Presenter, find_user, find_presenter
 
 
@@ -15,20 +18,28 @@ SubmissionToTags = db.Table('submission_tags', db.Model.metadata,
                             db.Column('submission_id', db.Integer(),
                                       db.ForeignKey('submissions.id', ondelete='CASCADE', onupdate='CASCADE')),
                             db.Column('tag_id', db.Integer(),
-                                      db.ForeignKey('tags.id', ondelete='CASCADE', onupdate='CASCADE'))
+                                      db.ForeignKey('tags.id', ondelete='CASCADE', onupdate='CASCADE')),
+                            db.Index('ix_submission_tags_submission_id_tag_id', 'submission_id', 'tag_id'),
+                            db.Index('ix_submission_tags_tag_id', 'tag_id')
 )
 SubmissionToResources = db.Table('submission_resources', db.Model.metadata,
                                  db.Column('submission_id', db.Integer(),
                                            db.ForeignKey('submissions.id', ondelete='CASCADE', onupdate='CASCADE')),
                                  db.Column('resource_id', db.Integer(),
-                                           db.ForeignKey('resources.id', ondelete='CASCADE', onupdate='CASCADE'))
+                                           db.ForeignKey('resources.id', ondelete='CASCADE', onupdate='CASCADE')),
+                                 db.Index('ix_submission_resources_submission_id_resource_id',
+                                          'submission_id', 'resource_id'),
+                                 db.Index('ix_submission_resources_resource_id', 'resource_id')
 )
 
 presenter_presenting_in = db.Table('presenter_presenting_in',
                               db.Column('submission_id', db.Integer,
                                         db.ForeignKey('submissions.id', ondelete='CASCADE', onupdate='CASCADE')),
                               db.Column('presenter_id', db.Integer,
-                                        db.ForeignKey('presenter.id', ondelete='CASCADE', onupdate='CASCADE')))
+                                        db.ForeignKey('presenter.id', ondelete='CASCADE', onupdate='CASCADE')),
+                              db.Index('ix_presenter_presenting_in_submission_id_presenter_id',
+                                       'submission_id', 'presenter_id'),
+                              db.Index('ix_presenter_presenting_in_presenter_id', 'presenter_id'))
 
 
 class Submission(db.Model):
@@ -37,9 +48,9 @@ class Submission(db.Model):
     title = db.Column(db.String())
     description = db.Column(db.String())
     comments = db.Column(db.String())
-    submitter_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    submitter_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     submitter = db.relationship('User', backref='submissions')
-    trackId = db.Column(db.Integer(), db.ForeignKey('tracks.id'))
+    trackId = db.Column(db.Integer(), db.ForeignKey('tracks.id'), index=True)
     track = db.relationship('Track')
     tags = db.relationship('Tag', secondary=SubmissionToTags, backref=db.backref('submissions'), passive_deletes=True)
     duration = db.Column(db.Integer())
@@ -52,16 +63,18 @@ class Submission(db.Model):
     roundTables = db.Column(db.Integer())
     longTables = db.Column(db.Integer())
     facilityRequest = db.Column(db.String())
-    followUpState = db.Column(db.Integer())  # 0 = submitted, 1 = followed up, 2 = accepted, 3 = rejected
+    followUpState = db.Column(db.Integer(), index=True)  # 0 = submitted, 1 = followed up, 2 = accepted, 3 = rejected
     presenters = db.relationship('Presenter', secondary=presenter_presenting_in, backref=db.backref('presenting_in'),
                                      passive_deletes=True)
     private = db.Column(db.Boolean())
     event_created = db.Column(db.Boolean())
     submitted_dt = db.Column(db.DateTime())
+    rsvp_count = db.Column(db.Integer())    # len(rsvped_by), kept up to date by penguicontrax.rsvp
 
     def __init__(self):
         self.private = False
         self.submitted_dt = datetime.datetime.now()
+        self.rsvp_count = 0
 
     def __repr__(self):
         return '<email: %s, title: %s>' % (self.email, self.title)
@@ -148,22 +161,111 @@ class Resource(db.Model):
 
 from penguicontrax import audit
 
-def submission_dataset_changed():
+# Redis hashes backing the per-submission fragment cache used by /api/submissions.
+# Row versions track the data, so unlike the fragments they survive deploys
+SUBMISSION_ROW_VERSIONS = namespaced_key('SUBMISSION_ROW_VERSIONS')
+
+def submission_fragments_key():
+    return cache_key('SUBMISSION_FRAGMENTS')
+
+def submission_fragment_versions_key():
+    return cache_key('SUBMISSION_FRAGMENT_VERSIONS')
+
+# Sorted set of submission id -> dataset version it last changed in, and the
+# oldest version from which the set is still a complete record of changes
+SUBMISSION_CHANGELOG = namespaced_key('SUBMISSION_CHANGELOG')
+SUBMISSION_CHANGELOG_FLOOR = namespaced_key('SUBMISSION_CHANGELOG_FLOOR')
+# number of dataset versions kept in the change log
+SUBMISSION_CHANGELOG_LENGTH = 5000
+
+submission_version = VersionCounter(namespaced_key('SUBMISSION_DATASET_VERSION'))
+
+def submission_dataset_changed(*submission_ids):
+    """ Bumps the dataset version
+        Pass the ids of the submissions that changed so only their cached
+        fragments are rebuilt and the change is recorded in the change log;
+        with no ids every fragment is discarded and clients have to resync
+    """
     from penguicontrax import conn
     if not conn is None:
         try:
-            conn.incr('SUBMISSION_DATASET_VERSION')
+            with conn.pipeline() as pipe:
+                while 1:
+                    try:
+                        pipe.watch(submission_version.key, SUBMISSION_CHANGELOG_FLOOR)
+                        version = int(pipe.get(submission_version.key) or 0) + 1
+                        floor = int(pipe.get(SUBMISSION_CHANGELOG_FLOOR) or 0)
+                        pipe.multi()
+                        pipe.set(submission_version.key, version)
+                        if len(submission_ids) == 0:
+                            pipe.delete(submission_fragments_key(), submission_fragment_versions_key())
+                            floor = version
+                            pipe.set(SUBMISSION_CHANGELOG_FLOOR, floor)
+                        for submission_id in submission_ids:
+                            pipe.hincrby(SUBMISSION_ROW_VERSIONS, submission_id, 1)
+                            pipe.zadd(SUBMISSION_CHANGELOG, submission_id, version)
+                        if version % 100 == 0:
+                            trim = version - SUBMISSION_CHANGELOG_LENGTH
+                            if trim > 0:
+                                pipe.zremrangebyscore(SUBMISSION_CHANGELOG, '-inf', trim)
+                                # the floor only goes up; a change to every
+                                # submission since trim already raised it
+                                if trim > floor:
+                                    pipe.set(SUBMISSION_CHANGELOG_FLOOR, trim)
+                        submission_version.publish(pipe, version)
+                        pipe.execute()
+                        break
+                    except WatchError:
+                        metrics.increment('watch_error_retries_total', operation='submission_version')
+                        continue
+            metrics.increment('dataset_version_bumps_total', dataset='submissions')
+            submission_version.changed(version)
+            return
         except:
             pass
+    metrics.increment('dataset_version_bumps_total', dataset='submissions')
+    submission_version.changed()
+
+def submission_dataset_changes(since):
+    """ Returns (version, ids) with the ids of the submissions changed after
+        the dataset version since, or (version, None) if the change log no
+        longer reaches back that far and the client has to resync
+    """
+    from penguicontrax import conn
+    if conn is None:
+        return submission_dataset_ver(), None
+    with conn.pipeline(transaction=True) as pipe:
+        pipe.get(submission_version.key)
+        pipe.get(SUBMISSION_CHANGELOG_FLOOR)
+        pipe.zrangebyscore(SUBMISSION_CHANGELOG, '(%d' % since, '+inf')
+        version, floor, ids = pipe.execute()
+    if version is None or floor is None or since < int(floor) or since > int(version):
+        return version, None
+    return version, [int(id) for id in ids]
 
 def submission_dataset_ver():
-    from penguicontrax import conn
-    if not conn is None:
-        try:
-            return conn.get('SUBMISSION_DATASET_VERSION')
-        except:
-            pass
-    return '0'
+    try:
+        return submission_version.get()
+    except:
+        return str(submission_version.local)
+
+# the lists loaded by the main page, see static/submissionList.js
+WARM_SUBMISSION_STATES = ['0,1,2', '3']
+
+def warm_submission_cache(generation):
+    """ rq job that builds the common submission lists before traffic arrives
+        Queued by rundeploy.py with the new cache generation. The worker may
+        have started before the deploy, so the generation is read again
+        here; if another deploy has started a newer one since, that deploy
+        queued its own warm-up and this one is dropped
+    """
+    current = load_cache_generation()
+    if current != generation:
+        return 'Generation %d is no longer current (%d), not warmed' % (generation, current)
+    client = app.test_client()
+    for state in WARM_SUBMISSION_STATES:
+        client.get('/api/submissions', query_string={'state': state})
+    return 'Warmed %d submission lists at version %s' % (len(WARM_SUBMISSION_STATES), submission_dataset_ver())
 
 def get_track(name):
     tracks = Track.query.filter(Track.name == name)
@@ -183,10 +285,12 @@ def get_resource(id):
 
 @app.route('/getevent', methods=['GET'])
 def getevent():
+    serializer = get_serializer(Submission.__table__)
     if 'id' in request.args:
-        return Response(dump_table_json(Submission.query.filter_by(id=int(request.args['id'])), Submission.__table__),
-                        mimetype='application/json')
-    return Response(dump_table_json(Submission.query.all(), Submission.__table__), mimetype='application/json')
+        rows = serializer.execute(Submission.id == int(request.args['id']))
+    else:
+        rows = serializer.execute()
+    return Response(stream_with_context(serializer.json(rows)), mimetype='application/json')
 
 
 @app.route('/eventform', methods=['GET'])
@@ -211,17 +315,31 @@ def event_form():
         event = None
 
     # probably need orders
-    tags = [tag.name for tag in Tag.query.all()]
+    tags = tag_names()
     tracks = [track.name for track in Track.query.all()]
     resources = Resource.query.filter_by(displayed_on_requst_form=True)
 
     return render_template('form.html', tags=tags, resources=resources, tracks=tracks, event=event, user=g.user)
 
+# form field -> Submission attribute copied as submitted
+SUBMISSION_FIELDS = {'email': 'email', 'title': 'title', 'description': 'description',
+                     'firstname': 'firstname', 'lastname': 'lastname',
+                     'duration': 'duration', 'setuptime': 'setupTime', 'repetition': 'repetition',
+                     'timerequest': 'timeRequest',
+                     'eventtype': 'eventType', 'players': 'players', 'roundtables': 'roundTables',
+                     'longtables': 'longTables', 'facilityrequest': 'facilityRequest',
+                     'comments': 'comments'}
+
 def validateSubmitEvent(request):
+    return validate_submission_form(request.form)
+
+def validate_submission_form(form):
+    """ Checks a submission's fields (a MultiDict, like request.form) have
+        everything a submission needs
+    """
     returnCode = 200
     returnStatus = 'success'
     returnMessages = []
-    tags = request.form.getlist('tag')
     validationRules = {
         'tag':{'msg':'One or more tags required','type':'list'},
         'description':{'msg':'Description required','type':'str'},
@@ -232,9 +350,9 @@ def validateSubmitEvent(request):
     }
     for index in validationRules:
         if validationRules[index]['type'] == 'list':
-            value = request.form.getlist(index)
+            value = form.getlist(index)
         else:
-            value = request.form.get(index,'');
+            value = form.get(index,'');
         if 0 == len(value):
             returnCode = 400
             returnMessages.append(validationRules[index]['msg']);
@@ -265,14 +383,7 @@ def submitevent():
         submission = Submission()
         old_submission = Submission()
 
-    fields = {'email': 'email', 'title': 'title', 'description': 'description',
-              'firstname': 'firstname', 'lastname': 'lastname',
-              'duration': 'duration', 'setuptime': 'setupTime', 'repetition': 'repetition',
-              'timerequest': 'timeRequest',
-              'eventtype': 'eventType', 'players': 'players', 'roundtables': 'roundTables', 'longtables': 'longTables',
-              'facilityrequest': 'facilityRequest',
-              'comments': 'comments'}
-    for field, dbfield in fields.items():
+    for field, dbfield in SUBMISSION_FIELDS.items():
         if field in request.form:
             setattr(submission, dbfield, request.form[field])
     if 'submitter_id' in request.form:
@@ -305,8 +416,7 @@ def submitevent():
 
     tags = request.form.getlist('tag')
     del submission.tags[:]
-    for tag in tags:
-        submission.tags.append(get_tag(tag))
+    submission.tags.extend(get_tags(tags))
 
     resources = request.form.getlist('resource')
     del submission.resources[:]
@@ -317,10 +427,13 @@ def submitevent():
 
     submission.track = get_track(request.form.get('track'))
     db.session.add(submission)
+    db.session.flush()
+    from penguicontrax.search import index_documents
+    index_documents('submission', [submission])
     db.session.commit()
     audit.audit_change(Submission.__table__, g.user, old_submission,
                        submission)  # We'd like submission.id to actually be real so commit the creation first
-    submission_dataset_changed()
+    submission_dataset_changed(submission.id)
     sendEmail(submission,old_submission)
     return "", 200, {
         "Location": "/"
@@ -375,17 +488,11 @@ def rsvp():
                 break
         if submission is None:
             return redirect('/')
+        from penguicontrax.rsvp import add_rsvp, remove_rsvp
         if value == 'un-RSVP':
-            g.user.rsvped_to.remove(submission)
-            g.user.points += 1
-        else:
-            if g.user.points <= 0 and g.user.staff != 1:
-                return redirect('/')
-            else:
-                g.user.rsvped_to.append(submission)
-                g.user.points -= 1
-        db.session.add(g.user)
-        db.session.commit()
+            remove_rsvp(g.user, submission)
+        elif not add_rsvp(g.user, submission, exempt=g.user.staff == 1):
+            return redirect('/')
         return redirect('/#submission_' + str(submission.id))
     else:
         return redirect('/')
@@ -428,6 +535,8 @@ def checked_if_tracked(submission, trackname):
 
 @app.template_filter()
 def number_total_rsvps(submission):
+    if submission.rsvp_count is not None:
+        return submission.rsvp_count
     return len(submission.rsvped_by)
 
 
@@ -0,0 +1,310 @@
+import csv
+import json
+
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import Integer
+from penguicontrax import app, db
+from penguicontrax.audit import audit_change
+from penguicontrax.search import index_documents
+from penguicontrax.submission import Submission, Track, Resource, SUBMISSION_FIELDS, validate_submission_form, \
+    submission_dataset_changed, sendEmail
+from penguicontrax.tag import Tag, normalize_tag_name
+from penguicontrax.user import User, Presenter
+
+# Creates submissions in bulk, for the batches of proposals partner tracks
+# send. Every row holds the fields /submitevent takes and is checked by the
+# same validator; the tags, tracks, resources, submitters and presenters the
+# batch names are then looked up with one query each, and the valid rows are
+# inserted, indexed and audited in one transaction followed by a single
+# dataset version bump. Rows with errors are reported and left out, the rest
+# of the batch is still ingested. Submitters are only emailed when the
+# caller asks for it, and then by an rq job rather than one message per row
+# in the request.
+
+# most rows /api/submissions/ingest takes in one request; runingest.py has no limit
+INGEST_MAX_ROWS = 5000
+# values per IN clause, under SQLite's limit on query parameters
+INGEST_QUERY_BATCH = 500
+# fields that can have several values; a CSV cell separates them with ';'
+LIST_FIELDS = ['tag', 'resource', 'presenter_id', 'presenter', 'phone', 'email']
+PRESENTER_FIELDS = ['presenter_id', 'presenter', 'phone', 'email']
+INGEST_FORMATS = ['jsonl', 'csv']
+
+
+def parse_jsonl(lines):
+    """ Yields (line number, fields, error) for every object in JSON Lines
+        Values may be strings, numbers or lists of them; false and null
+        count as missing, true as a checked box
+    """
+    for line_number, line in enumerate(lines, 1):
+        if len(line.strip()) == 0:
+            continue
+        try:
+            if isinstance(line, str):
+                line = line.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, 'Not valid JSON: %s' % e
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Expected an object'
+            continue
+        form = MultiDict()
+        for field, values in row.iteritems():
+            for value in values if isinstance(values, list) else [values]:
+                if value is None or value is False:
+                    continue
+                form.add(field, u'on' if value is True else unicode(value))
+        yield line_number, form, None
+
+
+def parse_csv(lines):
+    """ Yields (line number, fields, error) for every record of a CSV file
+        whose first row names the fields; empty cells count as missing
+    """
+    reader = csv.reader(lines)
+    try:
+        header = [field.decode('utf-8-sig').strip() for field in reader.next()]
+    except StopIteration:
+        return
+    except csv.Error as e:
+        yield reader.line_num, None, 'Not valid CSV: %s' % e
+        return
+    while True:
+        try:
+            record = reader.next()
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, None, 'Not valid CSV: %s' % e
+            return
+        if not any(cell.strip() for cell in record):
+            continue
+        if len(record) > len(header):
+            yield reader.line_num, None, 'Expected %d fields, found %d' % (len(header), len(record))
+            continue
+        try:
+            record = [cell.decode('utf-8').strip() for cell in record]
+        except UnicodeDecodeError as e:
+            yield reader.line_num, None, 'Not valid UTF-8: %s' % e
+            continue
+        form = MultiDict()
+        for field, cell in zip(header, record):
+            if len(cell) == 0:
+                continue
+            if field in LIST_FIELDS:
+                for value in cell.split(';'):
+                    form.add(field, value.strip())
+            else:
+                form.add(field, cell)
+        yield reader.line_num, form, None
+
+
+def parse_rows(lines, format):
+    if format == 'csv':
+        return parse_csv(lines)
+    return parse_jsonl(lines)
+
+
+def query_in(query, column, values):
+    """ Runs query once per INGEST_QUERY_BATCH values of column """
+    values = list(set(values))
+    found = []
+    for start in range(0, len(values), INGEST_QUERY_BATCH):
+        found.extend(query.filter(column.in_(values[start:start + INGEST_QUERY_BATCH])))
+    return found
+
+
+def integers(values):
+    """ Returns values as ints, or None if one isn't a whole number """
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        return None
+
+
+def presenter_rows(form):
+    """ (id, name, phone, email) for every presenter in form
+        Unlike the form, rows may leave out trailing ids, phones and emails
+    """
+    columns = [form.getlist(field) for field in PRESENTER_FIELDS]
+    count = max(len(column) for column in columns)
+    return [tuple(column[index] if index < len(column) else u'' for column in columns) for index in range(count)]
+
+
+class IngestBatch(object):
+    """ Everything the rows of a batch refer to, looked up in bulk """
+
+    def __init__(self, forms):
+        tag_names = set()
+        track_names = set()
+        resource_ids = set()
+        user_ids = set()
+        presenter_ids = set()
+        presenter_names = set()
+        for form in forms:
+            tag_names.update(normalize_tag_name(name) for name in form.getlist('tag'))
+            track_names.add(form.get('track'))
+            resource_ids.update(integers(form.getlist('resource')) or [])
+            user_ids.update(integers([form.get('submitter_id')]) or [])
+            for id, name, phone, email in presenter_rows(form):
+                if id:
+                    presenter_ids.update(integers([id]) or [])
+                else:
+                    presenter_names.add(name)
+        self.tags = dict((tag.name, tag) for tag in query_in(Tag.query, Tag.name, tag_names))
+        self.tracks = dict((track.name, track) for track in query_in(Track.query, Track.name, track_names))
+        self.resources = dict((resource.id, resource) for resource in
+                              query_in(Resource.query, Resource.id, resource_ids))
+        self.users = dict((user.id, user) for user in query_in(User.query, User.id, user_ids))
+        self.presenters = dict((presenter.id, presenter) for presenter in
+                               query_in(Presenter.query, Presenter.id, presenter_ids))
+        # presenters given by name, matched like find_presenter: on the name,
+        # and on the phone and email when given, the oldest match first
+        self.presenters_named = {}
+        for presenter in sorted(query_in(Presenter.query, Presenter.name, presenter_names),
+                                key=lambda presenter: presenter.id):
+            self.presenters_named.setdefault(presenter.name, []).append(presenter)
+
+    def find_presenter(self, name, phone, email):
+        for presenter in self.presenters_named.get(name, []):
+            if (not phone or presenter.phone == phone) and (not email or presenter.email == email):
+                return presenter
+        presenter = Presenter(name)
+        presenter.phone = phone
+        presenter.email = email
+        db.session.add(presenter)
+        # later rows naming the same person get this presenter
+        self.presenters_named.setdefault(name, []).append(presenter)
+        return presenter
+
+    def check(self, form):
+        """ Returns the problems with the records form refers to """
+        messages = []
+        for field, dbfield in SUBMISSION_FIELDS.items():
+            column = Submission.__table__.c.get(dbfield)
+            if field in form and column is not None and isinstance(column.type, Integer) and \
+                    integers([form[field]]) is None:
+                messages.append('%s must be a number' % field)
+        if 'followupstate' in form and form['followupstate'] not in ['0', '1', '2', '3']:
+            messages.append('followupstate must be 0, 1, 2 or 3')
+        unknown = [name for name in form.getlist('tag') if normalize_tag_name(name) not in self.tags]
+        if len(unknown) > 0:
+            messages.append('Unknown tags: %s' % ', '.join(unknown))
+        if form.get('track') not in self.tracks:
+            messages.append('Unknown track: %s' % form.get('track'))
+        ids = integers(form.getlist('resource'))
+        if ids is None or any(id not in self.resources for id in ids):
+            messages.append('Unknown resources: %s' % ', '.join(form.getlist('resource')))
+        ids = integers([form.get('submitter_id')])
+        if ids is None or ids[0] not in self.users:
+            messages.append('Unknown submitter: %s' % form.get('submitter_id'))
+        for id, name, phone, email in presenter_rows(form):
+            if id:
+                ids = integers([id])
+                if ids is None or ids[0] not in self.presenters:
+                    messages.append('Unknown presenter: %s' % id)
+            elif not name:
+                messages.append('Presenters need a name or a presenter_id')
+        return messages
+
+    def submission(self, form):
+        """ A new submission from form, as /submitevent would make it """
+        submission = Submission()
+        for field, dbfield in SUBMISSION_FIELDS.items():
+            if field in form:
+                setattr(submission, dbfield, form[field])
+        submission.submitter = self.users[int(form['submitter_id'])]
+        submission.private = 'private' in form
+        submission.followUpState = form.get('followupstate') or 0
+        for id, name, phone, email in presenter_rows(form):
+            presenter = self.presenters[int(id)] if id else self.find_presenter(name, phone, email)
+            if presenter not in submission.presenters:
+                submission.presenters.append(presenter)
+        for name in form.getlist('tag'):
+            tag = self.tags[normalize_tag_name(name)]
+            if tag not in submission.tags:
+                submission.tags.append(tag)
+        for id in form.getlist('resource'):
+            resource = self.resources[int(id)]
+            if resource not in submission.resources:
+                submission.resources.append(resource)
+        submission.track = self.tracks[form['track']]
+        return submission
+
+
+def notify_submitters(ids):
+    """ rq job that sends the emails /submitevent would have sent for the
+        new submissions
+    """
+    # Flask-Mail needs an application context, which a worker doesn't have
+    with app.app_context():
+        for start in range(0, len(ids), INGEST_QUERY_BATCH):
+            for submission in Submission.query.filter(Submission.id.in_(ids[start:start + INGEST_QUERY_BATCH])):
+                sendEmail(submission, Submission())
+    return 'Notified the submitters of %d submissions' % len(ids)
+
+
+def queue_notifications(ids):
+    """ Queues notify_submitters, or runs it here without redis """
+    from penguicontrax import conn, constants
+    from rq import Queue
+    if constants.MAIL_ENABLE != True:
+        return
+    try:
+        Queue('low', connection=conn).enqueue(notify_submitters, ids)
+    except:
+        notify_submitters(ids)
+
+
+def ingest_submissions(rows, user, notify=False):
+    """ Creates a submission for each valid row of (line number, fields,
+        parse error), as user, in one transaction
+        Rows without a submitter_id are submitted by user. The submitters
+        are emailed only if notify is set. Returns (ids of the new
+        submissions, errors) with errors a list of
+        {'line': line number, 'messages': [problems]} for the rows left out
+    """
+    errors = []
+    valid = []
+    for line, form, error in rows:
+        if error is not None:
+            errors.append({'line': line, 'messages': [error]})
+            continue
+        if 'submitter_id' not in form and user is not None:
+            form.add('submitter_id', unicode(user.id))
+        validation = validate_submission_form(form)
+        if validation['status'] != 'success':
+            errors.append({'line': line, 'messages': validation['messages']})
+            continue
+        valid.append((line, form))
+
+    batch = IngestBatch([form for line, form in valid])
+    submissions = []
+    for line, form in valid:
+        messages = batch.check(form)
+        if len(messages) > 0:
+            errors.append({'line': line, 'messages': messages})
+            continue
+        submission = batch.submission(form)
+        db.session.add(submission)
+        submissions.append(submission)
+    errors.sort(key=lambda error: error['line'])
+    if len(submissions) == 0:
+        db.session.rollback()
+        return [], errors
+
+    try:
+        db.session.flush()
+        index_documents('submission', submissions)
+        for submission in submissions:
+            audit_change(Submission.__table__, user, Submission(), submission, commit=False)
+        ids = [submission.id for submission in submissions]
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    submission_dataset_changed(*ids)
+    if notify:
+        queue_notifications(ids)
+    return ids, errors
@@ -1,6 +1,11 @@
 import string
-from .. import db
-from sqlalchemy.exc import IntegrityError
+import time
+from .. import db, metrics
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
+from penguicontrax.caching import VersionCounter, namespaced_key
+from penguicontrax.constants import constants
 import re
 
 class Tag(db.Model):
@@ -19,43 +24,169 @@ class Tag(db.Model):
         return self.name
 
 
+# Every tag is cached per process as plain rows, for the tag lists and to
+# resolve tag names without a query. The cache follows tag_version, which is
+# bumped after any commit that inserts, renames or deletes a tag, and is
+# reloaded with one query when it moves.
+
+tag_version = VersionCounter(namespaced_key('TAG_VERSION'))
+
+
+def mark_tags_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['tags_changed'] = True
+
+event.listen(Tag, 'after_insert', mark_tags_changed)
+event.listen(Tag, 'after_update', mark_tags_changed)
+event.listen(Tag, 'after_delete', mark_tags_changed)
+
+
+def commit_tag_changes(session):
+    if session.info.pop('tags_changed', False):
+        tag_dataset_changed()
+
+
+def forget_tag_changes(session, previous_transaction):
+    session.info.pop('tags_changed', None)
+
+event.listen(Session, 'after_commit', commit_tag_changes)
+event.listen(Session, 'after_soft_rollback', forget_tag_changes)
+
+
+def tag_dataset_changed():
+    from penguicontrax import conn
+    if not conn is None:
+        try:
+            version = conn.incr(tag_version.key)
+            tag_version.publish(conn, version)
+            metrics.increment('dataset_version_bumps_total', dataset='tags')
+            tag_version.changed(version)
+            return
+        except:
+            pass
+    metrics.increment('dataset_version_bumps_total', dataset='tags')
+    tag_version.changed()
+
+
+def tag_dataset_ver():
+    try:
+        return tag_version.get()
+    except:
+        return str(tag_version.local)
+
+
+class TagCache(object):
+    """ Every tag as (id, name, desc, system), in id order and by name
+        Reloaded when tag_version moves, the database changes, or after
+        L1_CACHE_TTL seconds in case an invalidation was missed
+    """
+
+    def __init__(self):
+        self.key = None
+        self.loaded = 0
+        self.rows = []
+        self.by_name = {}
+
+    def get(self):
+        """ Returns (version, rows) """
+        version = tag_dataset_ver()
+        key = (str(db.engine.url), version)
+        if key != self.key or time.time() > self.loaded + constants.L1_CACHE_TTL:
+            tags = Tag.__table__
+            rows = [tuple(row) for row in db.session.execute(
+                select([tags.c.id, tags.c.name, tags.c.desc, tags.c.system]).order_by(tags.c.id))]
+            self.key, self.loaded, self.rows = key, time.time(), rows
+            self.by_name = dict((row[1], row) for row in rows)
+        return self.key[1], self.rows
+
+tag_cache = TagCache()
+
+
+def tag_names():
+    """ Returns the names of every tag, without a query most of the time """
+    return [row[1] for row in tag_cache.get()[1]]
+
+
+def cached_tag(row):
+    """ The Tag of a cached row, added to the session as if it had been
+        loaded
+    """
+    tag = Tag.__mapper__.class_manager.new_instance()
+    for name, value in zip(['id', 'name', 'desc', 'system'], row):
+        set_committed_value(tag, name, value)
+    instance_state(tag).key = Tag.__mapper__.identity_key_from_primary_key([tag.id])
+    return db.session.merge(tag, load=False)
+
+
 def get_tag(name):
     # returns the tag by this name, or None if it doesn't exist
-    name = normalize_tag_name(name)
-    tag = Tag.query.filter(Tag.name == name).first()
-    return tag
+    tags = get_tags([name])
+    return tags[0] if len(tags) > 0 else None
+
+
+def get_tags(names):
+    """ Returns the tags by these names, in the order given, from the tag
+        cache; names it doesn't have are looked up in one query
+        Duplicates and names that aren't tags are left out
+    """
+    names = [normalize_tag_name(name) for name in names]
+    if len(names) == 0:
+        return []
+    tag_cache.get()
+    by_name = tag_cache.by_name
+    found = {}
+    missing = set()
+    for name in names:
+        row = by_name.get(name)
+        if row is not None:
+            found[name] = cached_tag(row)
+        else:
+            missing.add(name)
+    if len(missing) > 0:
+        found.update((tag.name, tag) for tag in Tag.query.filter(Tag.name.in_(missing)))
+    tags = []
+    for name in names:
+        tag = found.pop(name, None)
+        if tag is not None:
+            tags.append(tag)
+    return tags
 
 
 def get_user_tag(name):
     # returns the tag by this name, or None if it doesn't exist
-    name = normalize_tag_name(name)
-    tag = Tag.query.filter(Tag.name == name).filter(Tag.system==False).first()
-    return tag
+    tag = get_tag(name)
+    return tag if tag is not None and tag.system == False else None
+
+
+def create_tags(tags, system=False):
+    """ Returns the tags by the names of tags, a list of (name, desc or
+        None), in the order given, adding the ones that don't exist yet to
+        the session. The caller commits, and looks the tags up again if the
+        commit fails because another request created one first
+    """
+    tags = [(normalize_tag_name(name), desc) for name, desc in tags]
+    found = dict((tag.name, tag) for tag in get_tags([name for name, desc in tags]))
+    output = []
+    for name, desc in tags:
+        if name not in found:
+            found[name] = Tag(name, desc if desc is not None else name, system)
+            db.session.add(found[name])
+        output.append(found[name])
+    return output
 
 
 def create_tag(name, desc=None, system=False):
-    name = normalize_tag_name(name)
-    if desc is None:
-        desc = name
-    tag = Tag.query.filter(Tag.name == name).first()
-    if not tag:
-        try:
-            tag = Tag(name, desc, system)
-            db.session.add(tag)
-            db.session.commit()
-        except IntegrityError:
-            # managed to get created by someone else
-            tag = Tag.query.filter(Tag.name == name).first()
-    return tag
+    """ create_tags for one tag """
+    return create_tags([(name, desc)], system)[0]
+
+removable_characters = re.compile('[^ a-zA-Z0-9\-]')
 
 def normalize_tag_name(name):
     """ Takes a possible name and changes it to only have
         lowercase and - characters
     """
-    removables = re.compile('[^ a-zA-Z0-9\-]')
     name = name.lower().strip()
-    name = removables.sub('', name)
+    name = removable_characters.sub('', name)
     name = "-".join(name.split())
     return name
-
-
@@ -0,0 +1,209 @@
+import bisect
+import re
+import threading
+import time
+
+from sqlalchemy import event, or_, select
+from penguicontrax import db
+from penguicontrax.user import User, Presenter
+
+# seconds between checks for rows added by other processes
+TYPEAHEAD_REFRESH = 5
+# seconds between full rebuilds, which pick up edits made by other processes
+TYPEAHEAD_REBUILD = 600
+# more changed rows than this are picked up by a full rebuild
+TYPEAHEAD_MAX_DIRTY = 1000
+TYPEAHEAD_LIMIT = 10
+MAX_TYPEAHEAD_LIMIT = 100
+
+words = re.compile(r'\w+', re.UNICODE)
+
+
+class TypeaheadIndex(object):
+    """ An in-memory index answering "who starts with..." without a table scan
+        Every searchable field is indexed whole and word by word in a sorted
+        list, so prefixes are found by bisection, and by trigram so that
+        substrings still match. Results are ranked: names starting with the
+        query first, then rows with a word starting with it (closest words
+        first), then rows merely containing it. Every list is kept in the
+        order it is ranked in, so a lookup stops after limit matches.
+        Rows written through this process's sessions are reloaded on the
+        next lookup, rows added by other processes within TYPEAHEAD_REFRESH
+        seconds and rows edited elsewhere at the next full rebuild
+    """
+
+    def __init__(self, model, fields, search_fields):
+        self.model = model
+        self.table = model.__table__
+        self.fields = fields
+        self.search_fields = search_fields
+        self.columns = [self.table.c.id] + [self.table.c[field] for field in set(fields + search_fields) - set(['id'])]
+        self.lock = threading.RLock()
+        self.url = None
+        self.rebuilt = self.refreshed = 0
+        self.dirty = set()
+        self.clear()
+        event.listen(model, 'after_insert', self.mark)
+        event.listen(model, 'after_update', self.mark)
+        event.listen(model, 'after_delete', self.mark)
+
+    def mark(self, mapper, connection, target):
+        self.dirty.add(target.id)
+
+    def clear(self):
+        self.records = {}    # id -> (output fields, lowercase name, tokens, lowercase values)
+        self.names = []      # sorted (lowercase name, id)
+        self.prefixes = []   # sorted (token, lowercase name, id)
+        self.trigrams = {}   # trigram -> [id] in name order
+        self.max_id = 0
+
+    def rows(self, *criteria):
+        query = select(self.columns)
+        for criterion in criteria:
+            query = query.where(criterion)
+        return db.session.execute(query)
+
+    def record(self, row):
+        values = [(row[field] or u'') for field in self.search_fields]
+        values = [value if isinstance(value, unicode) else unicode(value) for value in values]
+        haystack = [value.lower() for value in values if value]
+        tokens = set(haystack)
+        for value in haystack:
+            tokens.update(words.findall(value))
+        name = (row['name'] or u'').lower()
+        return dict((field, row[field]) for field in self.fields), name, tokens, haystack
+
+    @staticmethod
+    def trigrams_of(haystack):
+        return set(value[index:index + 3] for value in haystack for index in range(len(value) - 2))
+
+    def build(self, rows):
+        """ Replaces the whole index with rows (mappings of column -> value)
+            The new index is built aside, lookups keep using the old one
+        """
+        records = dict((row['id'], self.record(row)) for row in rows)
+        names = sorted((record[1], id) for id, record in records.iteritems())
+        prefixes = sorted((token, name, id) for name, id in names for token in records[id][2])
+        trigrams = {}
+        # walking the ids in name order keeps every trigram's list in name order
+        for name, id in names:
+            for trigram in self.trigrams_of(records[id][3]):
+                trigrams.setdefault(trigram, []).append(id)
+        with self.lock:
+            self.records, self.names, self.prefixes, self.trigrams = records, names, prefixes, trigrams
+            self.max_id = max(records) if records else 0
+
+    def position(self, ids, id):
+        """ Where id goes in ids, a list kept in name order """
+        key = (self.records[id][1], id)
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if (self.records[ids[middle]][1], ids[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def remove(self, id):
+        if id not in self.records:
+            return
+        output, name, tokens, haystack = self.records[id]
+        self.discard(self.names, (name, id))
+        for token in tokens:
+            self.discard(self.prefixes, (token, name, id))
+        for trigram in self.trigrams_of(haystack):
+            ids = self.trigrams[trigram]
+            index = self.position(ids, id)
+            if index < len(ids) and ids[index] == id:
+                del ids[index]
+        del self.records[id]
+
+    @staticmethod
+    def discard(entries, entry):
+        index = bisect.bisect_left(entries, entry)
+        if index < len(entries) and entries[index] == entry:
+            del entries[index]
+
+    def update(self, rows, ids):
+        """ Reloads ids (and adds any new rows) from rows; ids missing from
+            rows were deleted or rolled back
+        """
+        with self.lock:
+            for id in ids:
+                self.remove(id)
+            for row in rows:
+                id = row['id']
+                self.remove(id)
+                self.records[id] = output, name, tokens, haystack = self.record(row)
+                bisect.insort(self.names, (name, id))
+                for token in tokens:
+                    bisect.insort(self.prefixes, (token, name, id))
+                for trigram in self.trigrams_of(haystack):
+                    ids = self.trigrams.setdefault(trigram, [])
+                    ids.insert(self.position(ids, id), id)
+                self.max_id = max(self.max_id, id)
+
+    def refresh(self):
+        url = str(db.engine.url)
+        now = time.time()
+        with self.lock:
+            rebuild = self.url != url or now > self.rebuilt + TYPEAHEAD_REBUILD or len(self.dirty) > TYPEAHEAD_MAX_DIRTY
+            if rebuild:
+                self.dirty = set()
+                self.url = url
+                self.rebuilt = self.refreshed = now
+            elif len(self.dirty) > 0 or now > self.refreshed + TYPEAHEAD_REFRESH:
+                dirty, self.dirty = self.dirty, set()
+                criteria = [self.table.c.id > self.max_id]
+                if len(dirty) > 0:
+                    criteria.append(self.table.c.id.in_(dirty))
+                self.update(list(self.rows(or_(*criteria))), dirty)
+                self.refreshed = now
+        if rebuild:
+            self.build(self.rows())
+
+    def lookup(self, q, limit=TYPEAHEAD_LIMIT):
+        """ Returns up to limit rows (dicts of the output fields) matching q, best first """
+        self.refresh()
+        q = (q or u'').strip().lower()
+        with self.lock:
+            if len(q) == 0:
+                return [self.records[id][0] for name, id in self.names[:limit]]
+            found = []
+            seen = set()
+            # names starting with q
+            self.scan(self.names, bisect.bisect_left(self.names, (q,)),
+                      lambda entry: entry[0].startswith(q), found, seen, limit)
+            # any word or field starting with q
+            if len(found) < limit:
+                self.scan(self.prefixes, bisect.bisect_left(self.prefixes, (q,)),
+                          lambda entry: entry[0].startswith(q), found, seen, limit)
+            # anything containing q, walking the rarest of its trigrams
+            if len(found) < limit and len(q) >= 3:
+                ids = min((self.trigrams.get(q[index:index + 3], []) for index in range(len(q) - 2)), key=len)
+                for id in ids:
+                    if len(found) == limit:
+                        break
+                    if id not in seen and any(q in value for value in self.records[id][3]):
+                        found.append(id)
+                        seen.add(id)
+            return [self.records[id][0] for id in found]
+
+    @staticmethod
+    def scan(entries, index, until, found, seen, limit):
+        """ Appends the ids (last item) of entries from index on to found
+            while until(entry) holds, skipping seen ids
+        """
+        while index < len(entries) and len(found) < limit:
+            entry = entries[index]
+            if not until(entry):
+                break
+            if entry[-1] not in seen:
+                found.append(entry[-1])
+                seen.add(entry[-1])
+            index += 1
+
+
+users_index = TypeaheadIndex(User, ['id', 'name', 'email'], ['name', 'email', 'account_name'])
+presenters_index = TypeaheadIndex(Presenter, ['name', 'id', 'email', 'phone'], ['name', 'email', 'phone'])
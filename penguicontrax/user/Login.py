@@ -2,10 +2,10 @@ from flask import g, redirect, request, session, flash, url_for, render_template
 from flask_openid import OpenID
 from flask_oauth import OAuth
 from penguicontrax import constants, uncacheable_response
-from . import lookup_current_user, User, UserLoginIP
+from . import lookup_current_user, remember_user, User, UserLoginIP
 from .. import app, db
 from ..constants import constants
-import urllib, hashlib
+import urllib, hashlib, re
 
 oid = OpenID(app, constants.OPENID_STORE, safe_roots=[])
 oauth = OAuth()
@@ -40,8 +40,12 @@ def gravatar_image_update(user):
 def generate_account_name(user):
     dedupe=0
     base = "".join(user.name.split())
+    # every name the loop could try starts with base, so fetch them at once;
+    # the part of base before any LIKE wildcard matches them all
+    prefix = re.split('[%_]', base)[0]
+    taken = set(row[0] for row in db.session.query(User.account_name).filter(User.account_name.like(prefix + '%')))
     proposed = base
-    while not User.query.filter_by(account_name=proposed).first() is None:
+    while proposed in taken:
         dedupe += 1
         proposed = base + str(dedupe)
     user.account_name = proposed
@@ -93,6 +97,7 @@ def new_openid_user(resp):
         g.user = user
         audit_user_creation(user)
     update_user_login_ip(g.user, session['ip'])
+    remember_user(g.user)
     return redirect(oid.get_next_url())
 
 @app.route('/logout')
@@ -102,6 +107,8 @@ def logout():
     session.pop('oauth_token', None)
     session.pop('oauth_token_secret', None)
     session.pop('fbid', None)
+    session.pop('user_id', None)
+    session.pop('user_key', None)
     return redirect(oid.get_next_url())
 
 @twitter.tokengetter
@@ -157,6 +164,7 @@ def oauth_authorized_facebook(resp):
     g.temp_oauth_token = None
     update_fb_info(g.user)
     update_user_login_ip(g.user, session['ip'])
+    remember_user(g.user)
     return redirect(next_url)
 
 @app.route('/oauth-authorized-twitter')
@@ -182,6 +190,7 @@ def oauth_authorized_twitter(resp):
         g.user = user
         audit_user_creation(user)
     update_user_login_ip(g.user, session['ip'])
+    remember_user(g.user)
     return redirect(next_url)
        
     
\ No newline at end of file
@@ -1,26 +1,38 @@
+import hashlib
+import json
+
 from penguicontrax import constants
 from flask import g, session, Response, render_template, request, redirect
+from flask.ctx import _AppCtxGlobals
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
 from .. import app, db
+from penguicontrax.caching import cache_key
 
 rsvps = db.Table('rsvps',
                 db.Column('submission_id', db.Integer, db.ForeignKey('submissions.id', ondelete='CASCADE', onupdate='CASCADE')),
-                db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE')))
+                db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE')),
+                db.Index('ix_rsvps_user_id_submission_id', 'user_id', 'submission_id', unique=True),
+                db.Index('ix_rsvps_submission_id', 'submission_id'))
 
 event_rsvps = db.Table('event_rsvps',
                 db.Column('event_id', db.Integer, db.ForeignKey('events.id', ondelete='CASCADE', onupdate='CASCADE')),
-                db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE')))
+                db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE', onupdate='CASCADE')),
+                db.Index('ix_event_rsvps_user_id_event_id', 'user_id', 'event_id', unique=True),
+                db.Index('ix_event_rsvps_event_id', 'event_id'))
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String())
-    account_name = db.Column(db.String())
+    name = db.Column(db.String(), index=True)
+    account_name = db.Column(db.String(), index=True, unique=True)
     staff = db.Column(db.Boolean())
     email = db.Column(db.String())
-    openid = db.Column(db.String())
+    openid = db.Column(db.String(), index=True, unique=True)
     points = db.Column(db.Integer())
-    oauth_token = db.Column(db.String())
+    oauth_token = db.Column(db.String(), index=True, unique=True)
     oauth_secret = db.Column(db.String())
-    fbid = db.Column(db.Integer())
+    fbid = db.Column(db.Integer(), index=True, unique=True)
     image_small = db.Column(db.String())
     image_large = db.Column(db.String())
     rsvped_to = db.relationship('Submission', secondary=rsvps, backref=db.backref('rsvped_by', passive_deletes=True))
@@ -47,10 +59,10 @@ class User(db.Model):
     
 class Presenter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String())
+    name = db.Column(db.String(), index=True)
     email = db.Column(db.String())
     phone = db.Column(db.String())
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     user = db.relationship('User')
     presentations = db.relationship('Submission', secondary='presenter_presenting_in', backref=db.backref('presented_by', passive_deletes=True))
     
@@ -61,6 +73,7 @@ class Presenter(db.Model):
         return self.name
     
 class UserLoginIP(db.Model):
+    __table_args__ = (db.Index('ix_user_login_ip_user_id_ip', 'user_id', 'ip'),)
     id = db.Column(db.Integer, primary_key=True)
     ip = db.Column(db.String())
     user_id = db.Column(db.Integer(), db.ForeignKey('user.id'))
@@ -69,19 +82,161 @@ class UserLoginIP(db.Model):
     def __repr__(self):
         return self.ip
 
+# Who is asking is worked out the first time a request touches g.user, so
+# static files and anonymous reads never query for it. Sessions carry the
+# user's id and a fingerprint of their credentials (the session cookie is
+# signed), and the user's columns are shared by every worker through redis
+# for IDENTITY_TTL seconds. Sessions from before only have the credentials; they
+# are looked up the old way once and then upgraded.
+
+# seconds a cached user row is trusted
+IDENTITY_TTL = 30
+# endpoints that never need to know who is asking
+IDENTITY_FREE_ENDPOINTS = set(['static'])
+
+
+class UserGlobals(_AppCtxGlobals):
+    """ flask.g that loads g.user on first use """
+
+    def __getattr__(self, name):
+        if name != 'user':
+            raise AttributeError(name)
+        self.user = current_user()
+        return self.user
+
+app.app_ctx_globals_class = UserGlobals
+
+
 @app.before_request
-def lookup_current_user():
-    g.user = None
+def forget_current_user():
+    g.__dict__.pop('user', None)
+    if request.endpoint in IDENTITY_FREE_ENDPOINTS:
+        g.user = None
+
+
+def credential_fingerprint(user):
+    """ Changes when the credentials the user logs in with change, which ends
+        the sessions made with the old ones
+    """
+    credentials = u'%s|%s|%s' % (user.openid, user.fbid, user.oauth_token)
+    return hashlib.sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
+
+def remember_user(user):
+    session['user_id'] = user.id
+    session['user_key'] = credential_fingerprint(user)
+
+
+def identity_key(user_id):
+    return cache_key('IDENTITY_%d' % user_id)
+
+
+def user_columns(user):
+    return dict((column.key, getattr(user, column.key)) for column in User.__table__.columns)
+
+
+def cached_user(columns):
+    """ The User with the cached column values, added to the session as if
+        it had been loaded; columns the cache doesn't have are loaded when
+        they're first used
+    """
+    user = User.__mapper__.class_manager.new_instance()
+    names = set(column.key for column in User.__table__.columns)
+    for name, value in columns.items():
+        if name in names:
+            set_committed_value(user, name, value)
+    instance_state(user).key = User.__mapper__.identity_key_from_primary_key([user.id])
+    return db.session.merge(user, load=False)
+
+
+def load_user(user_id):
+    """ Returns the user with id user_id, from the identity cache if it has
+        them, without querying
+    """
+    from penguicontrax import conn
+    if conn is not None:
+        try:
+            cached = conn.get(identity_key(user_id))
+            if cached is not None:
+                return cached_user(json.loads(cached))
+        except Exception as e:
+            pass
+    user = User.query.get(user_id)
+    if user is not None and conn is not None:
+        try:
+            conn.setex(identity_key(user_id), json.dumps(user_columns(user)), IDENTITY_TTL)
+        except Exception as e:
+            pass
+    return user
+
+
+def forget_user(user_id):
+    """ Drops user_id from the identity cache; call after changing the row
+        without the ORM
+    """
+    from penguicontrax import conn
+    if conn is not None:
+        try:
+            conn.delete(identity_key(user_id))
+        except Exception as e:
+            pass
+
+
+# the cached row is dropped once the change is committed, so a request
+# that reads it in the meantime can't cache the old one again
+
+def mark_user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(target.id)
+
+
+def forget_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        forget_user(user_id)
+
+
+def keep_changed_users(session, previous_transaction):
+    session.info.pop('changed_users', None)
+
+event.listen(User, 'after_update', mark_user_changed)
+event.listen(User, 'after_delete', mark_user_changed)
+event.listen(Session, 'after_commit', forget_changed_users)
+event.listen(Session, 'after_soft_rollback', keep_changed_users)
+
+
+def current_user():
+    """ Returns the user the session belongs to, or None """
+    if 'user_id' in session:
+        user = load_user(session['user_id'])
+        if user is not None and session.get('user_key') == credential_fingerprint(user):
+            return user
+        session.pop('user_id', None)
+        session.pop('user_key', None)
+        return None
+    user = None
     if 'openid' in session:
         openid = session['openid']
-        g.user = User.query.filter_by(openid=openid).first()
+        user = User.query.filter_by(openid=openid).first()
     elif 'fbid' in session: #This needs to come first -- Facebook sends back different oauth_tokens for each login
         id = session['fbid']
-        g.user = User.query.filter_by(fbid=id).first()
+        user = User.query.filter_by(fbid=id).first()
     elif 'oauth_token' in session:
         oa = session['oauth_token']
-        g.user = User.query.filter_by(oauth_token=oa[0]).first()
-        
+        user = User.query.filter_by(oauth_token=oa[0]).first()
+    if user is not None:
+        remember_user(user)
+    return user
+
+
+def lookup_current_user():
+    """ Sets g.user from the credentials in the session right away, as the
+        login handlers need after storing new ones
+    """
+    session.pop('user_id', None)
+    session.pop('user_key', None)
+    g.user = current_user()
+
 def user_profile(view_user):
     return redirect('/') if view_user is None else render_template('user_profile.html', user=g.user, view_user=view_user)
 
@@ -118,6 +273,9 @@ def update_user():
         db.session.add(view_user)
         db.session.commit()
         audit.audit_change(User.__table__, g.user, old_view_user, view_user)
+        # user details are embedded in every cached submission fragment
+        from penguicontrax.submission import submission_dataset_changed
+        submission_dataset_changed()
         return redirect('/' + view_user.account_name)
     return redirect('/')
 
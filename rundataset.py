@@ -0,0 +1,24 @@
+import argparse
+import time
+import penguicontrax
+from penguicontrax.dataset import generate_dataset, BASE_SIZES
+
+penguicontrax.init()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Adds a synthetic convention to the database set by DATABASE_URL '
+	                                             'for load and scale testing. The same seed and sizes give the '
+	                                             'same data on the same database')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--scale', type=float, default=1,
+	                    help='size relative to one convention of %s' % ', '.join(
+	                        '%d %s' % (count, name) for name, count in sorted(BASE_SIZES.items())))
+	for name in sorted(BASE_SIZES):
+		parser.add_argument('--' + name, type=int, help='number of %s, instead of the scaled number' % name)
+	args = parser.parse_args()
+	start = time.time()
+	convention_id, counts = generate_dataset(args.seed, args.scale,
+	                                         **dict((name, getattr(args, name)) for name in BASE_SIZES))
+	for table, count in sorted(counts.items()):
+		print '%8d %s' % (count, table)
+	print 'Created convention %d in %.1f seconds' % (convention_id, time.time() - start)
@@ -0,0 +1,18 @@
+import penguicontrax
+from rq import Queue
+from penguicontrax.caching import invalidate_cache
+from penguicontrax.submission import submission_dataset_changed, warm_submission_cache
+
+penguicontrax.init()
+conn = penguicontrax.conn
+
+if __name__ == '__main__':
+	if conn is None:
+		print 'No redis connection, nothing to invalidate'
+	else:
+		# drop what older releases cached, then move every client to a new
+		# dataset version so ETags and local caches from before don't match
+		generation = invalidate_cache(conn)
+		submission_dataset_changed()
+		Queue('high', connection=conn).enqueue(warm_submission_cache, generation)
+		print 'Started cache generation %d, warm-up queued' % generation
@@ -0,0 +1,29 @@
+import argparse
+import sys
+import penguicontrax
+from penguicontrax.submission.ingest import ingest_submissions, parse_rows, INGEST_FORMATS
+from penguicontrax.user import User
+
+penguicontrax.init()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Creates submissions in bulk from JSON Lines or CSV, '
+	                                             'in one transaction, reporting the rows left out')
+	parser.add_argument('file', help='file to read, - for standard input')
+	parser.add_argument('--format', choices=INGEST_FORMATS,
+	                    help='jsonl or csv, by default taken from the file extension')
+	parser.add_argument('--staff', required=True,
+	                    help='account name of the staff member the submissions are audited as')
+	parser.add_argument('--notify', action='store_true',
+	                    help='email the submitters as /submitevent would')
+	args = parser.parse_args()
+	user = User.query.filter_by(account_name=args.staff).first()
+	if user is None or not user.staff:
+		sys.exit('%s is not a staff account' % args.staff)
+	format = args.format or ('csv' if args.file.lower().endswith('.csv') else 'jsonl')
+	lines = sys.stdin if args.file == '-' else open(args.file, 'rb')
+	ids, errors = ingest_submissions(parse_rows(lines, format), user, args.notify)
+	for error in errors:
+		print >> sys.stderr, 'Line %d: %s' % (error['line'], '; '.join(error['messages']))
+	print 'Created %d submissions, left out %d rows' % (len(ids), len(errors))
+	sys.exit(1 if len(errors) > 0 else 0)
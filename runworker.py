@@ -2,7 +2,7 @@ import penguicontrax
 from rq import Worker, Queue, Connection
 
 penguicontrax.init()
-listen = ['high', 'default', 'low']
+listen = penguicontrax.constants.RQ_QUEUES
 conn = penguicontrax.conn
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import event
+import penguicontrax
+from penguicontrax import caching
+
+
+def redis_available():
+    """ Whether penguicontrax.conn reaches a redis server, for tests of
+        what only happens with one
+    """
+    if penguicontrax.conn is None:
+        return False
+    try:
+        return penguicontrax.conn.ping()
+    except Exception as e:
+        return False
+
+
+class TempDatabaseTestCase(unittest.TestCase):
+    """Runs every test against a new, empty SQLite database. count_statements()
+       collects the SQL the test runs from then on in self.statements
+    """
+
+    def setUp(self):
+        app = penguicontrax.app
+        self.old_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        penguicontrax.db.session.remove()
+        penguicontrax.db.create_all()
+        if penguicontrax.conn is not None:
+            # redis still has what the last test's database cached
+            try:
+                caching.invalidate_cache(penguicontrax.conn)
+            except Exception as e:
+                pass
+            caching.load_cache_generation()
+        self.statements = []
+        self.counting = False
+
+    def tearDown(self):
+        if self.counting:
+            event.remove(penguicontrax.db.engine, 'before_cursor_execute', self.count)
+        penguicontrax.db.session.remove()
+        penguicontrax.app.config['SQLALCHEMY_DATABASE_URI'] = self.old_uri
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def count_statements(self):
+        """ Only sees connections checked out after it's called, so remove
+            the session first
+        """
+        if not self.counting:
+            event.listen(penguicontrax.db.engine, 'before_cursor_execute', self.count)
+            self.counting = True
+
+    def count(self, connection, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+
+from penguicontrax import caching, constants
+from penguicontrax.caching import LRUCache, VersionCounter, cache_key, invalidate_cache, namespaced_key
+from tempdatabase import redis_available
+
+
+class LRUCacheTest(unittest.TestCase):
+    """The in-process cache must stay under its size, dropping what was
+       used least recently first
+    """
+
+    def test_eviction(self):
+        cache = LRUCache(10, 60)
+        cache.set('a', 'aaaa')
+        cache.set('b', 'bbbb')
+        self.assertEqual(cache.get('a'), 'aaaa')
+        # b is now the least recently used
+        cache.set('c', 'cccc')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'aaaa')
+        self.assertEqual(cache.get('c'), 'cccc')
+        self.assertEqual(cache.size, 8)
+
+    def test_sizes(self):
+        cache = LRUCache(10, 60)
+        cache.set('a', ('aaaa', 'gzip'))
+        self.assertEqual(cache.size, 8)
+        cache.set('a', 'aa')
+        self.assertEqual(cache.size, 2)
+        # too big to cache at all, and nothing else is evicted for it
+        cache.set('b', 'b' * 11)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'aa')
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+    def test_expiry(self):
+        cache = LRUCache(10, -1)
+        cache.set('a', 'aaaa')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+
+class VersionCounterTest(unittest.TestCase):
+    """Dataset versions must only ever go up"""
+
+    def setUp(self):
+        self.conn = penguicontrax.conn
+        self.counter = VersionCounter('TEST_VERSION')
+
+    def tearDown(self):
+        penguicontrax.conn = self.conn
+
+    def test_local(self):
+        # without redis the version is counted in this process
+        penguicontrax.conn = None
+        version = int(self.counter.get())
+        self.counter.changed()
+        self.assertEqual(int(self.counter.get()), version + 1)
+
+    def test_changed(self):
+        self.counter.changed('7')
+        self.assertEqual(self.counter.current, 7)
+        # a bump that another process published first doesn't go back
+        self.counter.changed('5')
+        self.assertEqual(self.counter.current, 7)
+        self.counter.changed(8)
+        self.assertEqual(self.counter.current, 8)
+
+
+class CacheKeyTest(unittest.TestCase):
+    """Cached values must be dropped by a deploy, counters kept"""
+
+    def tearDown(self):
+        caching.load_cache_generation()
+
+    def test_keys(self):
+        self.assertEqual(namespaced_key('COUNT'), constants.CACHE_NAMESPACE + ':COUNT')
+        generation = caching.load_cache_generation()
+        self.assertEqual(cache_key('LIST'), '%s:v%d:g%d:LIST' % (constants.CACHE_NAMESPACE,
+                                                                 constants.CACHE_SCHEMA_VERSION, generation))
+
+    @unittest.skipIf(not redis_available(), 'needs redis')
+    def test_invalidate(self):
+        conn = penguicontrax.conn
+        cached, counter = cache_key('TEST_LIST'), namespaced_key('TEST_COUNT')
+        other_schema = '%s:v0:g0:TEST_LIST' % constants.CACHE_NAMESPACE
+        other_namespace = 'elsewhere:v1:g0:TEST_LIST'
+        for key in [cached, counter, other_schema, other_namespace]:
+            conn.set(key, 1)
+        try:
+            generation = invalidate_cache(conn)
+            self.assertEqual(caching.load_cache_generation(), generation)
+            self.assertNotEqual(cache_key('TEST_LIST'), cached)
+            self.assertFalse(conn.exists(cached))
+            self.assertFalse(conn.exists(other_schema))
+            self.assertTrue(conn.exists(counter))
+            self.assertTrue(conn.exists(other_namespace))
+            # and the next deploy drops this generation's keys
+            conn.set(cache_key('TEST_LIST'), 1)
+            self.assertEqual(invalidate_cache(conn), generation + 1)
+            self.assertFalse(conn.exists(cache_key('TEST_LIST')))
+        finally:
+            conn.delete(counter, other_namespace)
+
+
+if __name__ == "__main__":
+    unittest.main()
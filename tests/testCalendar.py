@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import ical
+from penguicontrax.event import Convention, Events
+from penguicontrax.submission import Track
+from penguicontrax.tag import Tag
+from penguicontrax.user import User
+from tempdatabase import TempDatabaseTestCase
+
+
+class CalendarTest(TempDatabaseTestCase):
+    """The iCalendar feeds must follow RFC 5545 and revalidate"""
+
+    def setUp(self):
+        super(CalendarTest, self).setUp()
+        convention = Convention()
+        convention.name = 'Calcon'
+        convention.url = 'calcon'
+        tag = Tag('robots', 'Robots', True)
+        track = Track('Science', None)
+        user = User()
+        user.name = user.account_name = 'attendee'
+        for title, hour, tags, rsvp in [('Robot Wars', 10, [tag], True), ('Star Party; Outside', 22, [], False)]:
+            e = Events()
+            e.title = title
+            e.description = 'Bring a chair,\nand a blanket'
+            e.start_dt = datetime.datetime(2014, 5, 2, hour)
+            e.duration = 6
+            e.convention = convention
+            e.track = track if not tags else None
+            e.tags = tags
+            if rsvp:
+                e.rsvped_by.append(user)
+            db.session.add(e)
+        db.session.commit()
+        self.user_id = user.id
+
+    def get(self, path, **kwargs):
+        r = app.test_client().get(path, **kwargs)
+        if r.status_code == 200:
+            self.assertTrue(r.headers['Content-Type'].startswith('text/calendar'))
+            for line in r.data.split('\r\n')[:-1]:
+                self.assertTrue(0 < len(line) <= 75, line)
+        return r
+
+    def summaries(self, r):
+        return [line[len('SUMMARY:'):] for line in r.data.split('\r\n') if line.startswith('SUMMARY:')]
+
+    def test_convention(self):
+        r = self.get('/convention/calcon/schedule.ics')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.data.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'))
+        self.assertTrue(r.data.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(self.summaries(r), ['Robot Wars', 'Star Party\; Outside'])
+        self.assertTrue('DTSTART:20140502T220000\r\nDTEND:20140502T233000\r\n' in r.data)
+        self.assertTrue('DESCRIPTION:Bring a chair\\,\\nand a blanket\r\n' in r.data)
+        self.assertEqual(self.get('/convention/calcon/schedule.ics',
+                                  headers={'If-None-Match': r.headers['ETag']}).status_code, 304)
+        self.assertEqual(self.get('/convention/nocon/schedule.ics').status_code, 404)
+
+    def test_track_and_tag(self):
+        self.assertEqual(self.summaries(self.get('/convention/calcon/track/Science.ics')), ['Star Party\; Outside'])
+        self.assertEqual(self.summaries(self.get('/convention/calcon/tag/robots.ics')), ['Robot Wars'])
+        self.assertEqual(self.get('/convention/calcon/tag/nothing.ics').status_code, 404)
+
+    def test_user(self):
+        with app.test_request_context():
+            url = ical.calendar_url(User.query.get(self.user_id))
+        r = self.get(url[len('http://localhost'):])
+        self.assertEqual(self.summaries(r), ['Robot Wars'])
+        self.assertEqual(self.get('/calendar/%d/%s.ics' % (self.user_id, '0' * 20)).status_code, 404)
+
+    def test_fold(self):
+        line = u'DESCRIPTION:' + u'\u2603' * 40
+        folded = ical.fold(line)
+        self.assertTrue(all(len(part) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', '').decode('utf-8'), line + u'\r\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
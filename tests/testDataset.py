@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from sqlalchemy import event
+from penguicontrax import import2013schedule
+from penguicontrax.dataset import generate_dataset
+from penguicontrax.submission import Submission
+from penguicontrax.user import User
+from penguicontrax.user.Login import generate_account_name
+
+SIZES = {'users': 200, 'presenters': 40, 'submissions': 30, 'events': 25, 'rooms': 4}
+
+
+class DatasetTest(unittest.TestCase):
+    """The synthetic dataset must be consistent and the same for the same seed"""
+
+    def setUp(self):
+        self.old_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self.files = []
+
+    def tearDown(self):
+        db.session.remove()
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.old_uri
+        for fd, path in self.files:
+            os.close(fd)
+            os.unlink(path)
+
+    def use_new_database(self):
+        db.session.remove()
+        fd, path = tempfile.mkstemp(suffix='.db')
+        self.files.append((fd, path))
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        db.create_all()
+        import2013schedule.setup_predefined()
+
+    def generate(self, seed):
+        self.use_new_database()
+        return generate_dataset(seed, **SIZES)
+
+    def snapshot(self):
+        return [db.session.execute('SELECT * FROM %s ORDER BY 1, 2' % table).fetchall() for table in
+                ['user', 'submissions', 'rsvps', 'events', 'event_rsvps', 'presenter_presenting_in']]
+
+    def test_consistent(self):
+        convention_id, counts = self.generate(1)
+        self.assertEqual(counts['user'], 200)
+        self.assertEqual(counts['submissions'], 30)
+        self.assertEqual(counts['events'], 25)
+        self.assertEqual(counts['timeslot'] * 4, counts['room_availability'])
+        self.assertEqual(db.session.execute('SELECT count(*) FROM submissions s WHERE rsvp_count != '
+                                            '(SELECT count(*) FROM rsvps r WHERE r.submission_id = s.id)').scalar(), 0)
+        self.assertEqual(db.session.execute('SELECT count(*) FROM user u WHERE points != 5 - '
+                                            '(SELECT count(*) FROM rsvps r WHERE r.user_id = u.id)').scalar(), 0)
+        self.assertEqual(db.session.execute('SELECT count(*) FROM search_submissions').scalar(), 30)
+        # the most popular fifth of the submissions gets far more than a fifth of the RSVPs
+        counts = sorted(row[0] for row in db.session.query(Submission.rsvp_count))
+        self.assertTrue(sum(counts[-6:]) * 3 > sum(counts))
+        # and the ids keep working for rows added later
+        user = User()
+        user.name = 'Later User'
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(user.id, 201)
+
+    def test_reproducible(self):
+        self.generate(5)
+        first = self.snapshot()
+        self.generate(5)
+        self.assertEqual(self.snapshot(), first)
+        self.generate(6)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_account_name_one_query(self):
+        self.use_new_database()
+        for account_name in ['AliceSmith', 'AliceSmith1', 'AliceSmith2', 'Alice_Smith']:
+            user = User()
+            user.name = 'someone'
+            user.account_name = account_name
+            db.session.add(user)
+        candidate = User()
+        db.session.commit()
+        statements = []
+
+        def count(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            candidate.name = 'Alice Smith'
+            generate_account_name(candidate)
+            self.assertEqual(candidate.account_name, 'AliceSmith3')
+            candidate.name = 'Alice_Smith'
+            generate_account_name(candidate)
+            self.assertEqual(candidate.account_name, 'Alice_Smith1')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(len(statements), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
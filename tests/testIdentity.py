@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import json
+import os
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.user import User, cached_user, forget_user, user_columns
+from tempdatabase import TempDatabaseTestCase
+
+
+class IdentityTest(TempDatabaseTestCase):
+    """g.user must be loaded only when used, and sessions must follow credential changes"""
+
+    def setUp(self):
+        super(IdentityTest, self).setUp()
+        user = User()
+        user.name = 'Identity User'
+        user.account_name = 'IdentityUser'
+        user.email = 'identity@example.com'
+        user.openid = 'identity-test-user'
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.remove()
+        self.count_statements()
+
+    def tearDown(self):
+        # the next test's user has the same id
+        forget_user(self.user_id)
+        super(IdentityTest, self).tearDown()
+
+    def me(self, client):
+        """ Returns whether the client is logged in as the test user """
+        r = client.get('/api/user/%d' % self.user_id)
+        self.assertEqual(r.status_code, 200)
+        return 'email' in json.loads(r.data)
+
+    def test_static_skips_lookup(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['openid'] = 'identity-test-user'
+        self.assertEqual(client.get('/static/ptrax.css').status_code, 200)
+        self.assertEqual(self.statements, [])
+
+    def test_legacy_session_upgraded(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['openid'] = 'identity-test-user'
+        self.assertTrue(self.me(client))
+        with client.session_transaction() as session:
+            self.assertEqual(session['user_id'], self.user_id)
+            del session['openid']
+        self.assertTrue(self.me(client))
+
+    def test_credential_change_ends_session(self):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['openid'] = 'identity-test-user'
+        self.assertTrue(self.me(client))
+        user = User.query.get(self.user_id)
+        user.openid = 'relinked-identity'
+        db.session.commit()
+        db.session.remove()
+        self.assertFalse(self.me(client))
+        with client.session_transaction() as session:
+            self.assertFalse('user_id' in session)
+
+    def test_fake_login(self):
+        client = app.test_client()
+        os.environ['PC_FAKE_OID'] = 'identity-test-user'
+        try:
+            self.assertEqual(client.get('/fakelogin').status_code, 302)
+        finally:
+            del os.environ['PC_FAKE_OID']
+        self.assertTrue(self.me(client))
+
+    def test_cached_user(self):
+        columns = json.loads(json.dumps(user_columns(User.query.get(self.user_id))))
+        db.session.remove()
+        del columns['phone']
+        del self.statements[:]
+        user = cached_user(columns)
+        self.assertEqual((user.name, user.email, user.staff), ('Identity User', 'identity@example.com', True))
+        self.assertTrue(User.query.get(self.user_id) is user)
+        self.assertEqual(self.statements, [])
+        # what the cache doesn't have is loaded when it's used
+        self.assertEqual(user.phone, None)
+        self.assertEqual(user.rsvped_to, [])
+        self.assertEqual(len(self.statements), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import constants
+from penguicontrax.audit import Audit
+from penguicontrax.submission import ingest
+from penguicontrax.submission import Submission, Track, Resource, submission_dataset_ver
+from penguicontrax.tag import Tag
+from penguicontrax.user import User, Presenter
+from tempdatabase import TempDatabaseTestCase, redis_available
+
+
+class IngestTest(TempDatabaseTestCase):
+    """Bulk ingest must create the valid rows in one go and report the rest"""
+
+    def setUp(self):
+        super(IngestTest, self).setUp()
+        staff = User()
+        staff.name = 'Ingest Staff'
+        staff.account_name = 'IngestStaff'
+        staff.openid = 'ingest-staff'
+        staff.staff = True
+        guest = User()
+        guest.name = 'Ingest Guest'
+        guest.account_name = 'IngestGuest'
+        guest.openid = 'ingest-guest'
+        guest.staff = False
+        presenter = Presenter('Known Presenter')
+        presenter.email = 'known@example.com'
+        db.session.add_all([staff, guest, presenter, Tag('games', 'Games', True), Tag('science', 'Science', True),
+                            Track('gaming', None), Track('tech', None), Resource('Projector', 'Projector', True)])
+        db.session.commit()
+        self.staff_id, self.presenter_id = staff.id, presenter.id
+        db.session.remove()
+        self.count_statements()
+
+    def client(self, openid='ingest-staff'):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['openid'] = openid
+        return client
+
+    @staticmethod
+    def row(title, **fields):
+        row = {'title': title, 'description': 'About ' + title, 'setuptime': 0, 'eventtype': 'panel',
+               'track': 'gaming', 'tag': ['games'], 'duration': 1}
+        row.update(fields)
+        return json.dumps(row)
+
+    def ingest(self, rows, client=None, **kwargs):
+        r = (client or self.client()).post('/api/submissions/ingest', data='\n'.join(rows) + '\n', **kwargs)
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.data)
+
+    def test_jsonl(self):
+        version = int(submission_dataset_ver())
+        result = self.ingest([
+            self.row('Board Games', presenter=['New Presenter'], email=['new@example.com']),
+            self.row('Missing Fields', description=None, tag=[]),
+            '{not json',
+            self.row('Robots', track='tech', tag=['Science', 'games'], resource=['1'],
+                     presenter_id=[str(self.presenter_id), ''], presenter=['', 'New Presenter'],
+                     email=['', 'new@example.com']),
+            self.row('Unknown', track='cooking', tag=['baking'], duration='long'),
+        ])
+        self.assertEqual(len(result['created']), 2)
+        self.assertEqual([error['line'] for error in result['errors']], [2, 3, 5])
+        self.assertEqual(sorted(result['errors'][0]['messages']), ['Description required', 'One or more tags required'])
+        self.assertEqual(sorted(result['errors'][2]['messages']),
+                         ['Unknown tags: baking', 'Unknown track: cooking', 'duration must be a number'])
+        self.assertEqual(int(submission_dataset_ver()), version + 1)
+
+        board_games, robots = Submission.query.order_by(Submission.id).all()
+        self.assertEqual(board_games.submitter_id, self.staff_id)
+        self.assertEqual(sorted(tag.name for tag in robots.tags), ['games', 'science'])
+        self.assertEqual(robots.track.name, 'tech')
+        self.assertEqual([resource.name for resource in robots.resources], ['Projector'])
+        self.assertEqual(sorted(presenter.name for presenter in robots.presenters), ['Known Presenter', 'New Presenter'])
+        self.assertTrue(board_games.presenters[0] in robots.presenters)
+        self.assertEqual(Presenter.query.count(), 2)
+        self.assertEqual(Audit.query.count(), 2)
+
+    def test_queries_per_batch(self):
+        """ The lookups are per batch, not per row """
+        def selects(count):
+            del self.statements[:]
+            rows = [self.row('Event %d' % index, presenter=['Presenter %d' % index]) for index in range(count)]
+            self.assertEqual(len(self.ingest(rows)['created']), count)
+            return len([statement for statement in self.statements if statement.startswith('SELECT')])
+        selects(1)
+        self.assertEqual(selects(5), selects(40))
+
+    def test_csv(self):
+        data = 'title,description,setuptime,eventtype,track,tag,presenter,email\n' \
+               'Knitting,"Yarn, needles",0,workshop,gaming,games;science,Ann;Bob,ann@example.com;\n' \
+               'No Track,Nothing,0,panel,,games,,\n'
+        r = self.client().post('/api/submissions/ingest', data=data, content_type='text/csv')
+        result = json.loads(r.data)
+        self.assertEqual(len(result['created']), 1)
+        self.assertEqual(result['errors'], [{'line': 3, 'messages': ['Track is required']}])
+        submission = Submission.query.get(result['created'][0])
+        self.assertEqual(submission.description, 'Yarn, needles')
+        self.assertEqual(sorted(tag.name for tag in submission.tags), ['games', 'science'])
+        self.assertEqual(sorted((presenter.name, presenter.email) for presenter in submission.presenters),
+                         [('Ann', 'ann@example.com'), ('Bob', '')])
+
+    def test_staff_only(self):
+        r = self.client('ingest-guest').post('/api/submissions/ingest', data=self.row('Sneaky'))
+        self.assertEqual(r.status_code, 403)
+        self.assertEqual(Submission.query.count(), 0)
+
+    def test_notify(self):
+        notified = []
+        send_email, mail_enable = ingest.sendEmail, constants.MAIL_ENABLE
+        ingest.sendEmail = lambda submission, old_submission: notified.append(submission.title)
+        constants.MAIL_ENABLE = True
+        try:
+            self.ingest([self.row('Quiet')])
+            self.assertEqual(notified, [])
+            ids = self.ingest([self.row('Told'), self.row('Also Told')], query_string={'notify': 1})['created']
+            if redis_available():
+                # sent by a worker, not in the request
+                self.assertEqual(notified, [])
+                from rq import Queue
+                queue = Queue('low', connection=penguicontrax.conn)
+                job = [job for job in queue.jobs if job.func_name.endswith('.notify_submitters')][-1]
+                self.assertEqual(job.args, (ids,))
+                queue.remove(job)
+                ingest.notify_submitters(*job.args)
+            self.assertEqual(sorted(notified), ['Also Told', 'Told'])
+        finally:
+            ingest.sendEmail, constants.MAIL_ENABLE = send_email, mail_enable
+
+
+if __name__ == "__main__":
+    unittest.main()
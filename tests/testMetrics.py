@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import os
+import re
+import tempfile
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import constants, metrics
+from penguicontrax.event.solve import solve_convetion_modeler
+from penguicontrax.tag import Tag
+from tempdatabase import TempDatabaseTestCase
+
+SAMPLE = re.compile(r'^penguicontrax_[a-z_]+(\{[a-z]+="[^"]*"(,[a-z]+="[^"]*")*\})? -?[0-9.e+-]+$')
+
+
+class MetricsTest(TempDatabaseTestCase):
+    """/metrics must export the counters in the Prometheus text format"""
+
+    def scrape(self):
+        r = app.test_client().get('/metrics')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.headers['Content-Type'].startswith('text/plain'))
+        samples = {}
+        for line in r.data.splitlines():
+            if not line.startswith('#'):
+                self.assertTrue(SAMPLE.match(line), line)
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_counters(self):
+        before = self.scrape()
+        app.test_client().get('/api/submissions')
+        db.session.add(Tag('metrics', 'Metrics', True))
+        db.session.commit()
+        after = self.scrape()
+        for sample in ['penguicontrax_submissions_cache_requests_total{result="miss"}',
+                       'penguicontrax_dataset_version_bumps_total{dataset="tags"}']:
+            self.assertEqual(after[sample] - before.get(sample, 0), 1)
+        self.assertTrue('penguicontrax_db_connections_in_use' in after)
+        self.assertEqual(after['penguicontrax_processes'], 1)
+
+    def test_solver(self):
+        before = self.scrape()
+        old_modeler_path = constants.MODELER_PATH
+        constants.MODELER_PATH = os.path.join(tempfile.gettempdir(), 'no-such-modeler')
+        try:
+            self.assertRaises(OSError, solve_convetion_modeler, '1')
+        finally:
+            constants.MODELER_PATH = old_modeler_path
+        after = self.scrape()
+        self.assertEqual(after['penguicontrax_solver_jobs_total{outcome="error"}'] -
+                         before.get('penguicontrax_solver_jobs_total{outcome="error"}', 0), 1)
+        buckets = sorted([(name, value) for name, value in after.items()
+                          if name.startswith('penguicontrax_solver_duration_seconds_bucket')], key=metrics.sample_order)
+        self.assertEqual(buckets[-1][0], 'penguicontrax_solver_duration_seconds_bucket{le="+Inf",outcome="error"}')
+        self.assertEqual(after['penguicontrax_solver_duration_seconds_bucket{le="1",outcome="error"}'],
+                         after['penguicontrax_solver_duration_seconds_count{outcome="error"}'])
+
+    def test_label_escaping(self):
+        self.assertEqual(metrics.sample_name('x', {'a': 'say "hi"\n'}), r'penguicontrax_x{a="say \"hi\"\n"}')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import perf
+from penguicontrax.user import User
+from tempdatabase import TempDatabaseTestCase
+
+
+class PerfTest(TempDatabaseTestCase):
+    """Measured requests must report what they used, and only when enabled"""
+
+    def setUp(self):
+        super(PerfTest, self).setUp()
+        for name, staff in [('PerfStaff', True), ('PerfGuest', False)]:
+            user = User()
+            user.name = user.account_name = user.openid = name
+            user.staff = staff
+            db.session.add(user)
+        db.session.commit()
+        db.session.remove()
+        perf.reset()
+        perf.enable()
+
+    def tearDown(self):
+        perf.disable()
+        perf.reset()
+        super(PerfTest, self).tearDown()
+
+    def client(self, openid):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['openid'] = openid
+        return client
+
+    def test_server_timing(self):
+        r = self.client('PerfGuest').get('/help')
+        self.assertEqual(r.status_code, 200)
+        timings = dict(timing.split(';', 1) for timing in r.headers['Server-Timing'].split(', '))
+        self.assertEqual(sorted(timings), ['redis', 'sql', 'template', 'total'])
+        # the user is loaded for the page
+        self.assertFalse(timings['sql'].endswith('"0 queries"'))
+        self.assertTrue(float(timings['template'][4:]) > 0)
+
+    def test_histograms(self):
+        client = self.client('PerfStaff')
+        for i in range(3):
+            client.get('/help')
+        client.get('/api/submissions')
+        r = client.get('/debug/perf?format=json')
+        endpoints = json.loads(r.data)['endpoints']
+        metrics = endpoints['help']['metrics']
+        self.assertEqual(metrics['total']['count'], 3)
+        self.assertEqual(sum(count for bound, count in metrics['sql_queries']['buckets']), 3)
+        self.assertTrue(metrics['template']['max'] > 0)
+        self.assertEqual(sum(endpoints['submissionsapi']['caches']['submissions'].values()), 1)
+        self.assertEqual(client.get('/debug/perf').status_code, 200)
+        client.post('/debug/perf')
+        # only the reset itself is left
+        self.assertEqual(perf.snapshot().keys(), ['debug_perf'])
+
+    def test_staff_only(self):
+        r = self.client('PerfGuest').get('/debug/perf?format=json')
+        self.assertEqual(r.status_code, 302)
+
+    def test_disabled(self):
+        perf.disable()
+        r = self.client('PerfGuest').get('/help')
+        self.assertFalse('Server-Timing' in r.headers)
+        self.assertEqual(perf.snapshot(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import OperationalError
+from penguicontrax import migrations
+from penguicontrax.audit import Audit
+from penguicontrax.event import Events, Rooms, Convention, Timeslot, room_events, event_tags, event_resources, \
+    presenter_event, room_suitability, room_availability
+from penguicontrax.submission import Submission, SubmissionToTags, SubmissionToResources, presenter_presenting_in
+from penguicontrax.user import User, Presenter, UserLoginIP, rsvps, event_rsvps
+from tempdatabase import TempDatabaseTestCase
+
+ASSOCIATIONS = [rsvps, event_rsvps, SubmissionToTags, SubmissionToResources, presenter_presenting_in,
+                room_events, event_tags, event_resources, presenter_event, room_suitability, room_availability]
+
+
+def hot_queries():
+    """ (name, statement) of the queries run per request or per row """
+    queries = [
+        ('user by openid', User.query.filter_by(openid='x')),
+        ('user by fbid', User.query.filter_by(fbid=1)),
+        ('user by oauth_token', User.query.filter_by(oauth_token='x')),
+        ('user by account_name', User.query.filter_by(account_name='x')),
+        ('user by name', User.query.filter_by(name='x')),
+        ('login ip', UserLoginIP.query.filter_by(user_id=1, ip='127.0.0.1')),
+        ('presenter by name', Presenter.query.filter_by(name='x')),
+        ('presenters of user', Presenter.query.filter_by(user_id=1)),
+        ('submissions by state', db.session.query(Submission.id).filter(
+            or_(Submission.followUpState == 0, Submission.followUpState == 1, Submission.followUpState == 2))),
+        ('submissions by submitter', Submission.query.filter_by(submitter_id=1)),
+        ('submissions by track', Submission.query.filter_by(trackId=1)),
+        ('rsvps of user', db.session.query(Submission).join(rsvps, rsvps.c.submission_id == Submission.id).filter(
+            rsvps.c.user_id == 1)),
+        ('rsvp exists', select([rsvps]).where(and_(rsvps.c.submission_id == 1, rsvps.c.user_id == 1))),
+        ('scheduled events', Events.query.filter(Events.convention_id == 1, Events.start_dt != None)),
+        ('events of convention', Events.query.filter_by(convention_id=1)),
+        ('events by submitter', Events.query.filter_by(submitter_id=1)),
+        ('rooms of convention', Rooms.query.filter_by(convention_id=1)),
+        ('timeslots of convention', Timeslot.query.filter_by(convention_id=1)),
+        ('convention by url', Convention.query.filter_by(url='x')),
+        ('audit of user', Audit.query.filter_by(user_id=1)),
+    ]
+    for table in ASSOCIATIONS:
+        for column in table.columns:
+            queries.append(('%s by %s' % (table.name, column.name), select([table]).where(column == 1)))
+    return queries
+
+
+class QueryPlanTest(TempDatabaseTestCase):
+    """The hot lookups must use an index on SQLite, not scan a whole table"""
+
+    def plan(self, statement):
+        statement = getattr(statement, 'statement', statement)
+        compiled = statement.compile(dialect=db.engine.dialect)
+        params = [compiled.params[name] for name in compiled.positiontup]
+        cursor = db.session.connection().connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + unicode(compiled), params)
+        return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self):
+        for name, statement in hot_queries():
+            plan = self.plan(statement)
+            scans = [step for step in plan if step.startswith('SCAN') and step != 'SCAN CONSTANT ROW']
+            self.assertEqual(scans, [], '%s scans a table: %s' % (name, '; '.join(plan)))
+
+    def test_new_database(self):
+        self.assertIndexed()
+
+    def test_upgraded_database(self):
+        """ A database from before the indexes, upgraded in place """
+        for name, table in db.session.execute("SELECT name, tbl_name FROM sqlite_master "
+                                              "WHERE type = 'index' AND name LIKE 'ix_%'").fetchall():
+            db.session.execute('DROP INDEX %s' % name)
+        db.session.execute('DELETE FROM schema_version')
+        db.session.commit()
+        self.assertEqual(len(self.plan(User.query.filter_by(openid='x'))), 1)
+        self.assertTrue(self.plan(User.query.filter_by(openid='x'))[0].startswith('SCAN'))
+        db.session.remove()
+        self.assertEqual(migrations.upgrade(), [number for number, description, migration in migrations.MIGRATIONS])
+        self.assertEqual(migrations.upgrade(), [])
+        self.assertIndexed()
+
+    def test_racing_upgrade(self):
+        """ A migration another process applied while this one was trying """
+        migrations.upgrade()
+        number = migrations.MIGRATIONS[-1][0] + 1
+        def raced(connection):
+            db.engine.execute(migrations.schema_version.insert(), version=number, description='Raced')
+            connection.execute('CREATE TABLE schema_version (version INTEGER)')
+        def failed(connection):
+            connection.execute('CREATE TABLE schema_version (version INTEGER)')
+        old_migrations = migrations.MIGRATIONS
+        try:
+            migrations.MIGRATIONS = old_migrations + [(number, 'Raced', raced)]
+            self.assertEqual(migrations.upgrade(), [])
+            migrations.MIGRATIONS = old_migrations + [(number, 'Raced', raced), (number + 1, 'Failed', failed)]
+            self.assertRaises(OperationalError, migrations.upgrade)
+        finally:
+            migrations.MIGRATIONS = old_migrations
+
+
+if __name__ == "__main__":
+    unittest.main()
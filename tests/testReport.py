@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import artifacts, constants
+from penguicontrax.submission import Submission, submission_dataset_changed
+from penguicontrax.user import User, Presenter
+from tempdatabase import TempDatabaseTestCase
+
+
+class ReportTest(TempDatabaseTestCase):
+    """/report.csv must be built once per dataset version and revalidate"""
+
+    def setUp(self):
+        super(ReportTest, self).setUp()
+        self.old_artifact_dir = constants.ARTIFACT_DIR
+        constants.ARTIFACT_DIR = tempfile.mkdtemp()
+        # the versions of a single process are as good as shared here
+        self.shared_versions = artifacts.shared_versions
+        artifacts.shared_versions = lambda: True
+
+    def tearDown(self):
+        shutil.rmtree(constants.ARTIFACT_DIR)
+        constants.ARTIFACT_DIR = self.old_artifact_dir
+        artifacts.shared_versions = self.shared_versions
+        super(ReportTest, self).tearDown()
+
+    def add_submissions(self, count):
+        user = User()
+        user.name = user.account_name = 'Reporter %d' % count
+        user.email = 'reporter@example.com'
+        presenter = Presenter(u'Pr\xe9senter')
+        presenter.user = user
+        for index in range(count):
+            submission = Submission()
+            submission.title = u'Event %d' % index
+            submission.description = 'About, "quoted"'
+            submission.duration = 1
+            submission.submitter = user
+            submission.presenters = [presenter, Presenter('Other %d' % index)]
+            db.session.add(submission)
+        db.session.commit()
+        db.session.remove()
+        submission_dataset_changed()
+
+    def get(self, **kwargs):
+        del self.statements[:]
+        return app.test_client().get('/report.csv', **kwargs)
+
+    def test_csv(self):
+        self.add_submissions(3)
+        self.count_statements()
+        r = self.get()
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['Content-Length'], str(len(r.data)))
+        rows = list(csv.reader(StringIO(r.data)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], 'Reporter 3')
+        self.assertEqual(rows[1][3], 'About, "quoted"')
+        self.assertEqual(rows[1][11:], ['True', u'Pr\xe9senter,Other 0'.encode('utf-8')])
+
+        # served again from the file, and revalidated without it
+        self.assertEqual(self.get().data, r.data)
+        self.assertEqual(len(self.statements), 0)
+        self.assertEqual(self.get(headers={'If-None-Match': r.headers['ETag']}).status_code, 304)
+
+        submission_dataset_changed()
+        changed = self.get(headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], r.headers['ETag'])
+        # the old version's file is gone
+        self.assertEqual(len([name for name in os.listdir(constants.ARTIFACT_DIR) if not name.endswith('.lock')]), 1)
+
+    def test_unshared_versions(self):
+        self.add_submissions(2)
+        artifacts.shared_versions = lambda: False
+        self.count_statements()
+        r = self.get()
+        self.assertNotEqual(len(self.statements), 0)
+        self.assertEqual(len(r.data.splitlines()), 3)
+        self.assertFalse('ETag' in r.headers)
+        self.assertEqual(os.listdir(constants.ARTIFACT_DIR), [])
+
+    def test_newer_version_deletes(self):
+        """ A worker sending an older version while a newer one is built """
+        write = lambda text: lambda f: f.write(text)
+        old = artifacts.open_artifact('test.csv', 'old', write('old'))
+        # the newer build deletes the old file, the open one can still be sent
+        artifacts.build_artifact('test.csv', 'new', write('new'))
+        self.assertFalse(os.path.exists(artifacts.artifact_path('test.csv', 'old')))
+        self.assertEqual(old.read(), 'old')
+        old.close()
+        # deleted between build_artifact and the open, it's built again
+        build_artifact = artifacts.build_artifact
+        built = []
+        def deleted(name, key, build):
+            if not built:
+                built.append(key)
+                return artifacts.artifact_path(name, 'deleted')
+            return build_artifact(name, key, build)
+        artifacts.build_artifact = deleted
+        try:
+            f = artifacts.open_artifact('test.csv', 'old', write('old'))
+        finally:
+            artifacts.build_artifact = build_artifact
+        self.assertEqual(f.read(), 'old')
+        f.close()
+
+    def test_queries_per_batch(self):
+        self.add_submissions(5)
+        self.count_statements()
+        self.get()
+        few = len(self.statements)
+        self.add_submissions(60)
+        self.get()
+        self.assertEqual(len(self.statements), few)
+
+
+if __name__ == "__main__":
+    unittest.main()
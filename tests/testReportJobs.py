@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import artifacts, constants, reports
+from penguicontrax.event import Convention
+from penguicontrax.submission import Submission, submission_dataset_changed
+from tempdatabase import TempDatabaseTestCase
+
+
+class ReportJobsTest(TempDatabaseTestCase):
+    """Reports requested at /reports must be built once and downloadable"""
+
+    def setUp(self):
+        super(ReportJobsTest, self).setUp()
+        self.old_artifact_dir = constants.ARTIFACT_DIR
+        constants.ARTIFACT_DIR = tempfile.mkdtemp()
+        for index in range(3):
+            submission = Submission()
+            submission.title = 'Report job %d' % index
+            db.session.add(submission)
+        convention = Convention()
+        convention.name = convention.url = 'reportcon'
+        db.session.add(convention)
+        db.session.commit()
+        self.convention_id = convention.id
+
+    def tearDown(self):
+        shutil.rmtree(constants.ARTIFACT_DIR)
+        constants.ARTIFACT_DIR = self.old_artifact_dir
+        super(ReportJobsTest, self).tearDown()
+
+    def request(self, path, report, convention_id=None):
+        client = app.test_client()
+        r = client.post(path)
+        data = json.loads(r.data)
+        self.assertEqual(r.headers['Location'], 'http://localhost' + data['status_url'])
+        if r.status_code == 202:
+            # queued on redis; run the job here
+            self.assertEqual(data['status'], 'queued')
+            reports.run_report(data['id'], report, convention_id)
+            # kept in redis, not where only this machine can see it
+            self.assertFalse([name for name in os.listdir(constants.ARTIFACT_DIR) if name.startswith(data['id'])])
+        else:
+            self.assertEqual(r.status_code, 200)
+        # asking again while it's there doesn't build another
+        self.assertEqual(json.loads(client.post(path).data)['id'], data['id'])
+        status = json.loads(client.get(data['status_url']).data)
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual(status['progress'], 1.0)
+        return client.get(status['download_url'])
+
+    def test_csv(self):
+        r = self.request('/reports/report.csv', 'report.csv')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['Content-Disposition'], 'attachment; filename=report.csv')
+        self.assertEqual(r.data, app.test_client().get('/report.csv').data)
+        self.assertEqual(len(r.data.splitlines()), 4)
+        self.assertEqual(app.test_client().get('/reports/jobs/%s/download' % ('0' * 20)).status_code, 404)
+
+    def test_schedule(self):
+        path = '/reports/schedule.xml?convention=%d' % self.convention_id
+        r = self.request(path, 'schedule.xml', self.convention_id)
+        self.assertTrue(r.data.startswith('<?xml'))
+        self.assertEqual(app.test_client().post('/reports/schedule.xml?convention=999').status_code, 404)
+        self.assertEqual(app.test_client().post('/reports/other.csv').status_code, 404)
+
+    def test_newer_version(self):
+        client = app.test_client()
+        data = json.loads(client.post('/reports/report.csv').data)
+        if data['status'] == 'queued':
+            reports.run_report(data['id'], 'report.csv')
+        download_url = json.loads(client.get(data['status_url']).data)['download_url']
+        submission = Submission()
+        submission.title = 'Report job 3'
+        db.session.add(submission)
+        db.session.commit()
+        submission_dataset_changed(submission.id)
+        # building newer versions doesn't take the finished report away
+        self.assertEqual(len(client.get('/report.csv').data.splitlines()), 5)
+        self.assertNotEqual(json.loads(client.post('/reports/report.csv').data)['id'], data['id'])
+        r = client.get(download_url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.data.splitlines()), 4)
+
+    def test_queue_error(self):
+        """ Only a missing redis builds the report in the request """
+        request_report, conn = reports.request_report, penguicontrax.conn
+        def broken(*args):
+            raise RuntimeError('enqueue failed')
+        reports.request_report = broken
+        penguicontrax.conn = object()
+        old_propagate = app.config.get('PROPAGATE_EXCEPTIONS')
+        app.config['PROPAGATE_EXCEPTIONS'] = True
+        try:
+            self.assertRaises(RuntimeError, app.test_client().post, '/reports/report.csv')
+        finally:
+            reports.request_report, penguicontrax.conn = request_report, conn
+            app.config['PROPAGATE_EXCEPTIONS'] = old_propagate
+        self.assertEqual(os.listdir(constants.ARTIFACT_DIR), [])
+
+    def test_progress(self):
+        rows = []
+        with app.test_request_context():
+            spec = reports.get_report('report.xml')
+            self.assertEqual(spec.count(), 3)
+            with open(os.path.join(constants.ARTIFACT_DIR, 'out.xml'), 'wb') as f:
+                spec.write(f, lambda: rows.append(1))
+        self.assertEqual(len(rows), 3)
+
+    def test_retention(self):
+        old = artifacts.artifact_path('report.csv', 'old')
+        new = artifacts.artifact_path('report.csv', 'new')
+        for path in [old, new, old + '.lock']:
+            open(path, 'w').close()
+        os.utime(old, (time.time() - 100, time.time() - 100))
+        artifacts.expire_artifacts(50)
+        self.assertEqual(sorted(os.listdir(constants.ARTIFACT_DIR)), sorted([os.path.basename(new),
+                                                                            os.path.basename(old) + '.lock']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.audit import Audit
+from penguicontrax.submission import Submission
+from penguicontrax.user import User, rsvps
+from tempdatabase import TempDatabaseTestCase
+
+
+class RsvpTest(TempDatabaseTestCase):
+    """Parallel RSVP clicks must never overdraw a user's points"""
+
+    def setUp(self):
+        super(RsvpTest, self).setUp()
+        user = User()
+        user.name = 'RSVP User'
+        user.account_name = 'RSVPUser'
+        user.openid = 'rsvp-test-user'
+        user.staff = False
+        db.session.add(user)
+        for index in range(20):
+            submission = Submission()
+            submission.title = 'Submission %d' % index
+            submission.followUpState = 0
+            db.session.add(submission)
+        db.session.commit()
+        self.user_id = user.id
+        self.points = user.points
+        self.submission_ids = [submission.id for submission in Submission.query]
+        db.session.remove()
+
+    def click(self, submission_id, method, statuses):
+        t = app.test_client(self)
+        with t.session_transaction() as session:
+            session['openid'] = 'rsvp-test-user'
+        r = t.open('/api/submission/%d/rsvp' % submission_id, method=method)
+        statuses.append(r.status_code)
+
+    def click_in_parallel(self, clicks):
+        statuses = []
+        threads = [threading.Thread(target=self.click, args=(submission_id, method, statuses))
+                   for submission_id, method in clicks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db.session.remove()
+        self.assertEqual(len(statuses), len(clicks))
+        self.assertTrue(set(statuses) <= set([200, 400]), "Unexpected statuses %s" % statuses)
+        return statuses
+
+    def assertConsistent(self):
+        user = User.query.get(self.user_id)
+        rsvped = db.session.query(rsvps).filter(rsvps.c.user_id == self.user_id).count()
+        self.assertEqual(user.points, self.points - rsvped)
+        self.assertTrue(user.points >= 0, "Points went negative: %d" % user.points)
+        for submission in Submission.query:
+            self.assertEqual(submission.rsvp_count, len(submission.rsvped_by))
+        return rsvped
+
+    def test_parallel_rsvps(self):
+        # every submission clicked twice, more clicks than the user has points
+        statuses = self.click_in_parallel([(id, 'POST') for id in self.submission_ids * 2])
+        rsvped = self.assertConsistent()
+        self.assertEqual(rsvped, self.points)
+        self.assertEqual(statuses.count(200), self.points)
+        self.assertEqual(Audit.query.count(), self.points)
+
+    def test_parallel_un_rsvps(self):
+        rsvped_ids = self.submission_ids[:self.points]
+        self.click_in_parallel([(id, 'POST') for id in rsvped_ids])
+        statuses = self.click_in_parallel([(id, 'DELETE') for id in rsvped_ids * 2])
+        self.assertEqual(self.assertConsistent(), 0)
+        self.assertEqual(statuses.count(200), self.points)
+
+    def test_uncounted_submission(self):
+        # RSVPs made before rsvp_count was added
+        submission_id = self.submission_ids[0]
+        other = User()
+        other.name = other.account_name = 'Earlier RSVP'
+        db.session.add(other)
+        db.session.flush()
+        db.session.execute(rsvps.insert().values(submission_id=submission_id, user_id=other.id))
+        db.session.execute(Submission.__table__.update().values(rsvp_count=None))
+        db.session.commit()
+        db.session.remove()
+        self.click_in_parallel([(submission_id, 'POST'), (self.submission_ids[1], 'POST')])
+        self.assertEqual(Submission.query.get(submission_id).rsvp_count, 2)
+        self.assertEqual(Submission.query.get(self.submission_ids[1]).rsvp_count, 1)
+        self.click_in_parallel([(submission_id, 'DELETE')])
+        self.assertEqual(Submission.query.get(submission_id).rsvp_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import datetime
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import artifacts, constants
+from penguicontrax.event import Convention, Events, Rooms, create_schedule_XML
+from penguicontrax.submission import Track
+from penguicontrax.tag import Tag
+from penguicontrax.user import Presenter
+from tempdatabase import TempDatabaseTestCase
+
+BOOK = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<events xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+        '  <document>\n'
+        '    <day>Friday</day>\n'
+        '    <time>4 PM</time>\n'
+        '    <div class="section">\n'
+        '      <div class="what question">Late Show</div>\n'
+        '      <div class="what question" />\n'
+        '      <div class="where question">Annex</div>\n'
+        '      <div class="what question">\n'
+        '        <div class="who question" /> Fun &amp; &lt;games&gt; <div class="when question">2 hours</div>\n'
+        '      </div>\n'
+        '    </div>\n'
+        '    <div class="section">\n'
+        '      <div class="what question">Opening</div>\n'
+        '      <div class="what question">Literature, Music &amp; Dance</div>\n'
+        '      <div class="where question">Main</div>\n'
+        '      <div class="what question">\n'
+        '        <div class="who question">Alice, Bob</div>\n'
+        '      </div>\n'
+        '    </div>\n'
+        '    <day>Saturday</day>\n'
+        '    <time>9:30 AM</time>\n'
+        '    <div class="section">\n'
+        '      <div class="what question">Caf\xc3\xa9</div>\n'
+        '      <div class="what question" />\n'
+        '      <div class="where question" />\n'
+        '      <div class="what question">\n'
+        '        <div class="who question" />\n'
+        '        <div class="when question">1 hour and 45 minutes</div>\n'
+        '      </div>\n'
+        '    </div>\n'
+        '  </document>\n'
+        '</events>\n')
+
+
+class ScheduleTest(TempDatabaseTestCase):
+    """The schedule book must have every scheduled event in the 2013 format,
+       take the same queries however big it is, and be built once per version
+    """
+
+    def setUp(self):
+        super(ScheduleTest, self).setUp()
+        self.old_artifact_dir = constants.ARTIFACT_DIR
+        constants.ARTIFACT_DIR = tempfile.mkdtemp()
+        # the versions of a single process are as good as shared here
+        self.shared_versions = artifacts.shared_versions
+        artifacts.shared_versions = lambda: True
+        self.convention_id = self.add_convention()
+        db.session.remove()
+        self.count_statements()
+
+    def tearDown(self):
+        shutil.rmtree(constants.ARTIFACT_DIR)
+        constants.ARTIFACT_DIR = self.old_artifact_dir
+        artifacts.shared_versions = self.shared_versions
+        super(ScheduleTest, self).tearDown()
+
+    def add_event(self, convention, title, start_dt, duration, rooms=[], presenters=[], tags=[], track=None,
+                  description=None):
+        e = Events()
+        e.title = title
+        e.description = description
+        e.start_dt = start_dt
+        e.duration = duration
+        e.convention = convention
+        e.rooms = rooms
+        e.presenters = presenters
+        e.tags = tags
+        e.track = track
+        db.session.add(e)
+        return e
+
+    def add_convention(self):
+        convention = Convention()
+        convention.name = convention.url = 'bookcon'
+        convention.timeslot_duration = datetime.timedelta(hours=1)
+        rooms = []
+        for name in ['Main', 'Annex']:
+            room = Rooms()
+            room.room_name = name
+            room.convention = convention
+            rooms.append(room)
+        friday = datetime.datetime(2013, 4, 26, 16)
+        self.add_event(convention, 'Opening', friday, 4, rooms=[rooms[0]],
+                       presenters=[Presenter('Bob'), Presenter('Alice')], tags=[Tag('music', 'Music & Dance', True)],
+                       track=Track('Literature', None), description='')
+        self.add_event(convention, 'Late Show', friday, 8, rooms=[rooms[1]], description='Fun & <games>')
+        self.add_event(convention, u'Caf\xe9', datetime.datetime(2013, 4, 27, 9, 30), 7)
+        self.add_event(convention, 'Unscheduled', None, 4, rooms=[rooms[0]])
+        db.session.commit()
+        return convention.id
+
+    def test_book(self):
+        with app.test_request_context():
+            document = ''.join(create_schedule_XML(self.convention_id))
+        self.assertEqual(document, BOOK)
+        # what import2013schedule reads of it
+        sections = ET.fromstring(document).find('document').findall('div')
+        self.assertEqual(sections[0][3][0].tail, ' Fun & <games> ')
+
+    def test_queries(self):
+        with app.test_request_context():
+            ''.join(create_schedule_XML(self.convention_id))
+            few = len(self.statements)
+            convention = Convention.query.get(self.convention_id)
+            room = Rooms.query.first()
+            tag = Tag.query.first()
+            for index in range(30):
+                self.add_event(convention, 'Panel %d' % index, datetime.datetime(2013, 4, 28, index % 12), 4,
+                               rooms=[room], presenters=[Presenter('Panelist %d' % index)], tags=[tag])
+            db.session.commit()
+            del self.statements[:]
+            self.assertEqual(''.join(create_schedule_XML(self.convention_id)).count('class="section"'), 33)
+        self.assertEqual(len(self.statements), few)
+
+    def test_cached(self):
+        client = app.test_client()
+        del self.statements[:]
+        r = client.get('/convention/bookcon/schedulexml')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, BOOK)
+        self.assertEqual(r.headers['Content-Disposition'], 'attachment;filename=penguicon.schedule.xml')
+
+        # only the convention is read again
+        del self.statements[:]
+        again = client.get('/conventionschedulexml?id=%d' % self.convention_id)
+        self.assertEqual(again.data, BOOK)
+        self.assertEqual(again.headers['ETag'], r.headers['ETag'])
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(client.get('/convention/bookcon/schedulexml',
+                                    headers={'If-None-Match': r.headers['ETag']}).status_code, 304)
+
+        e = Events.query.filter_by(title='Opening').first()
+        e.title = 'Grand Opening'
+        db.session.commit()
+        changed = client.get('/convention/bookcon/schedulexml', headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], r.headers['ETag'])
+        self.assertTrue('>Grand Opening<' in changed.data)
+
+        tag = Tag.query.first()
+        tag.desc = 'Music'
+        db.session.commit()
+        self.assertTrue('>Literature, Music<' in client.get('/convention/bookcon/schedulexml').data)
+
+    def test_missing(self):
+        client = app.test_client()
+        self.assertEqual(client.get('/convention/nocon/schedulexml').status_code, 302)
+        self.assertEqual(client.get('/conventionschedulexml').status_code, 302)
+        self.assertEqual(client.get('/conventionschedulexml?id=999').status_code, 302)
+
+
+if __name__ == "__main__":
+    unittest.main()
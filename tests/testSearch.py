@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import search
+from penguicontrax.event import Events
+from penguicontrax.submission import Submission, submission_dataset_changed
+from penguicontrax.tag import Tag
+from penguicontrax.user import Presenter
+from tempdatabase import TempDatabaseTestCase
+
+
+class SearchTest(TempDatabaseTestCase):
+    """/api/submissions?q= must rank matches and see updates right away"""
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.add_submission('Zombie Tag', 'Run from the horde', 'Alice', 'games')
+        self.add_submission('Knitting circle', 'Zombie themed patterns welcome', 'Bob', 'crafts')
+        self.add_submission('Python for beginners', 'Learn to program', 'Carol', 'programming')
+
+    def add_submission(self, title, description, presenter, tag):
+        submission = Submission()
+        submission.title = title
+        submission.description = description
+        submission.followUpState = 0
+        submission.presenters.append(Presenter(presenter))
+        submission.tags.append(Tag(tag, tag, False))
+        db.session.add(submission)
+        db.session.flush()
+        search.index_documents('submission', [submission])
+        db.session.commit()
+        submission_dataset_changed(submission.id)
+
+    def titles(self, url):
+        r = app.test_client(self).get(url)
+        self.assertEqual(r.status_code, 200, "GET %s failed with %s" % (url, r.status_code))
+        return [submission['title'] for submission in json.loads(r.data)['submissions']]
+
+    def test_ranked_search(self):
+        self.assertEqual(self.titles('/api/submissions?q=zombie'), ['Zombie Tag', 'Knitting circle'])
+        self.assertEqual(self.titles('/api/submissions?q=zomb&sort=title'), ['Knitting circle', 'Zombie Tag'])
+        self.assertEqual(self.titles('/api/submissions?q=carol'), ['Python for beginners'])
+        self.assertEqual(self.titles('/api/submissions?q=crafts'), ['Knitting circle'])
+        self.assertEqual(self.titles('/api/submissions?q=vampire'), [])
+
+    def test_incremental_update(self):
+        self.add_submission('Vampire hunting', 'Bring stakes', 'Dan', 'horror')
+        self.assertEqual(self.titles('/api/submissions?q=vampire'), ['Vampire hunting'])
+        submission = Submission.query.filter_by(title='Zombie Tag').first()
+        submission.title = 'Werewolf Tag'
+        search.index_documents('submission', [submission])
+        db.session.commit()
+        submission_dataset_changed(submission.id)
+        self.assertEqual(self.titles('/api/submissions?q=zombie'), ['Knitting circle'])
+        self.assertEqual(self.titles('/api/submissions?q=werewolf'), ['Werewolf Tag'])
+
+    def matches(self, kind, q):
+        model = search.SEARCH_KINDS[kind][0]
+        return sorted(model.query.get(id).title for id, rank in search.search(kind, q))
+
+    def test_renamed_tag(self):
+        tag = Tag.query.filter_by(name='games').first()
+        tag.name, tag.desc = 'boardgames', 'Tabletop'
+        db.session.commit()
+        self.assertEqual(self.matches('submission', 'tabletop'), ['Zombie Tag'])
+        self.assertEqual(self.matches('submission', 'games'), [])
+        db.session.delete(Tag.query.filter_by(name='crafts').first())
+        db.session.commit()
+        self.assertEqual(self.matches('submission', 'crafts'), [])
+
+    def test_renamed_presenter(self):
+        Presenter.query.filter_by(name='Carol').first().name = 'Dana'
+        db.session.commit()
+        self.assertEqual(self.matches('submission', 'dana'), ['Python for beginners'])
+        self.assertEqual(self.matches('submission', 'carol'), [])
+
+    def test_new_event(self):
+        event = Events()
+        event.title = 'Juggling'
+        event.description = 'Three balls and up'
+        event.presenters.append(Presenter.query.filter_by(name='Alice').first())
+        db.session.add(event)
+        db.session.commit()
+        self.assertEqual(self.matches('event', 'juggling'), ['Juggling'])
+        self.assertEqual(self.matches('event', 'alice'), ['Juggling'])
+        self.assertEqual(self.matches('event', 'zombie'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import datetime
+import json
+import unittest
+import xml.etree.ElementTree as ET
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax import dump_table
+from penguicontrax.serializers import get_serializer
+from penguicontrax.submission import Submission
+from tempdatabase import TempDatabaseTestCase
+
+
+class SerializersTest(TempDatabaseTestCase):
+    """Compiled serializers must match dump_table, from ORM objects or Core rows"""
+
+    def setUp(self):
+        super(SerializersTest, self).setUp()
+        for index in range(3):
+            submission = Submission()
+            submission.title = u'Submission %d \u2603' % index
+            submission.followUpState = index
+            submission.submitted_dt = datetime.datetime(2014, 1, index + 1)
+            db.session.add(submission)
+        db.session.commit()
+
+    def test_core_rows_match_dump_table(self):
+        table = Submission.__table__
+        expected = [dict((col, getattr(element, col)) for col in table.columns.keys())
+                    for element in Submission.query.order_by(Submission.id)]
+        serializer = get_serializer(table)
+        self.assertEqual(dump_table(Submission.query.order_by(Submission.id), table), expected)
+        self.assertEqual(list(serializer.dicts(serializer.execute())), expected)
+
+    def test_field_whitelist(self):
+        serializer = get_serializer(Submission.__table__, ['id', 'title', 'submitted_dt'])
+        self.assertTrue(serializer is get_serializer(Submission.__table__, ['id', 'title', 'submitted_dt']))
+        output = json.loads(''.join(serializer.json(serializer.execute(Submission.followUpState == 1))))
+        self.assertEqual(output, [{'id': 2, 'title': u'Submission 1 \u2603', 'submitted_dt': '2014-01-02T00:00:00'}])
+
+        root = ET.Element('root')
+        serializer.xml(serializer.execute(), root, 'submissions', 'submission')
+        self.assertEqual([node.find('title').text for node in root.find('submissions')],
+                         [u'Submission %d \u2603' % index for index in range(3)])
+
+        lines = list(serializer.csv(serializer.execute()))
+        self.assertEqual(lines[0], 'id,title,submitted_dt\r\n')
+        self.assertEqual(lines[1], '1,Submission 0 \xe2\x98\x83,2014-01-01 00:00:00\r\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
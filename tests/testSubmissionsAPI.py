@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+import datetime
+import json
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.api.functions import available_encodings
+from penguicontrax.api import DateEncoder
+from penguicontrax.api.streaming import JSONStream
+from penguicontrax.api.submissions import SubmissionsAPI
+from penguicontrax.submission import Submission, Track, SUBMISSION_CHANGELOG_LENGTH, submission_dataset_changed, \
+    submission_version
+from penguicontrax.tag import Tag
+from penguicontrax.user import User
+from tempdatabase import TempDatabaseTestCase, redis_available
+
+
+class SubmissionsAPITest(TempDatabaseTestCase):
+    """/api/submissions must revalidate whatever encoding it was sent in"""
+
+    def setUp(self):
+        super(SubmissionsAPITest, self).setUp()
+        for index in range(3):
+            submission = Submission()
+            submission.title = 'Listed %d' % index
+            submission.followUpState = 0
+            db.session.add(submission)
+        db.session.commit()
+        db.session.remove()
+        submission_dataset_changed()
+
+    def test_etag(self):
+        client = app.test_client()
+        etags = {}
+        for encoding in available_encodings():
+            r = client.get('/api/submissions', headers={'Accept-Encoding': encoding})
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.data)
+            etags[r.headers.get('Content-Encoding', 'identity')] = r.headers['ETag']
+        # without redis the list is only sent unencoded
+        self.assertTrue('identity' in etags)
+        self.assertEqual(len(set(etags.values())), len(etags))
+        for encoding, etag in etags.items():
+            r = client.get('/api/submissions', headers={'Accept-Encoding': encoding, 'If-None-Match': etag})
+            self.assertEqual(r.status_code, 304)
+            self.assertEqual(r.headers['ETag'], etag)
+
+        submission_dataset_changed()
+        r = client.get('/api/submissions', headers={'If-None-Match': etags['identity']})
+        self.assertEqual(len(json.loads(r.data)), 3)
+
+
+class JSONStreamTest(unittest.TestCase):
+    """A streamed list must be the JSON json.dumps would have sent, and only
+       be kept when it's small enough
+    """
+
+    rows = [{'id': index, 'title': u'Row %d' % index, 'submitted_dt': datetime.datetime(2014, 1, index + 1),
+             'tags': [{'id': 'games', 'desc': 'Games'}]} for index in range(20)]
+
+    def test_chunks(self):
+        stream = JSONStream(self.rows, chunk_size=200)
+        chunks = list(stream)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), json.dumps(self.rows, cls=DateEncoder))
+        self.assertEqual(''.join(JSONStream([])), '[]')
+        self.assertEqual(''.join(JSONStream(iter([]))), '[]')
+
+    def test_keep_bytes(self):
+        document = json.dumps(self.rows, cls=DateEncoder)
+        kept = []
+        self.assertEqual(''.join(JSONStream(self.rows, 200, kept.append, len(document))), document)
+        self.assertEqual(kept, [document])
+        kept = []
+        self.assertEqual(''.join(JSONStream(self.rows, 200, kept.append, len(document) - 1)), document)
+        self.assertEqual(kept, [])
+        list(JSONStream([], 200, kept.append, 2))
+        self.assertEqual(kept, ['[]'])
+
+
+@unittest.skipIf(not redis_available(), 'needs redis')
+class FragmentCacheTest(TempDatabaseTestCase):
+    """Cached submission fragments must only be rebuilt for the rows that
+       changed
+    """
+
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        for index in range(3):
+            submission = Submission()
+            submission.title = 'Fragment %d' % index
+            submission.followUpState = 0
+            db.session.add(submission)
+        db.session.commit()
+        self.ids = [submission.id for submission in Submission.query.order_by(Submission.id)]
+        db.session.remove()
+        submission_dataset_changed()
+        self.query_fragments = SubmissionsAPI.query_fragments
+        self.rebuilt = []
+        def query_fragments(ids):
+            self.rebuilt.append(sorted(ids))
+            return self.query_fragments(ids)
+        SubmissionsAPI.query_fragments = staticmethod(query_fragments)
+
+    def tearDown(self):
+        SubmissionsAPI.query_fragments = staticmethod(self.query_fragments)
+        super(FragmentCacheTest, self).tearDown()
+
+    def fragments(self):
+        self.rebuilt = []
+        with app.test_request_context():
+            return [json.loads(fragment) if fragment is not None else None
+                    for fragment in SubmissionsAPI.cached_fragments(self.ids)]
+
+    def test_rebuilt(self):
+        titles = [fragment['title'] for fragment in self.fragments()]
+        self.assertEqual(titles, ['Fragment 0', 'Fragment 1', 'Fragment 2'])
+        self.assertEqual(self.rebuilt, [self.ids])
+        self.count_statements()
+        self.assertEqual([fragment['title'] for fragment in self.fragments()], titles)
+        self.assertEqual(self.rebuilt, [])
+        self.assertEqual(self.statements, [])
+
+        submission = Submission.query.get(self.ids[1])
+        submission.title = 'Renamed'
+        db.session.commit()
+        db.session.remove()
+        submission_dataset_changed(self.ids[1])
+        titles = [fragment['title'] for fragment in self.fragments()]
+        self.assertEqual(titles, ['Fragment 0', 'Renamed', 'Fragment 2'])
+        self.assertEqual(self.rebuilt, [[self.ids[1]]])
+
+        # without ids every fragment goes
+        submission_dataset_changed()
+        self.fragments()
+        self.assertEqual(self.rebuilt, [self.ids])
+
+    def test_deleted(self):
+        self.fragments()
+        db.session.delete(Submission.query.get(self.ids[0]))
+        db.session.commit()
+        db.session.remove()
+        submission_dataset_changed(self.ids[0])
+        fragments = self.fragments()
+        self.assertEqual(fragments[0], None)
+        self.assertEqual([fragment['title'] for fragment in fragments[1:]], ['Fragment 1', 'Fragment 2'])
+        self.assertEqual(self.rebuilt, [[self.ids[0]]])
+
+
+class SubmissionChangesTest(TempDatabaseTestCase):
+    """/api/submissions/changes must send what changed since a version, or
+       tell the client to resync when it can't
+    """
+
+    def setUp(self):
+        super(SubmissionChangesTest, self).setUp()
+        for index in range(3):
+            submission = Submission()
+            submission.title = 'Changed %d' % index
+            submission.followUpState = 0
+            db.session.add(submission)
+        db.session.commit()
+        self.ids = [submission.id for submission in Submission.query.order_by(Submission.id)]
+        db.session.remove()
+        submission_dataset_changed()
+
+    def changes(self, since, state=None):
+        url = '/api/submissions/changes?since=%d' % since
+        if state is not None:
+            url += '&state=' + state
+        r = app.test_client().get(url)
+        self.assertEqual(r.status_code, 200)
+        data = json.loads(r.data)
+        self.assertTrue(isinstance(data['version'], int))
+        return data
+
+    @unittest.skipIf(not redis_available(), 'needs redis')
+    def test_changes(self):
+        start = self.changes(0)['version']
+        data = self.changes(start)
+        self.assertEqual((data['version'], data['resync'], data['upserts'], data['deletes']), (start, False, [], []))
+
+        submission = Submission.query.get(self.ids[1])
+        submission.title = 'Renamed'
+        db.session.delete(Submission.query.get(self.ids[0]))
+        submission = Submission()
+        submission.title = 'Archived'
+        submission.followUpState = 3
+        db.session.add(submission)
+        db.session.commit()
+        archived_id = submission.id
+        db.session.remove()
+        submission_dataset_changed(self.ids[1])
+        submission_dataset_changed(self.ids[0], archived_id)
+
+        data = self.changes(start)
+        self.assertEqual(data['version'], start + 2)
+        self.assertFalse(data['resync'])
+        self.assertEqual([upsert['title'] for upsert in data['upserts']], ['Renamed'])
+        self.assertEqual(data['deletes'], sorted([self.ids[0], archived_id]))
+        data = self.changes(start, '3')
+        self.assertEqual([upsert['title'] for upsert in data['upserts']], ['Archived'])
+        self.assertEqual(data['deletes'], sorted(self.ids[:2]))
+        data = self.changes(start + 1)
+        self.assertEqual(data['deletes'], sorted([self.ids[0], archived_id]))
+        self.assertEqual(self.changes(start + 2)['upserts'], [])
+
+        # from before the log starts, after the current version, or across
+        # a change of every submission there's nothing to go on
+        self.assertTrue(self.changes(start - 1)['resync'])
+        self.assertTrue(self.changes(start + 3)['resync'])
+        submission_dataset_changed()
+        data = self.changes(start + 2)
+        self.assertEqual((data['version'], data['resync'], data['upserts'], data['deletes']),
+                         (start + 3, True, [], []))
+
+    @unittest.skipIf(not redis_available(), 'needs redis')
+    def test_trim_keeps_floor(self):
+        # jump to just before a trim of the change log
+        version = self.changes(0)['version']
+        version = (version // 100 + SUBMISSION_CHANGELOG_LENGTH // 100 + 1) * 100 - 2
+        penguicontrax.conn.set(submission_version.key, version)
+        submission_dataset_changed()
+        submission_dataset_changed(self.ids[0])
+        data = self.changes(version)
+        self.assertEqual(data['version'], version + 2)
+        self.assertTrue(data['resync'])
+        self.assertEqual(self.changes(version + 1)['upserts'][0]['id'], self.ids[0])
+
+    @unittest.skipIf(redis_available(), 'redis keeps a change log')
+    def test_without_log(self):
+        # every client has to resync
+        data = self.changes(0)
+        self.assertTrue(data['resync'])
+        self.assertTrue(self.changes(data['version'])['resync'])
+
+    def test_errors(self):
+        self.assertEqual(app.test_client().get('/api/submissions/changes').status_code, 400)
+        self.assertEqual(app.test_client().get('/api/submissions/changes?since=new').status_code, 400)
+
+
+class SubmissionPagesTest(TempDatabaseTestCase):
+    """Pages of /api/submissions must filter, sort and page through every
+       submission exactly once
+    """
+
+    def setUp(self):
+        super(SubmissionPagesTest, self).setUp()
+        users = []
+        for name in ['Ann', 'Ben']:
+            user = User()
+            user.name = user.account_name = name
+            users.append(user)
+        music, crafts = Tag('music', 'Music', True), Tag('crafts', 'Crafts', True)
+        track = Track('Music', None)
+        for title, tags, track, event_type, day, rsvps, submitter in [
+                ('Banjo', [music], track, 'Panel', 3, 2, users[0]),
+                ('Anvil', [crafts], None, 'Workshop', 1, 5, users[1]),
+                ('Cello', [music], track, 'Workshop', None, 0, users[0]),
+                ('Drum', [music, crafts], None, 'Panel', 2, 2, users[1]),
+                ('Egg', [], None, 'Panel', None, 1, users[1])]:
+            submission = Submission()
+            submission.title = title
+            submission.followUpState = 0
+            submission.tags = tags
+            submission.track = track
+            submission.eventType = event_type
+            submission.submitted_dt = datetime.datetime(2014, 1, day) if day is not None else None
+            submission.rsvp_count = rsvps
+            submission.submitter = submitter
+            db.session.add(submission)
+        db.session.commit()
+        self.submitter_id = users[0].id
+        db.session.remove()
+        submission_dataset_changed()
+
+    def get(self, url):
+        r = app.test_client().get(url)
+        self.assertEqual(r.status_code, 200, 'GET %s failed with %s' % (url, r.status_code))
+        return json.loads(r.data)
+
+    def titles(self, url):
+        """ Every title, following the cursors two at a time """
+        titles = []
+        page = self.get(url + '&limit=2')
+        while 1:
+            self.assertTrue(len(page['submissions']) <= 2)
+            titles += [submission['title'] for submission in page['submissions']]
+            if page['next'] is None:
+                return titles
+            page = self.get('%s&limit=2&cursor=%s' % (url, page['next']))
+
+    def test_filters(self):
+        self.assertEqual(self.titles('/api/submissions?tag=music'), ['Banjo', 'Drum', 'Cello'])
+        self.assertEqual(self.titles('/api/submissions?tag=music&tag=crafts'), ['Drum'])
+        self.assertEqual(self.titles('/api/submissions?track=Music'), ['Banjo', 'Cello'])
+        self.assertEqual(self.titles('/api/submissions?eventtype=Workshop'), ['Anvil', 'Cello'])
+        self.assertEqual(self.titles('/api/submissions?submitter=%d' % self.submitter_id), ['Banjo', 'Cello'])
+        self.assertEqual(self.titles('/api/submissions?state=3&sort=title'), [])
+
+    def test_sorts(self):
+        # submissions without a date come last, newest id first
+        self.assertEqual(self.titles('/api/submissions?sort=newest'), ['Banjo', 'Drum', 'Anvil', 'Egg', 'Cello'])
+        self.assertEqual(self.titles('/api/submissions?sort=rsvps'), ['Anvil', 'Drum', 'Banjo', 'Egg', 'Cello'])
+        self.assertEqual(self.titles('/api/submissions?sort=title'), ['Anvil', 'Banjo', 'Cello', 'Drum', 'Egg'])
+        shuffled = self.titles('/api/submissions?sort=random&seed=7')
+        self.assertEqual(sorted(shuffled), ['Anvil', 'Banjo', 'Cello', 'Drum', 'Egg'])
+        self.assertEqual(self.titles('/api/submissions?sort=random&seed=7'), shuffled)
+
+    def test_random_without_seed(self):
+        r = app.test_client().get('/api/submissions?sort=random')
+        self.assertEqual(r.status_code, 200)
+        # a page nobody can ask for again isn't cached
+        self.assertFalse('ETag' in r.headers)
+        page = json.loads(r.data)
+        again = self.get('/api/submissions?sort=random&seed=%d' % page['seed'])
+        self.assertEqual(again['submissions'], page['submissions'])
+
+    def test_errors(self):
+        client = app.test_client()
+        self.assertEqual(client.get('/api/submissions?sort=sideways').status_code, 400)
+        self.assertEqual(client.get('/api/submissions?sort=relevance').status_code, 400)
+        self.assertEqual(client.get('/api/submissions?sort=newest&cursor=nonsense').status_code, 400)
+        self.assertEqual(client.get('/api/submissions?rsvped=1').status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
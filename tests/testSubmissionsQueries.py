@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import unittest
+
+import penguicontrax
+from sqlalchemy import event
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.submission import Submission, submission_dataset_changed
+from penguicontrax.tag import Tag
+from penguicontrax.user import User, Presenter
+from tempdatabase import TempDatabaseTestCase
+
+
+class SubmissionsQueryCountTest(TempDatabaseTestCase):
+    """The submissions list must be loaded in a fixed number of queries"""
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def add_submissions(self, count):
+        offset = Submission.query.count()
+        for index in range(offset, offset + count):
+            user = User()
+            user.name = 'User %d' % index
+            user.account_name = 'User%d' % index
+            presenter = Presenter('Presenter %d' % index)
+            presenter.user = user
+            submission = Submission()
+            submission.title = 'Submission %d' % index
+            submission.followUpState = 0
+            submission.submitter = user
+            submission.presenters.append(presenter)
+            submission.tags.append(Tag('tag-%d' % index, 'Tag %d' % index, False))
+            submission.rsvped_by.append(user)
+            db.session.add(submission)
+        db.session.commit()
+        db.session.expunge_all()
+        submission_dataset_changed()
+
+    def count_list_queries(self):
+        t = app.test_client(self)
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+        try:
+            r = t.get('/api/submissions')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        self.assertEqual(r.status_code, 200, "GET /api/submissions failed with %s" % r.status_code)
+        return len(self.statements)
+
+    def test_query_count_is_constant(self):
+        self.add_submissions(5)
+        small = self.count_list_queries()
+        self.add_submissions(50)
+        large = self.count_list_queries()
+        self.assertEqual(small, large, "Query count grew from %d to %d with the dataset" % (small, large))
+        self.assertTrue(large <= 5, "Submissions list issued %d queries" % large)
+
+
+if __name__ == "__main__":
+    unittest.main()
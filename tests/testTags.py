@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.tag import Tag, create_tags, get_tag, get_tags, get_user_tag
+from penguicontrax.user import User
+from tempdatabase import TempDatabaseTestCase
+
+
+class TagCacheTest(TempDatabaseTestCase):
+    """Tag lists must come from the cache, with ETags, and follow tag changes"""
+
+    def setUp(self):
+        super(TagCacheTest, self).setUp()
+        user = User()
+        user.name = 'Tag User'
+        user.account_name = 'TagUser'
+        user.openid = 'tag-test-user'
+        user.staff = True
+        db.session.add(user)
+        db.session.add(Tag('games', 'Games', True))
+        db.session.add(Tag('knitting', 'knitting', False))
+        db.session.commit()
+        db.session.remove()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['openid'] = 'tag-test-user'
+        self.count_statements()
+
+    def user_tags(self):
+        r = self.client.get('/api/user-tags')
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.data), r.headers['ETag']
+
+    def test_etag(self):
+        r = self.client.get('/api/tags')
+        self.assertEqual(json.loads(r.data), [{'id': 'games', 'desc': 'Games'}])
+        del self.statements[:]
+        r = self.client.get('/api/tags', headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(self.statements, [])
+
+    def test_create_rename_delete(self):
+        tags, etag = self.user_tags()
+        self.assertEqual(tags, ['knitting'])
+        self.assertEqual(self.client.post('/api/user-tags', data={'id': 'Sewing Circle'}).status_code, 200)
+        tags, created_etag = self.user_tags()
+        self.assertEqual(tags, ['knitting', 'sewing-circle'])
+        self.assertNotEqual(created_etag, etag)
+        self.assertEqual(self.client.put('/api/user-tag/knitting', data={'id': 'sewing circle'}).status_code, 400)
+        self.assertEqual(self.client.put('/api/user-tag/knitting', data={'id': 'Crochet'}).status_code, 200)
+        self.assertEqual(self.user_tags()[0], ['crochet', 'sewing-circle'])
+        self.assertEqual(self.client.delete('/api/user-tag/crochet').status_code, 200)
+        self.assertEqual(self.user_tags()[0], ['sewing-circle'])
+
+    def test_get_tags(self):
+        del self.statements[:]
+        tags = get_tags(['Knitting', 'nonexistent', 'GAMES', 'knitting'])
+        self.assertEqual([tag.name for tag in tags], ['knitting', 'games'])
+        # loading the cache, and looking for the name it doesn't have
+        self.assertEqual(len(self.statements), 2)
+        db.session.remove()
+        del self.statements[:]
+        tags = get_tags(['games', 'Knitting'])
+        self.assertEqual([(tag.name, tag.desc, tag.system) for tag in tags],
+                         [('games', 'Games', True), ('knitting', 'knitting', False)])
+        self.assertEqual(get_user_tag('games'), None)
+        self.assertEqual(get_user_tag('knitting').desc, 'knitting')
+        self.assertEqual(self.statements, [])
+
+    def test_create_tags(self):
+        tags = create_tags([('Games', None), ('Board Games', 'Board games'), ('knitting', 'ignored')])
+        self.assertEqual([tag.name for tag in tags], ['games', 'board-games', 'knitting'])
+        # nothing is written until the caller commits
+        db.session.rollback()
+        self.assertEqual(Tag.query.filter_by(name='board-games').first(), None)
+        create_tags([('Board Games', 'Board games')])
+        db.session.commit()
+        self.assertEqual(get_tag('board games').desc, 'Board games')
+        self.assertEqual(Tag.query.count(), 3)
+
+if __name__ == "__main__":
+    unittest.main()
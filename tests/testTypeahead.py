@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.user import User, Presenter
+from tempdatabase import TempDatabaseTestCase
+
+
+class TypeaheadTest(TempDatabaseTestCase):
+    """/api/presenters and /api/users must rank matches, limit them and see new rows"""
+
+    def setUp(self):
+        super(TypeaheadTest, self).setUp()
+        user = User()
+        user.name = 'Staff Member'
+        user.account_name = 'staffer'
+        user.openid = 'typeahead-test'
+        user.staff = True
+        db.session.add(user)
+        for name, email, phone in [('Sam Adams', 'sam@example.com', '555-0100'),
+                                   ('Samantha Jones', 'sj@example.com', '555-0101'),
+                                   ('Jim Samson', 'jim@example.com', '555-0102'),
+                                   ('Ann Balsamic', 'ann@example.com', '555-0103'),
+                                   ('Bob Smith', 'bob@samples.org', '555-0104')]:
+            presenter = Presenter(name)
+            presenter.email = email
+            presenter.phone = phone
+            db.session.add(presenter)
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['openid'] = 'typeahead-test'
+
+    def names(self, url):
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200, "GET %s failed with %s" % (url, r.status_code))
+        return [row['name'] for row in json.loads(r.data)]
+
+    def test_ranking(self):
+        # names starting with the query, then the closest words, then substrings
+        self.assertEqual(self.names('/api/presenters?q=sam'),
+                         ['Sam Adams', 'Samantha Jones', 'Bob Smith', 'Jim Samson', 'Ann Balsamic'])
+        self.assertEqual(self.names('/api/presenters?q=SAMA'), ['Samantha Jones'])
+        self.assertEqual(self.names('/api/presenters?q=0103'), ['Ann Balsamic'])
+        self.assertEqual(self.names('/api/presenters?q=zz'), [])
+        self.assertEqual(self.names('/api/presenters?q=sam&limit=2'), ['Sam Adams', 'Samantha Jones'])
+        self.assertEqual(self.names('/api/users?q=staffer'), ['Staff Member'])
+
+    def test_new_rows(self):
+        self.assertEqual(self.names('/api/presenters?q=kim'), [])
+        db.session.add(Presenter('Kim Samuels'))
+        db.session.commit()
+        self.assertEqual(self.names('/api/presenters?q=kim'), ['Kim Samuels'])
+        presenter = Presenter.query.filter_by(name='Sam Adams').first()
+        presenter.name = 'Pat Adams'
+        db.session.commit()
+        self.assertEqual(self.names('/api/presenters?q=sam'),
+                         ['Samantha Jones', 'Pat Adams', 'Bob Smith', 'Jim Samson', 'Kim Samuels', 'Ann Balsamic'])
+        db.session.add(Presenter('Sam Rolled Back'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.names('/api/presenters?q=sam r'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import re
+import unittest
+import xml.etree.ElementTree as ET
+
+import penguicontrax
+
+penguicontrax.init()
+app = penguicontrax.app
+db = penguicontrax.db
+
+from penguicontrax.serializers import XMLWriter, get_serializer
+from penguicontrax.submission import Submission, SubmissionToTags
+from penguicontrax.tag import Tag
+from tempdatabase import TempDatabaseTestCase
+
+
+class XMLTest(TempDatabaseTestCase):
+    """The streamed XML must match what ElementTree made of the whole tree"""
+
+    def test_writer(self):
+        writer = XMLWriter(pretty=True)
+        document = ''.join([writer.start('a', {'z': '1', 'b': 'say "<hi>"\n'}), writer.start('empty'), writer.end(),
+                            writer.start('b'), writer.element('c', u'1 < 2 & \xe9'), writer.element('d'),
+                            writer.end(), writer.end()])
+        self.assertEqual(document, '<a b="say &quot;&lt;hi&gt;&quot;&#10;" z="1">\n  <empty />\n  <b>\n'
+                                   '    <c>1 &lt; 2 &amp; \xc3\xa9</c>\n    <d />\n  </b>\n</a>\n')
+        self.assertEqual(ET.fromstring(document).find('b/c').text, u'1 < 2 & \xe9')
+
+    def test_report(self):
+        tag = Tag('xml', u'<XML> & \xfcnicode', True)
+        for title in [u'Fish & <Chips>', None, u'\u2603']:
+            submission = Submission()
+            submission.title = title
+            submission.description = ''
+            submission.tags.append(tag)
+            db.session.add(submission)
+        db.session.commit()
+        r = app.test_client().get('/report')
+        self.assertEqual(r.status_code, 200)
+
+        # the document /report used to build
+        root = ET.Element('penguicontrax')
+        ET.SubElement(root, 'generated').text = 'now'
+        for table, collection_name, element_name in [(Submission.__table__, 'submissions', 'submission'),
+                                                     (Tag.__table__, 'tags', 'tag'),
+                                                     (SubmissionToTags, 'SubmissionToTags', 'SubmissionToTag')]:
+            serializer = get_serializer(table)
+            serializer.xml(serializer.execute(), root, collection_name, element_name)
+        self.assertEqual(re.sub('<generated>[^<]*', '<generated>now', r.data), ET.tostring(root, encoding='utf-8'))
+
+
+if __name__ == "__main__":
+    unittest.main()